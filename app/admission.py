@@ -0,0 +1,296 @@
+"""Admission control in front of the agent.
+
+A lecture hall of headsets asking at once would otherwise start one agent
+run per question, push the LLM provider into rate limiting and slow every
+answer down together. Queries that need the agent are admitted in two
+steps: a token bucket per session and one per client address, refused with
+429 once empty, then a global cap on agent runs in flight with a bounded
+queue of waiters. A full queue, or a wait longer than the queue timeout, is
+refused at once with 503. Both refusals carry a Retry-After header so
+clients back off instead of retrying straight into the overload.
+"""
+
+import asyncio
+import math
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable, Deque, Dict, Optional, Tuple
+
+from fastapi import HTTPException
+
+from app import metrics
+from app.config import (
+    ADMISSION_MAX_CONCURRENT,
+    ADMISSION_MAX_QUEUE,
+    ADMISSION_QUEUE_TIMEOUT_SECONDS,
+    SESSION_RATE_LIMIT_PER_MINUTE,
+    SESSION_RATE_LIMIT_BURST,
+    CLIENT_RATE_LIMIT_PER_MINUTE,
+    CLIENT_RATE_LIMIT_BURST,
+    RATE_LIMIT_MAX_KEYS,
+)
+
+# Why a query was refused
+REJECT_SESSION_RATE = "session_rate"
+REJECT_CLIENT_RATE = "client_rate"
+REJECT_QUEUE_FULL = "queue_full"
+REJECT_QUEUE_TIMEOUT = "queue_timeout"
+
+# Weight of the newest run in the average slot hold time used for Retry-After
+_HOLD_TIME_SMOOTHING = 0.2
+
+
+class AdmissionRejected(HTTPException):
+    """A query refused by admission control, answered with 429 or 503 and Retry-After."""
+
+    def __init__(self, status_code: int, reason: str, retry_after: float):
+        self.reason = reason
+        self.retry_after = max(1, math.ceil(retry_after))
+        if status_code == 429:
+            detail = "Too many questions, please wait a moment."
+        else:
+            detail = "The assistant is busy, please try again shortly."
+        super().__init__(status_code=status_code, detail=detail, headers={"Retry-After": str(self.retry_after)})
+        metrics.ADMISSION_REJECTIONS.labels(reason).inc()
+
+
+class RateLimiter:
+    """
+    Token buckets keyed by session ID or client address.
+
+    Each bucket holds up to `burst` tokens and refills at `per_minute / 60`
+    tokens a second; every admitted query takes one, and a batch takes one
+    per query in a single all-or-nothing charge. Buckets are kept in
+    least recently used order and the oldest are dropped beyond `max_keys`,
+    which at worst lets a forgotten key start again with a full bucket.
+    """
+
+    def __init__(self, reason: str, per_minute: float, burst: int, max_keys: int = RATE_LIMIT_MAX_KEYS,
+                 clock: Callable[[], float] = time.monotonic):
+        self.reason = reason
+        self.rate = per_minute / 60
+        self.burst = max(1, burst)
+        self.max_keys = max_keys
+        self._clock = clock
+        # key -> (tokens, time of the last refill)
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+        self.allowed = 0
+        self.rejected = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    def acquire(self, key: str, cost: int = 1) -> None:
+        """
+        Take tokens from a key's bucket.
+
+        Args:
+            key: Session ID or client address
+            cost: Number of tokens to take, all of them or none
+
+        Raises:
+            AdmissionRejected: With status 429 if the bucket holds fewer than `cost` tokens
+        """
+        if not self.enabled:
+            return
+        now = self._clock()
+        tokens, refilled_at = self._buckets.pop(key, (float(self.burst), now))
+        tokens = min(float(self.burst), tokens + (now - refilled_at) * self.rate)
+        admitted = tokens >= cost
+        self._buckets[key] = (tokens - cost if admitted else tokens, now)
+        if len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        if not admitted:
+            self.rejected += 1
+            raise AdmissionRejected(429, self.reason, (cost - tokens) / self.rate)
+        self.allowed += cost
+
+    def reset(self) -> None:
+        """Forget all buckets."""
+        self._buckets.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get rate limiter statistics.
+
+        Returns:
+            Dictionary with the configured limit, tracked keys and query counts
+        """
+        return {
+            "enabled": self.enabled,
+            "per_minute": self.rate * 60,
+            "burst": self.burst,
+            "keys": len(self._buckets),
+            "allowed": self.allowed,
+            "rejected": self.rejected,
+        }
+
+
+class AdmissionController:
+    """
+    Caps the agent runs in flight, with a bounded queue of waiting runs.
+
+    A run that finds every slot taken waits in arrival order, for at most
+    `queue_timeout` seconds, and a finishing run hands its slot straight to
+    the oldest waiter. Once `max_queue` runs are waiting, further runs are
+    refused immediately instead of piling up behind them.
+    """
+
+    def __init__(self, max_concurrent: int = ADMISSION_MAX_CONCURRENT, max_queue: int = ADMISSION_MAX_QUEUE,
+                 queue_timeout: float = ADMISSION_QUEUE_TIMEOUT_SECONDS):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        # Futures are created on the running loop, so the controller is not tied to one event loop
+        self._waiters: Deque[asyncio.Future] = deque()
+        self.in_flight = 0
+        self.admitted = 0
+        self.rejected = 0
+        self._hold_seconds = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_concurrent > 0
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    def _retry_after(self) -> float:
+        """Estimate when a slot frees up for a new arrival, from the average run time."""
+        return self._hold_seconds * (self.waiting + 1) / max(1, self.max_concurrent)
+
+    def _reject(self, reason: str) -> AdmissionRejected:
+        self.rejected += 1
+        return AdmissionRejected(503, reason, self._retry_after())
+
+    def _set_gauges(self) -> None:
+        metrics.ADMISSION_IN_FLIGHT.labels().set(self.in_flight)
+        metrics.ADMISSION_QUEUE_DEPTH.labels().set(self.waiting)
+
+    def _release(self) -> None:
+        """Hand the slot to the oldest waiter, or free it."""
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.in_flight -= 1
+
+    async def _acquire(self, timeout: float) -> bool:
+        """Wait for a slot; False if the timeout passed first."""
+        if self.in_flight < self.max_concurrent and not self._waiters:
+            self.in_flight += 1
+            return True
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self._set_gauges()
+        try:
+            await asyncio.wait_for(waiter, timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        except BaseException:
+            # A slot handed over just as the caller was cancelled goes to the next waiter
+            if waiter.done() and not waiter.cancelled():
+                self._release()
+            raise
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+
+    def check_capacity(self) -> None:
+        """
+        Refuse early when a run would find the queue full.
+
+        Raises:
+            AdmissionRejected: With status 503 if the queue is full
+        """
+        if self.enabled and self.in_flight >= self.max_concurrent and self.waiting >= self.max_queue:
+            raise self._reject(REJECT_QUEUE_FULL)
+
+    @asynccontextmanager
+    async def slot(self, max_wait: Optional[float] = None) -> AsyncIterator[bool]:
+        """
+        Hold a slot for an agent run for the duration of the block.
+
+        Args:
+            max_wait: Seconds left in the query's own latency budget, if any
+
+        Yields:
+            True once a slot is held, or False if the latency budget ran out
+            in the queue, so the caller can fall back instead of refusing
+
+        Raises:
+            AdmissionRejected: With status 503 if the queue is full or the
+                wait reaches the queue timeout
+        """
+        if not self.enabled:
+            yield True
+            return
+        self.check_capacity()
+        budget_bound = max_wait is not None and max_wait < self.queue_timeout
+        started = time.perf_counter()
+        acquired = await self._acquire(max_wait if budget_bound else self.queue_timeout)
+        admitted_at = time.perf_counter()
+        metrics.ADMISSION_WAIT.labels().observe(admitted_at - started)
+        if not acquired:
+            self._set_gauges()
+            if budget_bound:
+                yield False
+                return
+            raise self._reject(REJECT_QUEUE_TIMEOUT)
+        self.admitted += 1
+        self._set_gauges()
+        try:
+            yield True
+        finally:
+            self._release()
+            self._set_gauges()
+            held = time.perf_counter() - admitted_at
+            self._hold_seconds += _HOLD_TIME_SMOOTHING * (held - self._hold_seconds)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get admission statistics.
+
+        Returns:
+            Dictionary with the configured limits, runs in flight and waiting,
+            admitted and rejected counts, and the average run time
+        """
+        return {
+            "enabled": self.enabled,
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+            "queue_timeout_seconds": self.queue_timeout,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "average_run_seconds": round(self._hold_seconds, 4),
+        }
+
+
+# Global limits applied to queries that need the agent
+session_rate_limiter = RateLimiter(REJECT_SESSION_RATE, SESSION_RATE_LIMIT_PER_MINUTE, SESSION_RATE_LIMIT_BURST)
+client_rate_limiter = RateLimiter(REJECT_CLIENT_RATE, CLIENT_RATE_LIMIT_PER_MINUTE, CLIENT_RATE_LIMIT_BURST)
+llm_admission = AdmissionController()
+
+
+def check_rate_limits(session_id: str, client: Optional[str], cost: int = 1) -> None:
+    """
+    Take tokens for queries from their session's and their client's buckets.
+
+    Args:
+        session_id: The VR session asking
+        client: The client address, or None when not known
+        cost: Number of queries to charge
+
+    Raises:
+        AdmissionRejected: With status 429 if either bucket holds too few tokens
+    """
+    session_rate_limiter.acquire(session_id, cost)
+    if client is not None:
+        client_rate_limiter.acquire(client, cost)
@@ -1,47 +1,171 @@
-"""LangChain agent setup and execution."""
+"""LangChain agent setup and execution.
+
+The OpenAI client and the AgentExecutor are imported inside `create_agent`,
+since importing them takes longer than the rest of the app combined.
+"""
+
+from typing import TYPE_CHECKING, Any, AsyncIterator, Dict, List, Literal, Optional, Type, Union
 
-from langchain_openai import ChatOpenAI
-from langchain.agents import AgentExecutor, create_openai_tools_agent
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+from langchain_core.tools import BaseTool
+from pydantic import BaseModel, Field, create_model
 
-from app.config import LLM_MODEL, LLM_TEMPERATURE
+from app.config import OPENAI_API_KEY, LLM_MODEL, LLM_TEMPERATURE, LLM_BASE_URL, AGENT_ENGINE, AGENT_VERBOSE
+from app.http_client import llm_http_client, llm_timeout
+from app.logs import agent_trace_logger
+from app.metrics import agent_metrics
+from app.prompts import SYSTEM_PROMPT, STRUCTURED_OUTPUT_INSTRUCTIONS, prompt_cache_stats
 from app.tools import get_all_tools
 
+if TYPE_CHECKING:
+    from langchain.agents import AgentExecutor
+    from langchain_openai import ChatOpenAI
+
+ENGINE_EXECUTOR = "executor"
+ENGINE_STRUCTURED = "structured"
+
 
-def create_agent() -> AgentExecutor:
+def build_action_schema(tools: List[BaseTool]) -> Type[BaseModel]:
+    """
+    Build the structured output schema for an answer and its tool actions.
+    
+    Each action variant combines a tool's argument schema with a `tool`
+    discriminator, so the schema stays in sync with `get_all_tools()`.
+    
+    Args:
+        tools: The tools the model may request
+        
+    Returns:
+        Pydantic model with `answer` and `actions` fields
+    """
+    action_models = tuple(
+        create_model(f"{tool.name}_action", __base__=tool.args_schema, tool=(Literal[tool.name], ...))
+        for tool in tools
+    )
+    action_type = Union[action_models] if len(action_models) > 1 else action_models[0]
+    return create_model(
+        "StructuredAnswer",
+        answer=(str, Field(..., description="The spoken answer to the user's question.")),
+        actions=(List[action_type], Field(default_factory=list, description="VR actions to perform.")),
+    )
+
+
+class StructuredOutputEngine:
+    """
+    Answers a query with one model call that returns the text and the actions together.
+    
+    The requested tools are validated against their schemas and executed
+    locally; their outputs are never sent back to the model. Results use the
+    same shape as AgentExecutor so the routes can use either engine.
+    """
+
+    def __init__(self, llm: "ChatOpenAI", tools: List[BaseTool], prompt: ChatPromptTemplate):
+        self.tools = {tool.name: tool for tool in tools}
+        self.schema = build_action_schema(tools)
+        self.chain = prompt | llm.with_structured_output(self.schema)
+
+    async def ainvoke(self, inputs: Dict[str, Any], config: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Answer a query.
+        
+        Args:
+            inputs: Prompt variables (input, organ_context and chat_history)
+            config: Optional runnable config, e.g. callbacks
+            
+        Returns:
+            Dictionary with the answer in "output" and (tool name, action) pairs
+            in "intermediate_steps"
+        """
+        answer = await self.chain.ainvoke(inputs, config=config)
+        steps = []
+        for action in answer.actions:
+            tool = self.tools[action.tool]
+            steps.append((action.tool, await tool.ainvoke(action.model_dump(exclude={"tool"}))))
+        return {"output": answer.answer, "intermediate_steps": steps}
+
+    async def astream_events(self, inputs: Dict[str, Any], version: str = "v2", **kwargs) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Run the engine and report its result in the AgentExecutor event format.
+        
+        The single model call returns the answer and actions together, so
+        events are emitted once it completes.
+        
+        Args:
+            inputs: Prompt variables (input, organ_context and chat_history)
+            version: Event schema version; only "v2" is produced
+            
+        Yields:
+            on_tool_end events for each action and a final on_chain_end event
+        """
+        result = await self.ainvoke(inputs, config=kwargs.get("config"))
+        for tool_name, output in result["intermediate_steps"]:
+            yield {"event": "on_tool_end", "name": tool_name, "data": {"output": output}}
+        yield {"event": "on_chain_end", "name": "StructuredOutputEngine", "parent_ids": [], "data": {"output": result}}
+
+
+def create_agent(engine: str = AGENT_ENGINE, model: str = LLM_MODEL) -> Union["AgentExecutor", StructuredOutputEngine]:
     """
     Create and configure the LangChain agent.
     
+    Args:
+        engine: "executor" for the tool-calling AgentExecutor loop, or
+            "structured" for the single-call structured output engine
+        model: The OpenAI model to answer with
+    
     Returns:
-        Configured AgentExecutor instance
+        Configured AgentExecutor or StructuredOutputEngine instance
+    
+    Raises:
+        ValueError: If OPENAI_API_KEY is not set or the engine is unknown
     """
-    # Get all available tools
-    tools = get_all_tools()
+    if not OPENAI_API_KEY:
+        raise ValueError("OPENAI_API_KEY not found. Please set it in your .env file.")
+    
+    from langchain_openai import ChatOpenAI
     
-    # Initialize the OpenAI model
-    llm = ChatOpenAI(model=LLM_MODEL, temperature=LLM_TEMPERATURE)
+    # Get all available tools, reporting their executions to the metrics and trace log
+    callbacks = [agent_metrics, agent_trace_logger]
+    tools = [tool.model_copy(update={"callbacks": callbacks}) for tool in get_all_tools()]
+    
+    # Initialize the OpenAI model on the shared connection pool; retries are
+    # done by its transport, so the OpenAI client's own retries are disabled
+    llm = ChatOpenAI(
+        model=model,
+        temperature=LLM_TEMPERATURE,
+        base_url=LLM_BASE_URL,
+        http_async_client=llm_http_client.get(),
+        timeout=llm_timeout(),
+        max_retries=0,
+        stream_usage=True,
+        callbacks=[prompt_cache_stats, *callbacks]
+    )
+
+    # The static system prompt and the held organ's facts come first so that
+    # they form a stable, cacheable prefix; history and the query vary per call
+    if engine == ENGINE_STRUCTURED:
+        prompt = ChatPromptTemplate.from_messages([
+            ("system", SYSTEM_PROMPT + STRUCTURED_OUTPUT_INSTRUCTIONS),
+            ("system", "{organ_context}"),
+            MessagesPlaceholder(variable_name="chat_history"),
+            ("human", "{input}"),
+        ])
+        return StructuredOutputEngine(llm, tools, prompt)
+    if engine != ENGINE_EXECUTOR:
+        raise ValueError(f"Unknown AGENT_ENGINE '{engine}'. Expected 'executor' or 'structured'.")
     
     # Create the prompt template
     prompt = ChatPromptTemplate.from_messages([
-        ("system", """
-        You are an expert anatomy AI assistant for a medical training VR simulation.
-        Your role is to answer user questions about human organs and to trigger helpful actions in the VR scene.
-
-        You will receive the user's spoken question and the ID of the organ they are currently holding.
-
-        Your task is to:
-        1.  Provide a clear and concise answer to the user's question. This answer will be used for both display text and text-to-speech in the VR app.
-        2.  If the question is about location (e.g., "where does this go?"), you MUST use the `highlight_object` tool to highlight the correct anatomical socket for the held organ.
-        3.  You can use other tools, like `play_sound`, to provide additional feedback.
-        4.  Formulate a final response that includes the text answer and a list of all tool-generated actions.
-        """),
+        ("system", SYSTEM_PROMPT),
+        ("system", "{organ_context}"),
         MessagesPlaceholder(variable_name="chat_history"),
         ("human", "{input}"),
         MessagesPlaceholder(variable_name="agent_scratchpad"),
     ])
     
+    from langchain.agents import AgentExecutor, create_openai_tools_agent
+    
     # Create the agent
     agent = create_openai_tools_agent(llm, tools, prompt)
-    agent_executor = AgentExecutor(agent=agent, tools=tools, verbose=True)
+    agent_executor = AgentExecutor(agent=agent, tools=tools, verbose=AGENT_VERBOSE, callbacks=[agent_trace_logger])
     
     return agent_executor
@@ -0,0 +1,399 @@
+"""Pre-generated answers to the curriculum's canonical questions.
+
+Every session asks the same handful of questions about each organ: what it
+does, what it sits next to, why it matters. Rather than running the agent
+for each of them live, a build job asks them once, ahead of time, and
+writes the answers and their VR actions to a compact JSON artifact:
+
+    python -m app.answer_pack --output app/data/answer_pack.json
+
+The server loads the artifact once and serves matching queries from an
+in-memory dict keyed by organ and normalized query. The artifact records the
+knowledge base and prompt versions it was built from; if either no longer
+matches, the pack is not served until it is rebuilt. The prompt version
+covers everything else that shapes an answer: the model, the agent engine
+and its system prompt, the organ block template and the retrieval corpus.
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.cache import is_follow_up, normalize_cache_query
+from app.config import AGENT_ENGINE, ANSWER_PACK_PATH, ANSWER_PACK_ENABLED, LLM_MODEL
+from app.intent import classify_intent
+from app.knowledge_base import KnowledgeIndex, knowledge_base
+from app.models import VRQueryResponse
+from app.prompts import (
+    ORGAN_BLOCK_TEMPLATE,
+    STRUCTURED_OUTPUT_INSTRUCTIONS,
+    SYSTEM_PROMPT,
+    build_query_block,
+    get_organ_prompt_block,
+)
+from app.retrieval import passage_retriever, retrieve_passages
+
+logger = logging.getLogger(__name__)
+
+# Bumped when the artifact layout changes
+FORMAT_VERSION = 1
+
+# Canonical questions by topic. The first phrasing is sent to the agent and
+# every phrasing serves its answer; "{name}" is the organ's display name.
+CANONICAL_QUESTIONS: Dict[str, Tuple[str, ...]] = {
+    "function": (
+        "What does the {name} do?",
+        "What does this do?",
+        "What is the function of the {name}?",
+        "What is its function?",
+        "What is this organ for?",
+        "What is the {name} for?",
+    ),
+    "neighbours": (
+        "Which organs are next to the {name}?",
+        "What is next to this?",
+        "Which organs are near this?",
+        "What organs surround the {name}?",
+    ),
+    "importance": (
+        "Why is the {name} important?",
+        "Why is this important?",
+        "Why do we need the {name}?",
+    ),
+    "structure": (
+        "What is the {name} made of?",
+        "What is this made of?",
+    ),
+}
+
+PackKey = Tuple[str, str]
+
+
+def prompt_version(engine: str = AGENT_ENGINE) -> str:
+    """
+    Hash of what the agent answers with, besides the knowledge base.
+
+    Args:
+        engine: The agent engine answering, as passed to `create_agent`
+
+    Returns:
+        Hash of the model, engine, system prompt, organ block template and retrieval corpus version
+    """
+    system_prompt = SYSTEM_PROMPT + STRUCTURED_OUTPUT_INSTRUCTIONS if engine == "structured" else SYSTEM_PROMPT
+    parts = (LLM_MODEL, engine, system_prompt, ORGAN_BLOCK_TEMPLATE, passage_retriever.version)
+    return hashlib.sha256("\n".join(parts).encode()).hexdigest()[:16]
+
+
+def canonical_questions(organ_id: str, organ_info: Dict[str, Any]) -> Dict[str, List[str]]:
+    """
+    Get the phrasings of each canonical question for an organ.
+
+    Phrasings that the fast path already answers, or that read as follow-ups
+    and so bypass the pack, are left out.
+
+    Args:
+        organ_id: The unique identifier of the organ
+        organ_info: Knowledge base entry for the organ
+
+    Returns:
+        Topic to phrasings, the one sent to the agent first
+    """
+    name = organ_info["displayName"].lower()
+    questions = {}
+    for topic, templates in CANONICAL_QUESTIONS.items():
+        phrasings = [template.format(name=name) for template in templates]
+        phrasings = [
+            query for query in phrasings
+            if classify_intent(query, organ_id, organ_info) is None and not is_follow_up(query)
+        ]
+        if phrasings:
+            questions[topic] = phrasings
+    return questions
+
+
+class AnswerPack:
+    """An immutable set of pre-generated answers indexed by organ and normalized query."""
+
+    def __init__(self, answers: Dict[PackKey, VRQueryResponse], knowledge_base_version: str, prompt_version: str,
+                 model: Optional[str] = None, engine: Optional[str] = None, generated_at: Optional[str] = None):
+        self.answers = answers
+        self.knowledge_base_version = knowledge_base_version
+        self.prompt_version = prompt_version
+        self.model = model
+        self.engine = engine
+        self.generated_at = generated_at
+
+    def get(self, organ_id: str, query: str) -> Optional[VRQueryResponse]:
+        """
+        Look up the answer to a query about a held organ.
+
+        Args:
+            organ_id: The unique identifier of the held organ
+            query: The user's query
+
+        Returns:
+            The pre-generated response, or None if the query is not in the pack
+        """
+        return self.answers.get((organ_id, normalize_cache_query(query)))
+
+    @classmethod
+    def from_file(cls, path: str) -> "AnswerPack":
+        """
+        Load an answer pack artifact.
+
+        Args:
+            path: Path to the JSON artifact
+
+        Returns:
+            The loaded pack
+
+        Raises:
+            ValueError: If the artifact has an unsupported format
+        """
+        with open(path, "rb") as f:
+            data = json.loads(f.read())
+        if data.get("format") != FORMAT_VERSION:
+            raise ValueError(f"Unsupported answer pack format {data.get('format')!r} in {path}")
+        responses = [VRQueryResponse(**answer) for answer in data["answers"]]
+        answers = {
+            (organ_id, query): responses[answer_index]
+            for organ_id, queries in data["questions"].items()
+            for query, answer_index in queries.items()
+        }
+        return cls(answers, data["knowledge_base_version"], data["prompt_version"],
+                   model=data.get("model"), engine=data.get("engine"), generated_at=data.get("generated_at"))
+
+    def write(self, path: str) -> None:
+        """
+        Write the pack as a compact JSON artifact, replacing any existing file atomically.
+
+        Args:
+            path: Destination path
+        """
+        # Phrasings of one question share a single stored answer
+        answers: List[Dict[str, Any]] = []
+        answer_indexes: Dict[int, int] = {}
+        questions: Dict[str, Dict[str, int]] = {}
+        for (organ_id, query), response in self.answers.items():
+            index = answer_indexes.get(id(response))
+            if index is None:
+                index = answer_indexes[id(response)] = len(answers)
+                answers.append(response.model_dump())
+            questions.setdefault(organ_id, {})[query] = index
+        data = {
+            "format": FORMAT_VERSION,
+            "knowledge_base_version": self.knowledge_base_version,
+            "prompt_version": self.prompt_version,
+            "model": self.model,
+            "engine": self.engine,
+            "generated_at": self.generated_at,
+            "answers": answers,
+            "questions": questions,
+        }
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(data, f, separators=(",", ":"))
+        os.replace(temp_path, path)
+
+    def __len__(self) -> int:
+        return len(self.answers)
+
+
+class AnswerPackStore:
+    """
+    The answer pack the server serves from, loaded once on first use.
+
+    A pack built from a different knowledge base or prompt version is not
+    served. After a knowledge base reload the artifact is read again, so a
+    pack rebuilt alongside the new knowledge base is picked up.
+    """
+
+    def __init__(self, path: str = ANSWER_PACK_PATH, enabled: bool = ANSWER_PACK_ENABLED):
+        self.path = path
+        self.enabled = enabled
+        self._pack: Optional[AnswerPack] = None
+        self._loaded = False
+        self._load_lock = threading.Lock()
+        self.status = "not_loaded"
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def pack(self) -> Optional[AnswerPack]:
+        """The current pack, or None if there is none to serve."""
+        if not self._loaded:
+            self.load()
+        pack = self._pack
+        if pack is not None and pack.knowledge_base_version != knowledge_base.version:
+            # The knowledge base changed before its reload listener re-read the artifact
+            self.status = "stale_knowledge_base"
+            return None
+        return pack
+
+    def load(self) -> bool:
+        """
+        Read the artifact and check it against the current versions.
+
+        Returns:
+            True if a pack is being served
+        """
+        with self._load_lock:
+            self._pack, self.status = self._read()
+            self._loaded = True
+        if self._pack is not None:
+            logger.info("Answer pack loaded: %d queries", len(self._pack),
+                        extra={"answer_pack_queries": len(self._pack)})
+        elif self.status not in ("disabled", "missing"):
+            logger.warning("Answer pack not served: %s", self.status)
+        return self._pack is not None
+
+    def _read(self) -> Tuple[Optional[AnswerPack], str]:
+        if not self.enabled:
+            return None, "disabled"
+        if not os.path.exists(self.path):
+            return None, "missing"
+        try:
+            pack = AnswerPack.from_file(self.path)
+        except (OSError, ValueError, KeyError, IndexError) as exc:
+            return None, f"invalid: {exc}"
+        if pack.knowledge_base_version != knowledge_base.version:
+            return None, "stale_knowledge_base"
+        if pack.prompt_version != prompt_version():
+            return None, "stale_prompt"
+        return pack, "loaded"
+
+    def get(self, organ_id: str, query: str) -> Optional[VRQueryResponse]:
+        """
+        Look up a pre-generated answer.
+
+        Args:
+            organ_id: The unique identifier of the held organ
+            query: The user's query
+
+        Returns:
+            The response, or None on a miss or without a usable pack
+        """
+        pack = self.pack
+        if pack is None:
+            return None
+        response = pack.get(organ_id, query)
+        if response is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return response
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get answer pack statistics.
+
+        Returns:
+            Dictionary with the load status, the versions the pack was built
+            from, its number of queries, and lookup hits and misses
+        """
+        pack = self.pack
+        return {
+            "status": self.status,
+            "path": self.path,
+            "queries": len(pack) if pack is not None else 0,
+            "knowledge_base_version": pack.knowledge_base_version if pack is not None else None,
+            "model": pack.model if pack is not None else None,
+            "engine": pack.engine if pack is not None else None,
+            "generated_at": pack.generated_at if pack is not None else None,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+    def _on_knowledge_base_reload(self, index: KnowledgeIndex) -> None:
+        if self._loaded:
+            self.load()
+
+
+# Global answer pack, served by the query routes
+answer_pack = AnswerPackStore()
+
+knowledge_base.add_reload_listener(answer_pack._on_knowledge_base_reload)
+
+
+async def generate_pack(agent: Any = None, organ_ids: Optional[List[str]] = None, concurrency: int = 4,
+                        engine: str = AGENT_ENGINE) -> AnswerPack:
+    """
+    Ask the agent every canonical question and collect the answers.
+
+    Args:
+        agent: The agent to ask; by default one is created for `engine`
+        organ_ids: Organs to cover; all organs in the knowledge base by default
+        concurrency: Questions asked at the same time
+        engine: The agent engine answering, which the pack is versioned with
+
+    Returns:
+        The generated pack, versioned with the current knowledge base and prompt
+    """
+    if agent is None:
+        from app.agent import create_agent
+        agent = create_agent(engine)
+    index = knowledge_base.index
+    semaphore = asyncio.Semaphore(concurrency)
+    answers: Dict[PackKey, VRQueryResponse] = {}
+
+    async def answer(organ_id: str, organ_info: Dict[str, Any], phrasings: List[str]) -> None:
+        query = phrasings[0]
+        async with semaphore:
+            result = await agent.ainvoke({
+                "input": build_query_block(query, retrieve_passages(query, organ_id, organ_info)),
+                "organ_context": get_organ_prompt_block(organ_id, organ_info),
+                "chat_history": [],
+            })
+        text = result.get("output", "")
+        response = VRQueryResponse(
+            displayText=text,
+            spokenResponse=text,
+            actions=[step[1] for step in result.get("intermediate_steps", [])],
+        )
+        for phrasing in phrasings:
+            answers[(organ_id, normalize_cache_query(phrasing))] = response
+
+    await asyncio.gather(*(
+        answer(organ_id, index.organs[organ_id], phrasings)
+        for organ_id in (organ_ids or list(index.organs))
+        for phrasings in canonical_questions(organ_id, index.organs[organ_id]).values()
+    ))
+    return AnswerPack(answers, index.version, prompt_version(engine), model=LLM_MODEL, engine=engine,
+                      generated_at=datetime.now(timezone.utc).isoformat())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-generate answers to the canonical questions about each organ.")
+    parser.add_argument("--output", default=ANSWER_PACK_PATH, help="artifact path (default: ANSWER_PACK_PATH)")
+    parser.add_argument("--organ", action="append", dest="organs", help="organ to cover; repeat for several (default: all)")
+    parser.add_argument("--concurrency", type=int, default=4, help="questions asked at the same time")
+    parser.add_argument("--engine", choices=("executor", "structured"), default=AGENT_ENGINE,
+                        help="agent engine to answer with; must match the server's (default: AGENT_ENGINE)")
+    args = parser.parse_args()
+
+    from app.http_client import llm_http_client
+
+    async def build() -> AnswerPack:
+        try:
+            return await generate_pack(organ_ids=args.organs, concurrency=args.concurrency, engine=args.engine)
+        finally:
+            await llm_http_client.aclose()
+
+    started = time.perf_counter()
+    pack = asyncio.run(build())
+    pack.write(args.output)
+    print(f"{len(pack)} queries for knowledge base {pack.knowledge_base_version} written to {args.output} "
+          f"in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
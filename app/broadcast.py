@@ -0,0 +1,247 @@
+"""In-process pub/sub for classroom broadcast groups.
+
+In an instructor-led session every headset in the room should see the
+teacher's question answered and its organs highlighted. Rather than every
+headset sending the same query, headsets subscribe to a named group over
+their session WebSocket; a query asked for the group runs through the agent
+once, and its response is published to every subscriber.
+
+A published message is encoded once and the same string is queued for
+every subscriber, so fan-out costs one queue append per subscriber. Each
+subscriber's queue is bounded and drops its oldest message when full: a
+headset that stops reading loses old messages instead of holding memory or
+slowing the publisher and the rest of the room. Messages carry a per-group
+sequence number so a client can tell when it missed some.
+"""
+
+import asyncio
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Set
+
+import pydantic_core
+
+from app import metrics
+from app.config import BROADCAST_QUEUE_SIZE, BROADCAST_MAX_SUBSCRIBERS, BROADCAST_MAX_GROUPS
+
+
+class Subscription:
+    """A subscriber's bounded queue of encoded messages, dropping the oldest when full."""
+
+    def __init__(self, group: "BroadcastGroup", session_id: str, queue_size: int = BROADCAST_QUEUE_SIZE):
+        self.group = group
+        self.session_id = session_id
+        self._queue: Deque[str] = deque(maxlen=max(1, queue_size))
+        # Created on first wait, so the subscription is not tied to one event loop
+        self._ready: Optional[asyncio.Event] = None
+        self.closed = False
+        self.delivered = 0
+        self.dropped = 0
+
+    def put(self, message: str) -> None:
+        """
+        Queue a message without waiting.
+
+        Args:
+            message: The encoded message
+        """
+        if self.closed:
+            return
+        if len(self._queue) == self._queue.maxlen:
+            self.dropped += 1
+            metrics.BROADCAST_DROPPED.labels().inc()
+        self._queue.append(message)
+        self.delivered += 1
+        if self._ready is not None:
+            self._ready.set()
+
+    async def get(self) -> Optional[str]:
+        """
+        Wait for the next message.
+
+        Returns:
+            The oldest queued message, or None once the subscription is closed
+        """
+        while not self._queue:
+            if self.closed:
+                return None
+            if self._ready is None:
+                self._ready = asyncio.Event()
+            self._ready.clear()
+            await self._ready.wait()
+        return self._queue.popleft()
+
+    def close(self) -> None:
+        """Stop the subscription and wake its reader."""
+        self.closed = True
+        self._queue.clear()
+        if self._ready is not None:
+            self._ready.set()
+
+    async def run(self, send: Callable[[str], Awaitable[None]]) -> None:
+        """
+        Forward queued messages to the subscriber until the subscription is closed.
+
+        Args:
+            send: Sends one encoded message to the subscriber
+        """
+        while True:
+            message = await self.get()
+            if message is None:
+                return
+            await send(message)
+
+    @property
+    def pending(self) -> int:
+        return len(self._queue)
+
+
+class BroadcastGroup:
+    """A named group of subscribed connections that receive every published message."""
+
+    def __init__(self, group_id: str):
+        self.group_id = group_id
+        self._subscribers: Set[Subscription] = set()
+        self.sequence = 0
+
+    @property
+    def members(self) -> Set[str]:
+        """Sessions with at least one subscribed connection."""
+        return {subscription.session_id for subscription in self._subscribers}
+
+    def __len__(self) -> int:
+        return len(self._subscribers)
+
+    def publish(self, message_type: str, **fields: Any) -> int:
+        """
+        Encode a message once and queue it for every subscriber.
+
+        Args:
+            message_type: Value of the message's "type" field
+            **fields: Additional message fields; models are encoded as JSON objects
+
+        Returns:
+            Number of subscribers the message was queued for
+        """
+        self.sequence += 1
+        message: Dict[str, Any] = {"type": message_type, "groupID": self.group_id, "seq": self.sequence}
+        message.update({key: value for key, value in fields.items() if value is not None})
+        encoded = pydantic_core.to_json(message).decode()
+        for subscription in self._subscribers:
+            subscription.put(encoded)
+        metrics.BROADCAST_MESSAGES.labels().inc()
+        metrics.BROADCAST_DELIVERIES.labels().inc(len(self._subscribers))
+        return len(self._subscribers)
+
+
+class GroupRegistry:
+    """
+    The broadcast groups of this process and their subscriptions.
+
+    Groups are created by their first subscriber and removed with their
+    last, so only groups in use hold memory.
+    """
+
+    def __init__(self, queue_size: int = BROADCAST_QUEUE_SIZE, max_subscribers: int = BROADCAST_MAX_SUBSCRIBERS,
+                 max_groups: int = BROADCAST_MAX_GROUPS):
+        self.queue_size = queue_size
+        self.max_subscribers = max_subscribers
+        self.max_groups = max_groups
+        self._groups: Dict[str, BroadcastGroup] = {}
+        self.refused = 0
+
+    def subscribe(self, group_id: str, session_id: str) -> Optional[Subscription]:
+        """
+        Subscribe a connection to a group, creating the group if needed.
+
+        Args:
+            group_id: The group to join
+            session_id: The session of the subscribing connection
+
+        Returns:
+            The subscription, or None if the group or the registry is full
+        """
+        group = self._groups.get(group_id)
+        if group is None:
+            if len(self._groups) >= self.max_groups:
+                self.refused += 1
+                return None
+            group = self._groups[group_id] = BroadcastGroup(group_id)
+        elif len(group) >= self.max_subscribers:
+            self.refused += 1
+            return None
+        subscription = Subscription(group, session_id, self.queue_size)
+        group._subscribers.add(subscription)
+        self._set_gauges()
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        """
+        Close a subscription and remove its group once empty.
+
+        Args:
+            subscription: The subscription to end
+        """
+        subscription.close()
+        group = subscription.group
+        group._subscribers.discard(subscription)
+        if not group and self._groups.get(group.group_id) is group:
+            del self._groups[group.group_id]
+        self._set_gauges()
+
+    def get(self, group_id: str) -> Optional[BroadcastGroup]:
+        """
+        Look up a group.
+
+        Args:
+            group_id: The group identifier
+
+        Returns:
+            The group, or None if nobody is subscribed to it
+        """
+        return self._groups.get(group_id)
+
+    def publish(self, group_id: str, message_type: str, **fields: Any) -> int:
+        """
+        Publish a message to a group.
+
+        Args:
+            group_id: The group identifier
+            message_type: Value of the message's "type" field
+            **fields: Additional message fields
+
+        Returns:
+            Number of subscribers the message was queued for; 0 if the group has none
+        """
+        group = self._groups.get(group_id)
+        return group.publish(message_type, **fields) if group is not None else 0
+
+    def _set_gauges(self) -> None:
+        metrics.BROADCAST_GROUPS.labels().set(len(self._groups))
+        metrics.BROADCAST_SUBSCRIBERS.labels().set(sum(len(group) for group in self._groups.values()))
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get broadcast statistics.
+
+        Returns:
+            Dictionary with the limits, refused joins and, per group, its
+            members, subscribers, messages published, and messages queued,
+            dropped and pending across its subscribers
+        """
+        return {
+            "queue_size": self.queue_size,
+            "max_subscribers": self.max_subscribers,
+            "max_groups": self.max_groups,
+            "refused": self.refused,
+            "groups": {
+                group_id: {
+                    "members": len(group.members),
+                    "subscribers": len(group),
+                    "published": group.sequence,
+                    "delivered": sum(subscription.delivered for subscription in group._subscribers),
+                    "dropped": sum(subscription.dropped for subscription in group._subscribers),
+                    "pending": sum(subscription.pending for subscription in group._subscribers),
+                }
+                for group_id, group in self._groups.items()
+            },
+        }
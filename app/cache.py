@@ -0,0 +1,202 @@
+"""In-process response cache for agent answers."""
+
+import re
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from app.config import (
+    RESPONSE_CACHE_ENABLED,
+    RESPONSE_CACHE_MAX_ENTRIES,
+    RESPONSE_CACHE_TTL_SECONDS,
+    RESPONSE_CACHE_MAX_BYTES,
+)
+from app.intent import normalize_query
+from app.knowledge_base import knowledge_base
+from app.models import VRQueryResponse
+
+# Filler words that do not change the meaning of a question
+_FILLER_WORDS = {
+    "um", "uh", "erm", "hmm", "like", "please", "just", "actually", "basically",
+    "so", "well", "okay", "ok", "hey", "exactly", "really",
+}
+
+# Phrases that refer back to earlier turns, so the answer depends on session history
+_FOLLOW_UP_PATTERN = re.compile(
+    r"\b(?:again|more|else|also|another|other|previous|previously|earlier|before|"
+    r"last|you said|you mentioned|what about|how about|and what|and how|and why|"
+    r"instead|same|those|them|they|compared)\b"
+)
+
+CacheKey = Tuple[str, str]
+
+
+def normalize_cache_query(query: str) -> str:
+    """
+    Normalize a query for use in a cache key.
+
+    Args:
+        query: The raw user query
+
+    Returns:
+        Query with case, punctuation and filler words removed
+    """
+    words = normalize_query(query).split()
+    return " ".join(word for word in words if word not in _FILLER_WORDS)
+
+
+def is_follow_up(query: str) -> bool:
+    """
+    Check whether a query refers back to earlier turns in the conversation.
+
+    Args:
+        query: The raw user query
+
+    Returns:
+        True if the answer may depend on session history
+    """
+    return _FOLLOW_UP_PATTERN.search(normalize_query(query)) is not None
+
+
+class _CacheEntry:
+    """A cached response with its expiry time and approximate size."""
+
+    __slots__ = ("response", "expires_at", "size")
+
+    def __init__(self, response: VRQueryResponse, expires_at: float, size: int):
+        self.response = response
+        self.expires_at = expires_at
+        self.size = size
+
+
+class ResponseCache:
+    """LRU cache of agent responses with TTL expiry and a memory cap."""
+
+    def __init__(
+        self,
+        max_entries: int = RESPONSE_CACHE_MAX_ENTRIES,
+        ttl_seconds: float = RESPONSE_CACHE_TTL_SECONDS,
+        max_bytes: int = RESPONSE_CACHE_MAX_BYTES,
+        enabled: bool = RESPONSE_CACHE_ENABLED,
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self._entries: "OrderedDict[CacheKey, _CacheEntry]" = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @staticmethod
+    def make_key(organ_id: str, query: str) -> CacheKey:
+        """
+        Build the cache key for a query about a held organ.
+
+        Args:
+            organ_id: The unique identifier of the held organ
+            query: The user's query
+
+        Returns:
+            Tuple of organ ID and normalized query
+        """
+        return organ_id, normalize_cache_query(query)
+
+    def get(self, organ_id: str, query: str) -> Optional[VRQueryResponse]:
+        """
+        Look up a cached response.
+
+        Args:
+            organ_id: The unique identifier of the held organ
+            query: The user's query
+
+        Returns:
+            The cached response, or None on a miss
+        """
+        if not self.enabled:
+            return None
+        key = self.make_key(organ_id, query)
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        if entry.expires_at <= time.monotonic():
+            self._remove(key)
+            self.expirations += 1
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry.response
+
+    def contains(self, organ_id: str, query: str) -> bool:
+        """
+        Check for a live cached response without counting a lookup.
+
+        Args:
+            organ_id: The unique identifier of the held organ
+            query: The user's query
+
+        Returns:
+            True if a get would hit
+        """
+        entry = self._entries.get(self.make_key(organ_id, query)) if self.enabled else None
+        return entry is not None and entry.expires_at > time.monotonic()
+
+    def put(self, organ_id: str, query: str, response: VRQueryResponse) -> None:
+        """
+        Store a response, evicting least recently used entries as needed.
+
+        Args:
+            organ_id: The unique identifier of the held organ
+            query: The user's query
+            response: The complete response to cache
+        """
+        if not self.enabled:
+            return
+        key = self.make_key(organ_id, query)
+        size = len(response.model_dump_json()) + len(key[0]) + len(key[1])
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = _CacheEntry(response, time.monotonic() + self.ttl_seconds, size)
+        self._bytes += size
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def clear(self) -> None:
+        """Remove all cached responses."""
+        self._entries.clear()
+        self._bytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Get cache statistics.
+
+        Returns:
+            Dictionary of hit, miss and eviction counters and current size
+        """
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+    def _remove(self, key: CacheKey) -> None:
+        entry = self._entries.pop(key)
+        self._bytes -= entry.size
+
+
+# Global response cache instance
+response_cache = ResponseCache()
+
+# Cached answers were generated from the previous knowledge base content
+knowledge_base.add_reload_listener(lambda index: response_cache.clear())
@@ -0,0 +1,111 @@
+"""Async coordination primitives for serializing and deduplicating queries."""
+
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Hashable
+
+
+class _LockEntry:
+    """A lock and the number of tasks holding or waiting for it."""
+
+    __slots__ = ("lock", "users")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.users = 0
+
+
+class KeyedLocks:
+    """
+    One asyncio lock per key, created on demand and discarded when unused.
+
+    Waiters acquire a key's lock in arrival order, so work for the same key
+    runs one at a time and in the order it was requested.
+    """
+
+    def __init__(self):
+        self._locks: Dict[Hashable, _LockEntry] = {}
+
+    @asynccontextmanager
+    async def hold(self, key: Hashable) -> AsyncIterator[None]:
+        """
+        Hold the lock for a key for the duration of the block.
+
+        Args:
+            key: The key to serialize on, such as a session ID
+        """
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = _LockEntry()
+        entry.users += 1
+        try:
+            async with entry.lock:
+                yield
+        finally:
+            entry.users -= 1
+            if entry.users == 0:
+                del self._locks[key]
+
+    def __len__(self) -> int:
+        return len(self._locks)
+
+
+class SingleFlight:
+    """
+    Deduplicates concurrent calls with the same key.
+
+    The first caller starts the work; callers that arrive while it is in
+    flight await the same result. The work runs as its own task, so it
+    completes for the remaining callers even if the first one is cancelled.
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, "asyncio.Task[Any]"] = {}
+        self.executed = 0
+        self.shared = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Run fn once for all concurrent callers with the same key.
+
+        Args:
+            key: Identifies equivalent calls
+            fn: Zero-argument coroutine function performing the work
+
+        Returns:
+            The result of the shared call
+        """
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+            self.executed += 1
+        else:
+            self.shared += 1
+        return await asyncio.shield(task)
+
+    def in_flight(self) -> int:
+        """
+        Get the number of calls currently running.
+
+        Returns:
+            Number of distinct in-flight keys
+        """
+        return len(self._calls)
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Get deduplication statistics.
+
+        Returns:
+            Dictionary with executed and shared call counts and in-flight calls
+        """
+        return {"executed": self.executed, "shared": self.shared, "in_flight": len(self._calls)}
+
+    def _finish(self, key: Hashable, task: "asyncio.Task[Any]") -> None:
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # Mark the exception as retrieved when every caller was cancelled
+        if not task.cancelled():
+            task.exception()
@@ -6,13 +6,150 @@ from dotenv import load_dotenv
 # Load environment variables from .env file
 load_dotenv()
 
+
+def _env_int(name: str, default: int) -> int:
+    """Read an integer setting from the environment."""
+    return int(os.getenv(name, default))
+
+
+def _env_float(name: str, default: float) -> float:
+    """Read a float setting from the environment."""
+    return float(os.getenv(name, default))
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    """Read a boolean setting from the environment."""
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+# Checked when the agent is created, so the app can start and report readiness without it
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-if not OPENAI_API_KEY:
-    raise ValueError("OPENAI_API_KEY not found. Please set it in your .env file.")
 
 # LLM Configuration
 LLM_MODEL = "gpt-4o"
 LLM_TEMPERATURE = 0
+LLM_BASE_URL = os.getenv("LLM_BASE_URL")  # OpenAI-compatible endpoint, e.g. a local stand-in; unset uses the OpenAI API
+AGENT_ENGINE = os.getenv("AGENT_ENGINE", "executor")  # "executor" (tool-calling loop) or "structured" (single call)
+
+AGENT_VERBOSE = _env_bool("AGENT_VERBOSE", False)  # Print the full AgentExecutor chain trace to stdout
+
+# Model Routing Configuration (simple queries go to a faster, cheaper model)
+MODEL_ROUTING_ENABLED = _env_bool("MODEL_ROUTING_ENABLED", False)  # Off: every query uses LLM_MODEL
+LLM_FAST_MODEL = os.getenv("LLM_FAST_MODEL", "gpt-4o-mini")  # Model of the fast tier
+ROUTING_COMPLEXITY_THRESHOLD = _env_float("ROUTING_COMPLEXITY_THRESHOLD", 0.5)  # Queries scoring below this use the fast tier
+ROUTING_ESCALATE_LOW_CONFIDENCE = _env_bool("ROUTING_ESCALATE_LOW_CONFIDENCE", True)  # Rerun hedging fast-tier answers on LLM_MODEL
+
+# LLM HTTP Client Configuration (one connection pool shared by all LLM calls)
+LLM_POOL_MAX_CONNECTIONS = _env_int("LLM_POOL_MAX_CONNECTIONS", 100)  # Further requests wait for a free connection
+LLM_POOL_MAX_KEEPALIVE = _env_int("LLM_POOL_MAX_KEEPALIVE", 50)  # Idle connections kept open for reuse
+LLM_KEEPALIVE_EXPIRY_SECONDS = _env_float("LLM_KEEPALIVE_EXPIRY_SECONDS", 60)  # Idle connections older than this are closed
+LLM_HTTP2 = _env_bool("LLM_HTTP2", True)  # Only used when the optional 'h2' package is installed
+LLM_CONNECT_TIMEOUT_SECONDS = _env_float("LLM_CONNECT_TIMEOUT_SECONDS", 5)
+LLM_READ_TIMEOUT_SECONDS = _env_float("LLM_READ_TIMEOUT_SECONDS", 60)  # Longest wait for the next response bytes
+LLM_WRITE_TIMEOUT_SECONDS = _env_float("LLM_WRITE_TIMEOUT_SECONDS", 10)
+LLM_POOL_TIMEOUT_SECONDS = _env_float("LLM_POOL_TIMEOUT_SECONDS", 10)  # Longest wait for a free pooled connection
+LLM_MAX_RETRIES = _env_int("LLM_MAX_RETRIES", 2)  # Retries for connection errors, 429 and 5xx responses
+LLM_RETRY_BACKOFF_SECONDS = _env_float("LLM_RETRY_BACKOFF_SECONDS", 0.5)  # Base of the jittered exponential backoff
+LLM_RETRY_BACKOFF_MAX_SECONDS = _env_float("LLM_RETRY_BACKOFF_MAX_SECONDS", 8)
+
+# Latency Budget Configuration
+QUERY_DEADLINE_SECONDS = _env_float("QUERY_DEADLINE_SECONDS", 8)  # Agent answers later than this fall back to the knowledge base; 0 disables
+BREAKER_ENABLED = _env_bool("BREAKER_ENABLED", True)
+BREAKER_WINDOW_SECONDS = _env_float("BREAKER_WINDOW_SECONDS", 30)  # Agent runs considered when deciding to open
+BREAKER_MIN_CALLS = _env_int("BREAKER_MIN_CALLS", 10)  # Runs needed in the window before the breaker can open
+BREAKER_FAILURE_RATE = _env_float("BREAKER_FAILURE_RATE", 0.5)  # Share of failed or timed out runs that opens the breaker
+BREAKER_SLOW_CALL_SECONDS = _env_float("BREAKER_SLOW_CALL_SECONDS", 5)  # Runs slower than this count as slow
+BREAKER_SLOW_CALL_RATE = _env_float("BREAKER_SLOW_CALL_RATE", 0.8)  # Share of slow runs that opens the breaker
+BREAKER_OPEN_SECONDS = _env_float("BREAKER_OPEN_SECONDS", 15)  # Time before a trial run is let through
+
+# Admission Control Configuration
+ADMISSION_MAX_CONCURRENT = _env_int("ADMISSION_MAX_CONCURRENT", 32)  # Agent runs in flight across all requests; 0 disables the cap
+ADMISSION_MAX_QUEUE = _env_int("ADMISSION_MAX_QUEUE", 64)  # Agent runs waiting for a slot; further ones are refused with 503
+ADMISSION_QUEUE_TIMEOUT_SECONDS = _env_float("ADMISSION_QUEUE_TIMEOUT_SECONDS", 5)  # Longest wait for a slot before a 503
+SESSION_RATE_LIMIT_PER_MINUTE = _env_float("SESSION_RATE_LIMIT_PER_MINUTE", 20)  # Agent queries per session; 0 disables
+SESSION_RATE_LIMIT_BURST = _env_int("SESSION_RATE_LIMIT_BURST", 10)
+CLIENT_RATE_LIMIT_PER_MINUTE = _env_float("CLIENT_RATE_LIMIT_PER_MINUTE", 600)  # Agent queries per client address; 0 disables
+CLIENT_RATE_LIMIT_BURST = _env_int("CLIENT_RATE_LIMIT_BURST", 100)  # Headsets behind one NAT share a client bucket
+RATE_LIMIT_MAX_KEYS = _env_int("RATE_LIMIT_MAX_KEYS", 100000)  # Least recently used buckets are dropped beyond this
+
+# Logging Configuration
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")  # "json" (one object per line) or "text"
+AGENT_TRACE_SAMPLE_RATE = _env_float("AGENT_TRACE_SAMPLE_RATE", 0.0)  # Fraction of requests whose full agent trace is logged
+
+# Knowledge Base Configuration
+KNOWLEDGE_BASE_PATH = os.getenv(
+    "KNOWLEDGE_BASE_PATH", os.path.join(os.path.dirname(__file__), "data", "anatomy.json")
+)
+KNOWLEDGE_BASE_WATCH_INTERVAL_SECONDS = _env_float("KNOWLEDGE_BASE_WATCH_INTERVAL_SECONDS", 10)  # 0 disables the file watcher
+
+# Answer Pack Configuration
+ANSWER_PACK_PATH = os.getenv(
+    "ANSWER_PACK_PATH", os.path.join(os.path.dirname(__file__), "data", "answer_pack.json")
+)  # Pre-generated answers to canonical questions; built with `python -m app.answer_pack`
+ANSWER_PACK_ENABLED = _env_bool("ANSWER_PACK_ENABLED", True)
+
+# Speculative Prefetch Configuration (the likeliest question is answered when an organ is picked up)
+PREFETCH_ENABLED = _env_bool("PREFETCH_ENABLED", True)
+PREFETCH_MAX_RUNS_PER_SESSION = _env_int("PREFETCH_MAX_RUNS_PER_SESSION", 20)  # Speculative agent runs per session; later grabs only warm up
+PREFETCH_MAX_CONCURRENT = _env_int("PREFETCH_MAX_CONCURRENT", 4)  # Speculative agent runs in flight across all sessions
+PREFETCH_MAX_SESSIONS = _env_int("PREFETCH_MAX_SESSIONS", 10000)  # Least recently used sessions' run counts are dropped beyond this
+
+# Retrieval Configuration
+RETRIEVAL_CORPUS_PATH = os.getenv(
+    "RETRIEVAL_CORPUS_PATH", os.path.join(os.path.dirname(__file__), "data", "corpus.json")
+)
+RETRIEVAL_TOP_K = _env_int("RETRIEVAL_TOP_K", 3)  # Reference passages added to each agent prompt; 0 disables retrieval
+RETRIEVAL_ORGAN_BOOST = _env_float("RETRIEVAL_ORGAN_BOOST", 1.5)  # Score multiplier for passages about the held organ
+
+# Startup Configuration
+STARTUP_WARMUP = _env_bool("STARTUP_WARMUP", True)  # Build the agent and indexes in the background at startup
+STARTUP_WARMUP_REQUEST = _env_bool("STARTUP_WARMUP_REQUEST", False)  # Also send one agent request to open connections
+
+# Metrics Configuration
+EVENT_LOOP_LAG_INTERVAL_SECONDS = _env_float("EVENT_LOOP_LAG_INTERVAL_SECONDS", 0.5)  # 0 disables the lag monitor
+
+# Admin Configuration
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")  # Required in X-Admin-Token for admin endpoints when set
 
 # Session Configuration
 MAX_CHAT_HISTORY = 10  # Keep last 10 messages in chat history
+HISTORY_TOKEN_BUDGET = _env_int("HISTORY_TOKEN_BUDGET", 1000)  # Tokens of recent turns sent verbatim; older turns are summarized
+HISTORY_SUMMARY_MAX_TOKENS = _env_int("HISTORY_SUMMARY_MAX_TOKENS", 250)  # Size of the rolling summary of older turns
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "memory")  # "memory", "sqlite" or "redis"
+SESSION_SQLITE_PATH = os.getenv("SESSION_SQLITE_PATH", "mexr_sessions.db")
+SESSION_REDIS_URL = os.getenv("SESSION_REDIS_URL", "redis://localhost:6379/0")
+SESSION_MAX_SESSIONS = _env_int("SESSION_MAX_SESSIONS", 10000)  # Least recently used sessions are evicted beyond this
+SESSION_IDLE_TTL_SECONDS = _env_float("SESSION_IDLE_TTL_SECONDS", 1800)  # Sessions idle this long are expired
+SESSION_MAX_BYTES = _env_int("SESSION_MAX_BYTES", 64 * 1024 * 1024)  # Memory ceiling for all session history
+SESSION_SWEEP_INTERVAL_SECONDS = _env_float("SESSION_SWEEP_INTERVAL_SECONDS", 60)
+
+# Response Cache Configuration
+RESPONSE_CACHE_ENABLED = _env_bool("RESPONSE_CACHE_ENABLED", True)
+RESPONSE_CACHE_MAX_ENTRIES = _env_int("RESPONSE_CACHE_MAX_ENTRIES", 1024)
+RESPONSE_CACHE_TTL_SECONDS = _env_float("RESPONSE_CACHE_TTL_SECONDS", 600)
+RESPONSE_CACHE_MAX_BYTES = _env_int("RESPONSE_CACHE_MAX_BYTES", 8 * 1024 * 1024)
+
+# Response Encoding Configuration
+RESPONSE_MSGPACK_ENABLED = _env_bool("RESPONSE_MSGPACK_ENABLED", True)  # Only used when the optional 'ormsgpack' package is installed
+
+# Streaming Configuration
+STREAM_TTS_MIN_CHARS = _env_int("STREAM_TTS_MIN_CHARS", 40)  # Shortest text chunk sent for speech
+STREAM_TTS_MAX_CHARS = _env_int("STREAM_TTS_MAX_CHARS", 200)  # Longest text chunk sent for speech
+
+# WebSocket Configuration
+WS_HEARTBEAT_INTERVAL_SECONDS = _env_float("WS_HEARTBEAT_INTERVAL_SECONDS", 15)
+WS_IDLE_TIMEOUT_SECONDS = _env_float("WS_IDLE_TIMEOUT_SECONDS", 60)  # Close after this long without client messages
+WS_RELEASE_SESSION_ON_DISCONNECT = _env_bool("WS_RELEASE_SESSION_ON_DISCONNECT", False)  # Off: a dropped connection keeps its history until the idle TTL
+
+# Classroom Broadcast Configuration
+BROADCAST_QUEUE_SIZE = _env_int("BROADCAST_QUEUE_SIZE", 32)  # Messages buffered per subscriber; a slow one loses its oldest
+BROADCAST_MAX_SUBSCRIBERS = _env_int("BROADCAST_MAX_SUBSCRIBERS", 500)  # Connections per group; further joins are refused
+BROADCAST_MAX_GROUPS = _env_int("BROADCAST_MAX_GROUPS", 1000)  # Groups with subscribers; further new groups are refused
+
+# Batch Query Configuration
+BATCH_MAX_SIZE = _env_int("BATCH_MAX_SIZE", 100)  # Largest accepted batch
+BATCH_MAX_CONCURRENCY = _env_int("BATCH_MAX_CONCURRENCY", 8)  # Queries of one batch answered at the same time
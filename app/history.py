@@ -0,0 +1,77 @@
+"""Extractive summaries of older chat turns.
+
+Turns that no longer fit the history token budget are folded into a short
+rolling summary instead of being dropped. The summary is built locally from
+the turns themselves, one line per turn with the question and the first
+sentence of its answer, so compacting a session needs no LLM call.
+"""
+
+import re
+from functools import lru_cache
+from typing import List, Optional, Sequence, Tuple
+
+from app.prompts import count_tokens
+
+# Heading of the system message that carries the summary into the prompt
+SUMMARY_HEADER = "Summary of the earlier conversation:"
+
+# Longest answer excerpt kept per summarized turn
+MAX_ANSWER_CHARS = 200
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+_WHITESPACE = re.compile(r"\s+")
+
+
+@lru_cache(maxsize=8192)
+def cached_token_count(text: str) -> int:
+    """
+    Count the tokens in a history message, caching the result.
+
+    Args:
+        text: A stored query, response or summary
+
+    Returns:
+        Number of tokens
+    """
+    return count_tokens(text)
+
+
+def summarize_turn(query: str, response: str) -> str:
+    """
+    Reduce a turn to one summary line.
+
+    Args:
+        query: The user's query
+        response: The answer given
+
+    Returns:
+        A line with the question and the first sentence of the answer
+    """
+    query = _WHITESPACE.sub(" ", query).strip()
+    answer = _SENTENCE_END.split(_WHITESPACE.sub(" ", response).strip(), 1)[0]
+    if len(answer) > MAX_ANSWER_CHARS:
+        answer = answer[:MAX_ANSWER_CHARS].rsplit(" ", 1)[0] + "..."
+    return f"- Asked: {query} Answered: {answer}"
+
+
+def extend_summary(summary: Optional[str], turns: Sequence[Tuple[str, str]], max_tokens: int) -> Optional[str]:
+    """
+    Fold turns into a rolling summary that stays within a token limit.
+
+    Args:
+        summary: The current summary, or None
+        turns: (query, response) pairs to add, oldest first
+        max_tokens: Largest summary size; the oldest lines are dropped beyond it
+
+    Returns:
+        The new summary, or None if nothing fits
+    """
+    lines: List[str] = summary.splitlines() if summary else []
+    lines.extend(summarize_turn(query, response) for query, response in turns)
+    sizes = [cached_token_count(line) + 1 for line in lines]
+    total = sum(sizes)
+    start = 0
+    while start < len(lines) and total > max_tokens:
+        total -= sizes[start]
+        start += 1
+    return "\n".join(lines[start:]) or None
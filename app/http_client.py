@@ -0,0 +1,224 @@
+"""Shared HTTP client for LLM API calls.
+
+One `httpx.AsyncClient` per process carries every call to the LLM API, so
+connections are kept alive and reused across requests instead of being
+opened per agent. Pool size, keep-alive, timeouts and retries are set
+explicitly, and HTTP/2 is used when the optional `h2` package is installed.
+"""
+
+import asyncio
+import importlib.util
+import logging
+import random
+from typing import Any, Dict, Optional
+
+import httpx
+
+from app.config import (
+    LLM_POOL_MAX_CONNECTIONS,
+    LLM_POOL_MAX_KEEPALIVE,
+    LLM_KEEPALIVE_EXPIRY_SECONDS,
+    LLM_HTTP2,
+    LLM_CONNECT_TIMEOUT_SECONDS,
+    LLM_READ_TIMEOUT_SECONDS,
+    LLM_WRITE_TIMEOUT_SECONDS,
+    LLM_POOL_TIMEOUT_SECONDS,
+    LLM_MAX_RETRIES,
+    LLM_RETRY_BACKOFF_SECONDS,
+    LLM_RETRY_BACKOFF_MAX_SECONDS,
+)
+
+logger = logging.getLogger(__name__)
+
+# Responses worth retrying: timeouts, rate limits and transient server errors
+RETRY_STATUS_CODES = frozenset({408, 409, 429, 500, 502, 503, 504})
+
+# Failures that happen before the server could have processed the request,
+# including a keep-alive connection that the server already closed
+RETRY_EXCEPTIONS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.RemoteProtocolError)
+
+# How long and how much a closed response may still be read so its
+# connection can return to the pool instead of being discarded
+DRAIN_TIMEOUT_SECONDS = 0.25
+DRAIN_MAX_BYTES = 64 * 1024
+
+
+class DrainingStream(httpx.AsyncByteStream):
+    """
+    Response body that reads the rest of a short unread tail when closed.
+
+    The OpenAI client stops reading a streamed completion at ``[DONE]`` and
+    closes it before the final chunk terminator arrives, which makes the
+    pool drop the connection. Reading that tail keeps the connection alive;
+    responses abandoned early are still closed after a bounded wait.
+    """
+
+    def __init__(self, stream: httpx.AsyncByteStream):
+        self._stream = stream
+        self._iterator = None
+        self._exhausted = False
+
+    async def __aiter__(self):
+        self._iterator = self._stream.__aiter__()
+        async for chunk in self._iterator:
+            yield chunk
+        self._exhausted = True
+
+    async def _drain(self) -> None:
+        read = 0
+        async for chunk in self._iterator:
+            read += len(chunk)
+            if read > DRAIN_MAX_BYTES:
+                return
+
+    async def aclose(self) -> None:
+        if self._iterator is not None and not self._exhausted:
+            try:
+                await asyncio.wait_for(self._drain(), DRAIN_TIMEOUT_SECONDS)
+            except (asyncio.TimeoutError, httpx.HTTPError):
+                pass
+        await self._stream.aclose()
+
+
+class RetryTransport(httpx.AsyncBaseTransport):
+    """Retries failed requests with exponential backoff and full jitter."""
+
+    def __init__(self, transport: httpx.AsyncBaseTransport, max_retries: int = LLM_MAX_RETRIES,
+                 backoff: float = LLM_RETRY_BACKOFF_SECONDS, backoff_max: float = LLM_RETRY_BACKOFF_MAX_SECONDS):
+        self.transport = transport
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.requests = 0
+        self.in_flight = 0
+        self.retries = 0
+        self.failures = 0
+
+    def _delay(self, attempt: int, retry_after: Optional[str] = None) -> float:
+        """Seconds to wait before a retry, honouring a numeric Retry-After header."""
+        if retry_after is not None:
+            try:
+                return min(max(float(retry_after), 0.0), self.backoff_max)
+            except ValueError:
+                pass
+        return random.uniform(0, min(self.backoff_max, self.backoff * 2 ** attempt))
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self.requests += 1
+        self.in_flight += 1
+        try:
+            attempt = 0
+            while True:
+                retry_after = None
+                try:
+                    response = await self.transport.handle_async_request(request)
+                except RETRY_EXCEPTIONS as exc:
+                    if attempt >= self.max_retries:
+                        self.failures += 1
+                        raise
+                    logger.warning("LLM request failed, retrying: %s", exc, extra={"attempt": attempt + 1})
+                else:
+                    if response.status_code not in RETRY_STATUS_CODES or attempt >= self.max_retries:
+                        if response.status_code >= 500:
+                            self.failures += 1
+                        response.stream = DrainingStream(response.stream)
+                        return response
+                    retry_after = response.headers.get("retry-after")
+                    await response.aclose()
+                    logger.warning("LLM request returned %d, retrying", response.status_code,
+                                   extra={"attempt": attempt + 1})
+                self.retries += 1
+                await asyncio.sleep(self._delay(attempt, retry_after))
+                attempt += 1
+        finally:
+            self.in_flight -= 1
+
+    async def aclose(self) -> None:
+        await self.transport.aclose()
+
+
+def http2_available() -> bool:
+    """Whether the `h2` package needed for HTTP/2 is installed."""
+    return importlib.util.find_spec("h2") is not None
+
+
+def llm_timeout() -> httpx.Timeout:
+    """Timeouts for LLM API calls; the read timeout applies between streamed chunks."""
+    return httpx.Timeout(
+        connect=LLM_CONNECT_TIMEOUT_SECONDS,
+        read=LLM_READ_TIMEOUT_SECONDS,
+        write=LLM_WRITE_TIMEOUT_SECONDS,
+        pool=LLM_POOL_TIMEOUT_SECONDS,
+    )
+
+
+class LLMHttpClient:
+    """Owns the process-wide HTTP client for the LLM API."""
+
+    def __init__(self):
+        self._client: Optional[httpx.AsyncClient] = None
+        self._retry_transport: Optional[RetryTransport] = None
+        self.limits = httpx.Limits(
+            max_connections=LLM_POOL_MAX_CONNECTIONS,
+            max_keepalive_connections=LLM_POOL_MAX_KEEPALIVE,
+            keepalive_expiry=LLM_KEEPALIVE_EXPIRY_SECONDS,
+        )
+        self.http2 = LLM_HTTP2 and http2_available()
+
+    def get(self) -> httpx.AsyncClient:
+        """
+        Get the shared client, creating it on first use.
+
+        Returns:
+            The process-wide async HTTP client
+        """
+        if self._client is None or self._client.is_closed:
+            if LLM_HTTP2 and not self.http2:
+                logger.info("HTTP/2 requested for LLM calls but the 'h2' package is not installed; using HTTP/1.1")
+            transport = httpx.AsyncHTTPTransport(limits=self.limits, http2=self.http2)
+            self._retry_transport = RetryTransport(transport)
+            self._client = httpx.AsyncClient(transport=self._retry_transport, timeout=llm_timeout())
+        return self._client
+
+    async def aclose(self) -> None:
+        """Close the client and its pooled connections."""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get connection pool statistics.
+
+        Returns:
+            Dictionary with request, retry and failure counts, requests in
+            flight, open and idle connections, and the pool configuration
+        """
+        stats: Dict[str, Any] = {
+            "http2": self.http2,
+            "max_connections": self.limits.max_connections,
+            "max_keepalive_connections": self.limits.max_keepalive_connections,
+            "requests": 0,
+            "in_flight": 0,
+            "retries": 0,
+            "failures": 0,
+            "connections": 0,
+            "idle_connections": 0,
+            "queued_requests": 0,
+        }
+        transport = self._retry_transport
+        if transport is None:
+            return stats
+        stats.update(requests=transport.requests, in_flight=transport.in_flight,
+                     retries=transport.retries, failures=transport.failures)
+        # httpcore exposes its connections; the request queue is internal
+        pool = getattr(transport.transport, "_pool", None)
+        connections = list(getattr(pool, "connections", []))
+        stats["connections"] = len(connections)
+        stats["idle_connections"] = sum(1 for connection in connections if connection.is_idle())
+        stats["queued_requests"] = max(0, len(getattr(pool, "_requests", [])) - stats["connections"] + stats["idle_connections"])
+        return stats
+
+
+# Global LLM HTTP client
+llm_http_client = LLMHttpClient()
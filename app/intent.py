@@ -0,0 +1,161 @@
+"""Local intent classification for queries that can be answered without the LLM."""
+
+import re
+from enum import Enum
+from typing import Dict, Any, List, Optional
+
+from app.tools import highlight_object
+
+
+class QueryIntent(str, Enum):
+    """Intents that can be answered directly from the knowledge base."""
+    LOCATION = "location"
+    IDENTIFY = "identify"
+
+
+# Words that carry no meaning for intent matching
+_LEADING_FILLERS = re.compile(
+    r"^(?:(?:hey|hi|ok|okay|so|um|uh|erm|well|please|"
+    r"can you tell me|could you tell me|tell me|do you know)\s+)+"
+)
+_TRAILING_FILLERS = re.compile(r"(?:\s+(?:please|again|now))+$")
+_PUNCTUATION = re.compile(r"[^\w\s']")
+_WHITESPACE = re.compile(r"\s+")
+
+# References to "the thing I'm holding"; the held organ's own name is added per query
+_DEICTIC_SUBJECTS = {
+    "this", "it", "that", "this one", "that one", "this organ", "that organ",
+    "this piece", "this part", "this thing", "this object",
+}
+
+_LOCATION_PATTERNS = [
+    re.compile(
+        r"where (?:does|do|should|would|can|could|will|is) (?P<subject>.+?) "
+        r"(?:go|goes|belong|belongs|fit|fits|sit|sits|attach|be placed|be put|be|placed|located)"
+        r"(?: in| to)?(?: the body)?"
+    ),
+    re.compile(r"where (?:do|should|can|could|would) i (?:put|place) (?P<subject>.+?)(?: in the body)?"),
+    re.compile(r"(?:show me|highlight) where (?P<subject>.+?) (?:goes|go|belongs|fits)"),
+    re.compile(r"where is the (?:socket|slot|spot|place) for (?P<subject>.+?)"),
+    re.compile(r"which (?:socket|slot|spot) (?:is|does) (?P<subject>.+?)(?: go in| belong in| for)?"),
+    re.compile(r"where (?P<subject>.+?) (?:goes|belongs)"),
+    re.compile(r"where is (?P<subject>.+?)"),
+]
+
+_IDENTIFY_PATTERNS = [
+    re.compile(r"what(?: is|'s| organ is) (?P<subject>.+?)"),
+    re.compile(r"which organ is (?P<subject>.+?)"),
+    re.compile(r"what am i (?:holding|carrying)"),
+]
+
+
+def normalize_query(query: str) -> str:
+    """
+    Normalize a spoken query for pattern matching.
+
+    Args:
+        query: The raw user query
+
+    Returns:
+        Lower-cased query without punctuation or filler words
+    """
+    text = query.lower().replace("’", "'")
+    text = _PUNCTUATION.sub(" ", text)
+    text = _WHITESPACE.sub(" ", text).strip()
+    text = _LEADING_FILLERS.sub("", text)
+    text = _TRAILING_FILLERS.sub("", text)
+    return text
+
+
+def _refers_to_held_organ(subject: Optional[str], organ_id: str, organ_info: Dict[str, Any]) -> bool:
+    """Check whether the subject of a query is the organ the user is holding."""
+    if subject is None:
+        return True
+    subject = subject.strip()
+    if subject in _DEICTIC_SUBJECTS:
+        return True
+    names = {organ_id.replace("_", " "), organ_info["displayName"].lower()}
+    for name in names:
+        if subject in (name, f"the {name}", f"this {name}", f"my {name}"):
+            return True
+    return False
+
+
+def _match(patterns: List[re.Pattern], text: str, organ_id: str, organ_info: Dict[str, Any]) -> bool:
+    for pattern in patterns:
+        match = pattern.fullmatch(text)
+        if match and _refers_to_held_organ(match.groupdict().get("subject"), organ_id, organ_info):
+            return True
+    return False
+
+
+def classify_intent(query: str, organ_id: str, organ_info: Dict[str, Any]) -> Optional[QueryIntent]:
+    """
+    Classify a query into an intent that the knowledge base can answer.
+
+    Only whole-query matches about the held organ are accepted, so compound or
+    comparative questions fall through to the agent.
+
+    Args:
+        query: The user's spoken question
+        organ_id: The unique identifier of the held organ
+        organ_info: Knowledge base entry for the held organ
+
+    Returns:
+        The matched intent, or None if the query should go to the agent
+    """
+    text = normalize_query(query)
+    if not text:
+        return None
+    if _match(_LOCATION_PATTERNS, text, organ_id, organ_info):
+        return QueryIntent.LOCATION
+    if _match(_IDENTIFY_PATTERNS, text, organ_id, organ_info):
+        return QueryIntent.IDENTIFY
+    return None
+
+
+def answer_from_knowledge_base(intent: QueryIntent, organ_info: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Build a response for a classified intent directly from the knowledge base.
+
+    Args:
+        intent: The classified query intent
+        organ_info: Knowledge base entry for the held organ
+
+    Returns:
+        Dictionary matching the VRQueryResponse schema
+    """
+    name = organ_info["displayName"]
+    if intent == QueryIntent.LOCATION:
+        text = f"This is the {name}. I've highlighted its socket so you can see where it goes."
+        actions = [highlight_object.invoke({"target_id": organ_info["socketID"]})]
+    else:
+        text = f"This is the {name}. {organ_info['description']}"
+        actions = []
+    return {
+        "displayText": text,
+        "spokenResponse": text,
+        "actions": actions
+    }
+
+
+def fallback_answer(organ_info: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Build a deterministic answer about the held organ for when the agent is unavailable.
+
+    Args:
+        organ_info: Knowledge base entry for the held organ
+
+    Returns:
+        Dictionary matching the VRQueryResponse schema, with the organ's
+        description and a highlight action for its socket
+    """
+    text = (
+        f"This is the {organ_info['displayName']}. {organ_info['description']} "
+        "I've highlighted its socket so you can see where it goes."
+    )
+    return {
+        "displayText": text,
+        "spokenResponse": text,
+        "actions": [highlight_object.invoke({"target_id": organ_info["socketID"]})]
+    }
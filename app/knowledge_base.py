@@ -1,59 +1,261 @@
-"""Knowledge base containing anatomy information for the VR simulation."""
-
-from typing import Dict, Any, Optional
-
-ANATOMY_KNOWLEDGE = {
-    "heart": {
-        "displayName": "Heart",
-        "socketID": "socket_heart",
-        "description": "The heart is a muscular organ that pumps blood through the circulatory system by contraction and relaxation.",
-        "function": "Its primary function is to pump oxygenated blood to the body and deoxygenated blood to the lungs."
-    },
-    "liver": {
-        "displayName": "Liver",
-        "socketID": "socket_liver",
-        "description": "The liver is a large, meaty organ that sits on the right side of the belly, weighing about 3 pounds.",
-        "function": "It filters the blood from the digestive tract, detoxifies chemicals, metabolizes drugs, and makes proteins important for blood clotting."
-    },
-    "stomach": {
-        "displayName": "Stomach",
-        "socketID": "socket_stomach",
-        "description": "The stomach is a J-shaped organ that digests food. It produces enzymes and acids.",
-        "function": "It secretes acid and enzymes that digest food, breaking it down before it moves to the small intestine."
-    },
-    "left_lung": {
-        "displayName": "Left Lung",
-        "socketID": "socket_left_lung",
-        "description": "The left lung is one of the two lungs, located in the chest. It is slightly smaller than the right lung to make room for the heart.",
-        "function": "Its main function is the process of gas exchange called respiration (or breathing)."
-    },
-    "right_lung": {
-        "displayName": "Right Lung",
-        "socketID": "socket_right_lung",
-        "description": "The right lung is one of the two lungs, located in the chest. It is divided into three lobes.",
-        "function": "Its main function is the process of gas exchange called respiration (or breathing)."
-    }
-}
+"""Knowledge base containing anatomy information for the VR simulation.
+
+Organ data is loaded from a JSON file (``KNOWLEDGE_BASE_PATH``) on first use
+into an immutable index with O(1) lookup by organ ID, socket ID and alias.
+Reloading builds a new index and swaps it in as a single reference
+assignment, so concurrent readers always see a complete snapshot.
+"""
+
+import asyncio
+import difflib
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+from collections.abc import Mapping
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from app.config import KNOWLEDGE_BASE_PATH, KNOWLEDGE_BASE_WATCH_INTERVAL_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Minimum similarity for a misspelled object ID to match an organ
+FUZZY_MATCH_CUTOFF = 0.8
+# Fuzzy matches scoring within this much of the best one are close enough to be ambiguous
+FUZZY_MATCH_MARGIN = 0.05
+
+_ALIAS_NORMALIZER = re.compile(r"[^a-z0-9]")
+
+
+def normalize_alias(object_id: str) -> str:
+    """
+    Normalize an object ID for alias lookup.
+
+    Args:
+        object_id: An organ ID or alias as emitted by a scene build
+
+    Returns:
+        The ID lower-cased with separators removed, e.g. "Left-Lung" -> "leftlung"
+    """
+    return _ALIAS_NORMALIZER.sub("", object_id.lower())
+
+
+class KnowledgeIndex:
+    """An immutable, indexed snapshot of the knowledge base file."""
+
+    def __init__(self, organs: Dict[str, Dict[str, Any]], aliases: Dict[str, str], version: str):
+        self.organs = organs
+        self.version = version
+        self.by_socket = {info["socketID"]: organ_id for organ_id, info in organs.items()}
+        self.aliases = {normalize_alias(organ_id): organ_id for organ_id in organs}
+        self.aliases.update(aliases)
+        self._alias_keys: List[str] = list(self.aliases)
+
+    @classmethod
+    def from_file(cls, path: str) -> "KnowledgeIndex":
+        """
+        Load and index a knowledge base file.
+
+        Args:
+            path: Path to the JSON knowledge base file
+
+        Returns:
+            The indexed knowledge base
+        """
+        with open(path, "rb") as f:
+            raw = f.read()
+        data = json.loads(raw)
+        organs: Dict[str, Dict[str, Any]] = {}
+        aliases: Dict[str, str] = {}
+        for organ_id, entry in data["organs"].items():
+            entry = dict(entry)
+            for alias in entry.pop("aliases", []):
+                aliases[normalize_alias(alias)] = organ_id
+            organs[organ_id] = entry
+        return cls(organs, aliases, hashlib.sha256(raw).hexdigest()[:16])
+
+    def resolve(self, object_id: str, fuzzy: bool = True) -> Optional[str]:
+        """
+        Resolve an object ID, alias or misspelling to an organ ID.
+
+        Args:
+            object_id: The ID sent by the VR client
+            fuzzy: Whether to fall back to approximate matching
+
+        Returns:
+            The canonical organ ID, or None if nothing matches or a misspelling
+            is about as close to aliases of different organs
+        """
+        if object_id in self.organs:
+            return object_id
+        key = normalize_alias(object_id)
+        organ_id = self.aliases.get(key)
+        if organ_id is not None or not fuzzy or not key:
+            return organ_id
+        matches = difflib.get_close_matches(key, self._alias_keys, n=len(self._alias_keys), cutoff=FUZZY_MATCH_CUTOFF)
+        if not matches:
+            return None
+        matcher = difflib.SequenceMatcher(b=key)
+        scores = []
+        for alias in matches:
+            matcher.set_seq1(alias)
+            scores.append(matcher.ratio())
+        best = max(scores)
+        candidates = {self.aliases[alias] for alias, score in zip(matches, scores) if score >= best - FUZZY_MATCH_MARGIN}
+        # "lung" is as close to left_lung's aliases as to right_lung's, so guessing either would be wrong half the time
+        return candidates.pop() if len(candidates) == 1 else None
+
+
+class KnowledgeBase:
+    """Lazily loaded, hot-reloadable anatomy knowledge base."""
+
+    def __init__(self, path: str = KNOWLEDGE_BASE_PATH):
+        self.path = path
+        self._index: Optional[KnowledgeIndex] = None
+        self._mtime: Optional[float] = None
+        self._load_lock = threading.Lock()
+        self._reload_listeners: List[Callable[[KnowledgeIndex], None]] = []
+
+    @property
+    def index(self) -> KnowledgeIndex:
+        """The current index, loaded from disk on first access."""
+        index = self._index
+        if index is None:
+            with self._load_lock:
+                if self._index is None:
+                    self._load()
+                index = self._index
+        return index
+
+    @property
+    def version(self) -> str:
+        """Content hash of the loaded knowledge base file."""
+        return self.index.version
+
+    def reload(self, force: bool = False) -> bool:
+        """
+        Reload the knowledge base if the file has changed.
+
+        Args:
+            force: Reload even if the file's modification time is unchanged
+
+        Returns:
+            True if a new version of the knowledge base was loaded
+        """
+        with self._load_lock:
+            if not force and self._index is not None and os.path.getmtime(self.path) == self._mtime:
+                return False
+            previous = self._index
+            self._load()
+            index = self._index
+        if previous is not None and previous.version == index.version:
+            return False
+        for listener in list(self._reload_listeners):
+            listener(index)
+        return True
+
+    def add_reload_listener(self, listener: Callable[[KnowledgeIndex], None]) -> None:
+        """
+        Register a callback to run after a new version is loaded.
+
+        Args:
+            listener: Called with the new index
+        """
+        self._reload_listeners.append(listener)
+
+    async def run_watcher(self, interval: float = KNOWLEDGE_BASE_WATCH_INTERVAL_SECONDS) -> None:
+        """
+        Poll the knowledge base file and reload it when it changes, until cancelled.
+
+        Args:
+            interval: Seconds between checks
+        """
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                self.reload()
+            except (OSError, ValueError, KeyError) as exc:
+                # Keep serving the current version if the new file is missing or invalid
+                logger.warning("Knowledge base reload failed: %s", exc)
+
+    def _load(self) -> None:
+        mtime = os.path.getmtime(self.path)
+        self._index = KnowledgeIndex.from_file(self.path)
+        self._mtime = mtime
+
+
+class _LiveOrganView(Mapping):
+    """Read-only mapping of organ ID to organ info that always reflects the current index."""
+
+    def __init__(self, knowledge_base: KnowledgeBase):
+        self._knowledge_base = knowledge_base
+
+    def __getitem__(self, organ_id: str) -> Dict[str, Any]:
+        return self._knowledge_base.index.organs[organ_id]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._knowledge_base.index.organs)
+
+    def __len__(self) -> int:
+        return len(self._knowledge_base.index.organs)
+
+
+# Global knowledge base instance
+knowledge_base = KnowledgeBase()
+
+ANATOMY_KNOWLEDGE: Mapping = _LiveOrganView(knowledge_base)
 
 
 def get_organ_info(organ_id: str) -> Optional[Dict[str, Any]]:
     """
     Retrieve organ information from the knowledge base.
-    
+
     Args:
-        organ_id: The unique identifier for the organ
-        
+        organ_id: The unique identifier for the organ, or one of its aliases
+
     Returns:
         Dictionary containing organ information, or None if not found
     """
-    return ANATOMY_KNOWLEDGE.get(organ_id)
+    index = knowledge_base.index
+    resolved = index.resolve(organ_id, fuzzy=False)
+    return index.organs.get(resolved) if resolved else None
+
+
+def resolve_organ_id(object_id: str) -> Optional[str]:
+    """
+    Resolve the object ID sent by a scene build to a canonical organ ID.
+
+    Tries an exact match, then aliases, then a fuzzy match for typos.
+
+    Args:
+        object_id: The held object ID from the VR client
+
+    Returns:
+        The canonical organ ID, or None if nothing matches
+    """
+    return knowledge_base.index.resolve(object_id)
+
+
+def get_organ_by_socket(socket_id: str) -> Optional[str]:
+    """
+    Find the organ that belongs in a socket.
+
+    Args:
+        socket_id: The unique identifier of the socket
+
+    Returns:
+        The organ ID, or None if no organ uses that socket
+    """
+    return knowledge_base.index.by_socket.get(socket_id)
 
 
 def get_all_organs() -> Dict[str, Dict[str, Any]]:
     """
     Get all organs in the knowledge base.
-    
+
     Returns:
         Dictionary of all organs and their information
     """
-    return ANATOMY_KNOWLEDGE
+    return knowledge_base.index.organs
@@ -0,0 +1,202 @@
+"""Structured logging through a background queue.
+
+Records from the ``app`` loggers are put on an in-memory queue by the
+calling task and formatted and written to stdout by a listener thread, so
+the event loop never blocks on a console write. Each record carries the
+request ID and session ID of the request that emitted it.
+"""
+
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import time
+import uuid
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+
+from app.config import LOG_LEVEL, LOG_FORMAT, AGENT_TRACE_SAMPLE_RATE
+
+REQUEST_ID_HEADER = "X-Request-ID"
+
+request_id_var: ContextVar[Optional[str]] = ContextVar("mexr_request_id", default=None)
+session_id_var: ContextVar[Optional[str]] = ContextVar("mexr_session_id", default=None)
+trace_sampled_var: ContextVar[bool] = ContextVar("mexr_trace_sampled", default=False)
+
+# Attributes every LogRecord has; anything else was passed in `extra`
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+logger = logging.getLogger(__name__)
+
+
+def bind_session(session_id: str) -> None:
+    """
+    Attach a session ID to the log records of the current request or task.
+
+    Args:
+        session_id: The unique session identifier
+    """
+    session_id_var.set(session_id)
+
+
+class ContextFilter(logging.Filter):
+    """Adds the current request and session IDs to each record."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get()
+        record.session_id = session_id_var.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats a record as a single JSON object per line."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and value is not None:
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_queue_handler: Optional[logging.handlers.QueueHandler] = None
+
+
+def setup_logging(level: str = LOG_LEVEL, fmt: str = LOG_FORMAT) -> None:
+    """
+    Route the app's log records through a queue to a background writer.
+
+    Args:
+        level: Minimum level for the ``app`` loggers
+        fmt: "json" for one JSON object per line, or "text"
+    """
+    global _listener, _queue_handler
+    if _listener is not None:
+        return
+    stream_handler = logging.StreamHandler(sys.stdout)
+    if fmt == "json":
+        stream_handler.setFormatter(JsonFormatter())
+    else:
+        stream_handler.setFormatter(logging.Formatter(
+            "%(asctime)s %(levelname)s %(name)s [%(request_id)s %(session_id)s] %(message)s"
+        ))
+
+    log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    _queue_handler = logging.handlers.QueueHandler(log_queue)
+    # The filter runs in the emitting task, where the context variables are set
+    _queue_handler.addFilter(ContextFilter())
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+
+    app_logger = logging.getLogger("app")
+    app_logger.setLevel(level.upper())
+    app_logger.addHandler(_queue_handler)
+    app_logger.propagate = False
+    _listener.start()
+
+
+def shutdown_logging() -> None:
+    """Write out queued records and restore the default logging setup."""
+    global _listener, _queue_handler
+    if _listener is None:
+        return
+    app_logger = logging.getLogger("app")
+    app_logger.removeHandler(_queue_handler)
+    app_logger.propagate = True
+    _listener.stop()
+    _listener = None
+    _queue_handler = None
+
+
+class RequestContextMiddleware:
+    """
+    ASGI middleware that assigns each request an ID and decides whether to trace it.
+
+    The client's X-Request-ID header is used when present, and the ID is
+    returned in the response headers.
+    """
+
+    def __init__(self, app, trace_sample_rate: float = AGENT_TRACE_SAMPLE_RATE):
+        self.app = app
+        self.trace_sample_rate = trace_sample_rate
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+
+        request_id = None
+        for name, value in scope.get("headers", ()):
+            if name == b"x-request-id":
+                request_id = value.decode("latin-1")[:128]
+                break
+        request_id = request_id or uuid.uuid4().hex
+        tokens = [
+            (request_id_var, request_id_var.set(request_id)),
+            (session_id_var, session_id_var.set(None)),
+            (trace_sampled_var, trace_sampled_var.set(random.random() < self.trace_sample_rate)),
+        ]
+
+        async def send_with_request_id(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [
+                    (REQUEST_ID_HEADER.lower().encode("latin-1"), request_id.encode("latin-1"))
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            for var, token in reversed(tokens):
+                var.reset(token)
+
+
+class AgentTraceLogger(BaseCallbackHandler):
+    """Logs the full agent trace (prompts, model output, tool calls) for sampled requests."""
+
+    # Run in the caller's context so the sampling decision is visible
+    run_inline = True
+
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages: List[List[Any]], *, run_id: UUID, **kwargs: Any) -> None:
+        if trace_sampled_var.get():
+            prompt = [{"role": message.type, "content": message.content} for batch in messages for message in batch]
+            logger.info("LLM call started", extra={"trace": "llm_start", "run_id": str(run_id), "prompt": prompt})
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any) -> None:
+        if trace_sampled_var.get():
+            output = [
+                {"text": generation.text, "tool_calls": getattr(getattr(generation, "message", None), "tool_calls", None)}
+                for generations in response.generations for generation in generations
+            ]
+            logger.info("LLM call finished", extra={"trace": "llm_end", "run_id": str(run_id), "output": output})
+
+    def on_tool_start(self, serialized: Dict[str, Any], input_str: str, *, run_id: UUID, **kwargs: Any) -> None:
+        if trace_sampled_var.get():
+            logger.info("Tool call started", extra={
+                "trace": "tool_start", "run_id": str(run_id), "tool": (serialized or {}).get("name"), "input": input_str
+            })
+
+    def on_tool_end(self, output: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        if trace_sampled_var.get():
+            logger.info("Tool call finished", extra={"trace": "tool_end", "run_id": str(run_id), "output": output})
+
+    def on_agent_finish(self, finish: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        if trace_sampled_var.get():
+            logger.info("Agent finished", extra={"trace": "agent_finish", "run_id": str(run_id), "output": finish.return_values})
+
+
+# Global trace logger, attached to the LLM, the agent and its tools
+agent_trace_logger = AgentTraceLogger()
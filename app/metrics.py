@@ -0,0 +1,533 @@
+"""Request metrics in the Prometheus text exposition format.
+
+Metrics are plain in-process counters and histograms. Each labelled series
+is created once and cached, so recording a value on the hot path is a dict
+lookup, a bisect and a few additions. All updates happen on the event loop
+thread.
+
+Per-query labels (route and held organ) are carried in a context variable
+that the middleware sets for each HTTP request or WebSocket connection, so
+LangChain callbacks and route helpers can label what they record without
+passing the request around.
+"""
+
+import asyncio
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+
+# Latency buckets in seconds, from a cached answer up to a slow agent run
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    """Base class for a metric family with a fixed set of label names."""
+
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._series: Dict[LabelValues, Any] = {}
+
+    def labels(self, *values: str) -> Any:
+        """
+        Get the series for a combination of label values.
+
+        Args:
+            values: One value per label name, in order
+
+        Returns:
+            The series, created on first use
+        """
+        series = self._series.get(values)
+        if series is None:
+            if len(values) != len(self.label_names):
+                raise ValueError(f"{self.name} expects labels {self.label_names}, got {values}")
+            series = self._series[values] = self._new_series()
+        return series
+
+    def _new_series(self) -> Any:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        """Render the metric family in the Prometheus text format."""
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for values, series in list(self._series.items()):
+            lines.extend(self._render_series(values, series))
+        return lines
+
+    def _render_series(self, values: LabelValues, series: Any) -> List[str]:
+        raise NotImplementedError
+
+
+class _CounterSeries:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.value += amount
+
+
+class Counter(_Metric):
+    """A monotonically increasing count."""
+
+    kind = "counter"
+
+    def _new_series(self) -> _CounterSeries:
+        return _CounterSeries()
+
+    def _render_series(self, values: LabelValues, series: _CounterSeries) -> List[str]:
+        return [f"{self.name}{_format_labels(self.label_names, values)} {_format_value(series.value)}"]
+
+
+class _GaugeSeries:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+
+class Gauge(_Metric):
+    """A value that can go up and down."""
+
+    kind = "gauge"
+
+    def _new_series(self) -> _GaugeSeries:
+        return _GaugeSeries()
+
+    def _render_series(self, values: LabelValues, series: _GaugeSeries) -> List[str]:
+        return [f"{self.name}{_format_labels(self.label_names, values)} {_format_value(series.value)}"]
+
+
+class _HistogramSeries:
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Histogram(_Metric):
+    """A distribution of observed values in cumulative buckets."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_series(self) -> _HistogramSeries:
+        return _HistogramSeries(self.buckets)
+
+    def _render_series(self, values: LabelValues, series: _HistogramSeries) -> List[str]:
+        names = self.label_names + ("le",)
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), series.counts):
+            cumulative += count
+            lines.append(f"{self.name}_bucket{_format_labels(names, values + (_format_value(bound),))} {cumulative}")
+        labels = _format_labels(self.label_names, values)
+        lines.append(f"{self.name}_sum{labels} {_format_value(series.sum)}")
+        lines.append(f"{self.name}_count{labels} {series.count}")
+        return lines
+
+
+class MetricsRegistry:
+    """A collection of metric families rendered together."""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        """
+        Add a metric family to the registry.
+
+        Args:
+            metric: The metric to add
+
+        Returns:
+            The same metric, for assignment at module level
+        """
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        """
+        Render every registered metric.
+
+        Returns:
+            The metrics in the Prometheus text exposition format
+        """
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+# Global metrics registry, served on /metrics
+registry = MetricsRegistry()
+
+QUERY_LABELS = ("route", "organ")
+
+REQUEST_DURATION = registry.register(Histogram(
+    "mexr_request_duration_seconds", "Time to handle an HTTP request.", QUERY_LABELS))
+STAGE_DURATION = registry.register(Histogram(
+    "mexr_stage_duration_seconds", "Time spent in each stage of answering a query.", ("stage",) + QUERY_LABELS))
+QUERIES = registry.register(Counter(
+    "mexr_queries_total", "Queries answered, by serving path.", QUERY_LABELS + ("served_by",)))
+LLM_CALLS = registry.register(Counter(
+    "mexr_llm_calls_total", "LLM calls made.", QUERY_LABELS))
+LLM_TOKENS = registry.register(Counter(
+    "mexr_llm_tokens_total", "LLM tokens used, by type (prompt, cached or completion).", QUERY_LABELS + ("type",)))
+TOOL_CALLS = registry.register(Counter(
+    "mexr_tool_calls_total", "Tool calls executed for the agent.", QUERY_LABELS + ("tool",)))
+AGENT_ITERATIONS = registry.register(Histogram(
+    "mexr_agent_iterations", "LLM calls per agent run.", QUERY_LABELS, buckets=(1, 2, 3, 4, 5, 8, 15)))
+ERRORS = registry.register(Counter(
+    "mexr_errors_total", "Errors, by where they occurred.", QUERY_LABELS + ("type",)))
+EVENT_LOOP_LAG = registry.register(Histogram(
+    "mexr_event_loop_lag_seconds", "Delay of a scheduled wake-up on the event loop."))
+FALLBACKS = registry.register(Counter(
+    "mexr_fallbacks_total", "Agent queries answered from the knowledge base instead, by reason.", QUERY_LABELS + ("reason",)))
+CIRCUIT_STATE = registry.register(Gauge(
+    "mexr_circuit_breaker_state", "State of a circuit breaker: 0 closed, 1 half-open, 2 open.", ("breaker",)))
+CIRCUIT_TRANSITIONS = registry.register(Counter(
+    "mexr_circuit_breaker_transitions_total", "Circuit breaker state changes, by new state.", ("breaker", "state")))
+MODEL_TIER_RUNS = registry.register(Counter(
+    "mexr_model_tier_runs_total", "Agent runs by model tier.", QUERY_LABELS + ("tier",)))
+MODEL_TIER_DURATION = registry.register(Histogram(
+    "mexr_model_tier_duration_seconds", "Time of an agent run by model tier.", ("tier",)))
+MODEL_ESCALATIONS = registry.register(Counter(
+    "mexr_model_escalations_total", "Fast-tier answers rerun on the full model.", QUERY_LABELS))
+ADMISSION_IN_FLIGHT = registry.register(Gauge(
+    "mexr_admission_in_flight", "Agent runs holding an admission slot."))
+ADMISSION_QUEUE_DEPTH = registry.register(Gauge(
+    "mexr_admission_queue_depth", "Agent runs waiting for an admission slot."))
+ADMISSION_WAIT = registry.register(Histogram(
+    "mexr_admission_wait_seconds", "Time an agent run waited for an admission slot."))
+ADMISSION_REJECTIONS = registry.register(Counter(
+    "mexr_admission_rejections_total", "Queries refused by admission control, by reason.", ("reason",)))
+BROADCAST_GROUPS = registry.register(Gauge(
+    "mexr_broadcast_groups", "Classroom broadcast groups with at least one subscriber."))
+BROADCAST_SUBSCRIBERS = registry.register(Gauge(
+    "mexr_broadcast_subscribers", "Connections subscribed to a classroom broadcast group."))
+BROADCAST_MESSAGES = registry.register(Counter(
+    "mexr_broadcast_messages_total", "Messages published to classroom broadcast groups."))
+BROADCAST_DELIVERIES = registry.register(Counter(
+    "mexr_broadcast_deliveries_total", "Broadcast messages queued for a subscriber."))
+BROADCAST_DROPPED = registry.register(Counter(
+    "mexr_broadcast_dropped_total", "Queued broadcast messages dropped because a subscriber fell behind."))
+PREFETCHES = registry.register(Counter(
+    "mexr_prefetch_total", "Speculative prefetches on grab, by outcome.", ("outcome",)))
+PREFETCH_QUERIES = registry.register(Counter(
+    "mexr_prefetch_queries_total", "Grabs with a speculative answer, by whether it served the next query.", ("result",)))
+
+# Label used before the held organ is known, or when it is not in the knowledge base
+ORGAN_NONE = "none"
+ORGAN_UNKNOWN = "unknown"
+
+# Serving path recorded for queries about objects missing from the knowledge base
+SERVED_BY_UNKNOWN_ORGAN = "unknown-organ"
+
+
+class QueryMetrics:
+    """Labels and timestamps for the query handled in the current context."""
+
+    __slots__ = ("scope", "organ", "started", "handler_started", "handler_finished", "llm_calls")
+
+    def __init__(self, scope: Optional[Dict[str, Any]] = None, organ: str = ORGAN_NONE,
+                 started: Optional[float] = None):
+        self.scope = scope
+        self.organ = organ
+        self.started = time.perf_counter() if started is None else started
+        self.handler_started: Optional[float] = None
+        self.handler_finished: Optional[float] = None
+        self.llm_calls = 0
+
+    @property
+    def route(self) -> str:
+        """The matched route's path template, so raw session IDs never become labels."""
+        route = self.scope.get("route") if self.scope is not None else None
+        return getattr(route, "path", None) or "unmatched"
+
+    def labels(self) -> Tuple[str, str]:
+        return self.route, self.organ
+
+
+_current_query: ContextVar[Optional[QueryMetrics]] = ContextVar("mexr_query_metrics", default=None)
+
+
+def current_query() -> QueryMetrics:
+    """
+    Get the metrics state of the current query.
+
+    Returns:
+        The current state, or a detached one outside a request
+    """
+    query = _current_query.get()
+    if query is None:
+        query = QueryMetrics()
+        _current_query.set(query)
+    return query
+
+
+def fork_query() -> QueryMetrics:
+    """
+    Give the current task its own query state, for concurrent queries in one request.
+
+    Returns:
+        The new state, with the parent's route
+    """
+    parent = current_query()
+    query = QueryMetrics(scope=parent.scope, started=parent.started)
+    _current_query.set(query)
+    return query
+
+
+def set_organ(organ: str) -> None:
+    """
+    Label the current query's metrics with the held organ.
+
+    Args:
+        organ: Canonical organ ID, or ORGAN_UNKNOWN
+    """
+    current_query().organ = organ
+
+
+def mark_handler_started() -> None:
+    """Record that request parsing and validation have finished."""
+    current_query().handler_started = time.perf_counter()
+
+
+def mark_handler_finished() -> None:
+    """Record that the handler has returned its result, before serialization."""
+    current_query().handler_finished = time.perf_counter()
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """
+    Time a stage of answering the current query.
+
+    Args:
+        name: The stage name, e.g. "kb_lookup"
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        query = current_query()
+        STAGE_DURATION.labels(name, *query.labels()).observe(time.perf_counter() - started)
+
+
+def record_query(served_by: Optional[str]) -> None:
+    """
+    Count a query by the path that served it.
+
+    Args:
+        served_by: The serving path, or None for unknown organs
+    """
+    QUERIES.labels(*current_query().labels(), served_by or SERVED_BY_UNKNOWN_ORGAN).inc()
+
+
+def record_error(kind: str) -> None:
+    """
+    Count an error in the current query.
+
+    Args:
+        kind: Where the error occurred, e.g. "llm" or "stream"
+    """
+    ERRORS.labels(*current_query().labels(), kind).inc()
+
+
+def record_fallback(reason: str) -> None:
+    """
+    Count a query answered by the knowledge base fallback.
+
+    Args:
+        reason: Why the agent was not used, e.g. "deadline" or "circuit_open"
+    """
+    FALLBACKS.labels(*current_query().labels(), reason).inc()
+
+
+@contextmanager
+def agent_run() -> Iterator[None]:
+    """Time an agent run and record how many LLM calls it made."""
+    query = current_query()
+    query.llm_calls = 0
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        labels = query.labels()
+        STAGE_DURATION.labels("agent", *labels).observe(time.perf_counter() - started)
+        AGENT_ITERATIONS.labels(*labels).observe(query.llm_calls)
+
+
+async def monitor_event_loop_lag(interval: float) -> None:
+    """
+    Measure how late the event loop runs a timer, until cancelled.
+
+    Args:
+        interval: Seconds between measurements
+    """
+    lag = EVENT_LOOP_LAG.labels()
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        lag.observe(max(0.0, time.perf_counter() - started - interval))
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware that sets up per-request query metrics.
+
+    Records the total request time, the time spent reading and validating
+    the request before the handler ran, and the time spent serializing the
+    handler's result before the response started.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+
+        query = QueryMetrics(scope=scope)
+        token = _current_query.set(query)
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                now = time.perf_counter()
+                labels = query.labels()
+                if query.handler_started is not None:
+                    STAGE_DURATION.labels("validation", *labels).observe(query.handler_started - query.started)
+                if query.handler_finished is not None:
+                    STAGE_DURATION.labels("serialization", *labels).observe(now - query.handler_finished)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            if scope["type"] == "http":
+                labels = query.labels()
+                REQUEST_DURATION.labels(*labels).observe(time.perf_counter() - query.started)
+                if status >= 500:
+                    ERRORS.labels(*labels, "http").inc()
+            _current_query.reset(token)
+
+
+class AgentMetricsCallback(BaseCallbackHandler):
+    """Records LLM and tool call latency, token usage and errors for the current query."""
+
+    # Run in the caller's context so the current query's labels are visible
+    run_inline = True
+
+    def __init__(self):
+        self._started: Dict[UUID, float] = {}
+
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages: List[List[Any]], *, run_id: UUID, **kwargs: Any) -> None:
+        self._started[run_id] = time.perf_counter()
+        current_query().llm_calls += 1
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any) -> None:
+        started = self._started.pop(run_id, None)
+        labels = current_query().labels()
+        if started is not None:
+            STAGE_DURATION.labels("llm", *labels).observe(time.perf_counter() - started)
+        LLM_CALLS.labels(*labels).inc()
+        usage = self._usage(response)
+        for kind, tokens in usage.items():
+            if tokens:
+                LLM_TOKENS.labels(*labels, kind).inc(tokens)
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._started.pop(run_id, None)
+        record_error("llm")
+
+    def on_tool_start(self, serialized: Dict[str, Any], input_str: str, *, run_id: UUID, **kwargs: Any) -> None:
+        self._started[run_id] = time.perf_counter()
+
+    def on_tool_end(self, output: Any, *, run_id: UUID, name: Optional[str] = None, **kwargs: Any) -> None:
+        started = self._started.pop(run_id, None)
+        labels = current_query().labels()
+        if started is not None:
+            STAGE_DURATION.labels("tool", *labels).observe(time.perf_counter() - started)
+        TOOL_CALLS.labels(*labels, name or "unknown").inc()
+
+    def on_tool_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._started.pop(run_id, None)
+        record_error("tool")
+
+    @staticmethod
+    def _usage(response: LLMResult) -> Dict[str, int]:
+        """Extract prompt, cached and completion token counts from an LLM result."""
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                if usage:
+                    details = usage.get("input_token_details") or {}
+                    return {
+                        "prompt": usage.get("input_tokens", 0),
+                        "cached": details.get("cache_read", 0) or 0,
+                        "completion": usage.get("output_tokens", 0),
+                    }
+        token_usage = (response.llm_output or {}).get("token_usage") or {}
+        details = token_usage.get("prompt_tokens_details") or {}
+        return {
+            "prompt": token_usage.get("prompt_tokens", 0),
+            "cached": details.get("cached_tokens", 0) or 0,
+            "completion": token_usage.get("completion_tokens", 0),
+        }
+
+
+# Global callback handler, attached to the LLM and the agent's tools
+agent_metrics = AgentMetricsCallback()
@@ -1,7 +1,9 @@
 """Pydantic models for API request and response validation."""
 
 from pydantic import BaseModel, Field
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Literal, Optional
+
+from app.config import BATCH_MAX_SIZE
 
 
 class VRQueryContext(BaseModel):
@@ -28,6 +30,26 @@ class VRQueryRequest(BaseModel):
     )
 
 
+class VRContextEvent(BaseModel):
+    """Request model for the context event endpoint, sent when the user grabs or releases an object."""
+    sessionID: str = Field(
+        ...,
+        description="A unique identifier for the user session.",
+        example="user_session_xyz123"
+    )
+    event: Literal["grab", "release"] = Field(..., description="Whether the object was picked up or put down.")
+    context: Optional[VRQueryContext] = Field(None, description="The grabbed object; required for grab events.")
+
+
+class VRContextEventResponse(BaseModel):
+    """Response model for the context event endpoint."""
+    prefetch: str = Field(
+        ...,
+        description="What the event did: started, shared, ready, busy, capped, active, disabled, "
+                    "unknown-organ, released or idle."
+    )
+
+
 class Action(BaseModel):
     """Action to be performed in the VR scene."""
     command: str
@@ -40,3 +62,34 @@ class VRQueryResponse(BaseModel):
     displayText: str
     spokenResponse: str
     actions: List[Action]
+
+
+class VRBroadcastResponse(BaseModel):
+    """Response model for the group broadcast query endpoint."""
+    groupID: str = Field(..., description="The broadcast group the answer was published to.")
+    subscribers: int = Field(..., description="Connections the answer was pushed to.")
+    servedBy: Optional[str] = Field(None, description="Path that served the query: fast-path, pack, cache, agent or fallback.")
+    response: VRQueryResponse
+
+
+class VRQueryBatchRequest(BaseModel):
+    """Request model for the batch query endpoint."""
+    requests: List[VRQueryRequest] = Field(
+        ...,
+        min_length=1,
+        max_length=BATCH_MAX_SIZE,
+        description="The queries to process."
+    )
+
+
+class VRQueryBatchItem(BaseModel):
+    """Result for a single query in a batch."""
+    index: int = Field(..., description="Position of the query in the batch request.")
+    response: Optional[VRQueryResponse] = None
+    servedBy: Optional[str] = Field(None, description="Path that served the query: fast-path, pack, cache, agent or fallback.")
+    error: Optional[str] = Field(None, description="Error message if the query failed.")
+
+
+class VRQueryBatchResponse(BaseModel):
+    """Response model for the batch query endpoint."""
+    results: List[VRQueryBatchItem]
@@ -0,0 +1,297 @@
+"""Speculative answers prepared when a trainee picks up an organ.
+
+The headset knows which organ is held seconds before the question is
+spoken. On grab it reports the organ, and the most likely question about it
+(the first canonical question, "What does the ... do?") is answered in the
+background and put in the response cache under each of its phrasings. If
+the trainee then asks it, the query is served from the cache, or waits for
+the speculative run already in flight instead of starting a second one.
+
+Speculative runs are the first thing to give way:
+- they are skipped while the question is already answerable, the circuit
+  breaker is not closed, or every admission slot is taken
+- they are capped per session and across the process
+- they are cancelled when the organ is put down or another is picked up,
+  unless another session that grabbed the same organ still wants the answer
+
+Hit-rate counters show whether the speculation pays off.
+"""
+
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from app import metrics
+from app.answer_pack import answer_pack, canonical_questions
+from app.cache import normalize_cache_query, response_cache
+from app.config import (
+    PREFETCH_ENABLED,
+    PREFETCH_MAX_RUNS_PER_SESSION,
+    PREFETCH_MAX_CONCURRENT,
+    PREFETCH_MAX_SESSIONS,
+)
+from app.models import VRQueryResponse
+from app.prompts import get_organ_prompt_block
+
+logger = logging.getLogger(__name__)
+
+# What a grab did
+STATUS_DISABLED = "disabled"
+STATUS_ACTIVE = "active"
+STATUS_READY = "ready"
+STATUS_CAPPED = "capped"
+STATUS_BUSY = "busy"
+STATUS_STARTED = "started"
+STATUS_SHARED = "shared"
+
+# Answers the likeliest question about an organ, or returns None to skip when the agent is busy
+Answerer = Callable[[str, str, Dict[str, Any]], Awaitable[Optional[VRQueryResponse]]]
+
+RunKey = Tuple[str, str]
+
+
+class _Run:
+    """A speculative agent run and the sessions waiting on it."""
+
+    __slots__ = ("task", "sessions")
+
+    def __init__(self, task: "asyncio.Task[Optional[VRQueryResponse]]", session_id: str):
+        self.task = task
+        self.sessions: Set[str] = {session_id}
+
+    @property
+    def failed(self) -> bool:
+        """Whether the run ended without an answer."""
+        task = self.task
+        return task.done() and (task.cancelled() or task.exception() is not None or task.result() is None)
+
+
+class _Grab:
+    """The organ a session is holding and what was prepared for it."""
+
+    __slots__ = ("organ_id", "queries", "run", "counted")
+
+    def __init__(self, organ_id: str, queries: Set[str], run: Optional[_Run] = None):
+        self.organ_id = organ_id
+        self.queries = queries
+        self.run = run
+        self.counted = False
+
+
+def likely_questions(organ_id: str, organ_info: Dict[str, Any]) -> List[str]:
+    """
+    Get the phrasings of the question most likely asked about a held organ.
+
+    Args:
+        organ_id: The unique identifier of the organ
+        organ_info: Knowledge base entry for the organ
+
+    Returns:
+        Phrasings of the first canonical question, the one to send to the
+        agent first; empty if the organ has none
+    """
+    questions = canonical_questions(organ_id, organ_info)
+    return next(iter(questions.values()), [])
+
+
+class Prefetcher:
+    """Starts, shares and cancels speculative runs, and counts whether they are used."""
+
+    def __init__(self, enabled: bool = PREFETCH_ENABLED, max_runs_per_session: int = PREFETCH_MAX_RUNS_PER_SESSION,
+                 max_concurrent: int = PREFETCH_MAX_CONCURRENT, max_sessions: int = PREFETCH_MAX_SESSIONS):
+        self.enabled = enabled
+        self.max_runs_per_session = max_runs_per_session
+        self.max_concurrent = max_concurrent
+        self.max_sessions = max_sessions
+        self._grabs: Dict[str, _Grab] = {}
+        self._runs: Dict[RunKey, _Run] = {}
+        # Speculative runs started per session, in least recently used order
+        self._session_runs: "OrderedDict[str, int]" = OrderedDict()
+        self.outcomes: Dict[str, int] = {}
+        self.hits = 0
+        self.misses = 0
+        self.unused = 0
+
+    def _count(self, outcome: str) -> str:
+        self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+        metrics.PREFETCHES.labels(outcome).inc()
+        return outcome
+
+    def grab(self, session_id: str, organ_id: str, organ_info: Dict[str, Any], answer: Answerer,
+             agent_available: bool = True) -> str:
+        """
+        Start preparing for a session's questions about the organ it picked up.
+
+        Any earlier grab of the session is released first.
+
+        Args:
+            session_id: The VR session holding the organ
+            organ_id: The unique identifier of the held organ
+            organ_info: Knowledge base entry for the held organ
+            answer: Runs the agent on a question about the organ
+            agent_available: False to only warm up, e.g. while the circuit breaker is open
+
+        Returns:
+            What was done, one of the STATUS_* values
+        """
+        current = self._grabs.get(session_id)
+        if current is not None and current.organ_id == organ_id:
+            return STATUS_ACTIVE
+        self.release(session_id)
+        if not self.enabled or not response_cache.enabled:
+            return STATUS_DISABLED
+
+        # Build the organ's prompt block now rather than when the question arrives
+        get_organ_prompt_block(organ_id, organ_info)
+        phrasings = likely_questions(organ_id, organ_info)
+        pack = answer_pack.pack
+        if not phrasings or (pack is not None and pack.get(organ_id, phrasings[0]) is not None) or \
+                response_cache.contains(organ_id, phrasings[0]):
+            return self._count(STATUS_READY)
+
+        queries = {normalize_cache_query(query) for query in phrasings}
+        key = (organ_id, normalize_cache_query(phrasings[0]))
+        run = self._runs.get(key)
+        if run is not None:
+            run.sessions.add(session_id)
+            self._grabs[session_id] = _Grab(organ_id, queries, run)
+            return self._count(STATUS_SHARED)
+
+        runs = self._session_runs.pop(session_id, 0)
+        self._session_runs[session_id] = runs
+        if len(self._session_runs) > self.max_sessions:
+            self._session_runs.popitem(last=False)
+        if runs >= self.max_runs_per_session:
+            return self._count(STATUS_CAPPED)
+        if not agent_available or len(self._runs) >= self.max_concurrent:
+            return self._count(STATUS_BUSY)
+
+        self._session_runs[session_id] = runs + 1
+        task = asyncio.ensure_future(self._prepare(organ_id, organ_info, phrasings, answer))
+        run = self._runs[key] = _Run(task, session_id)
+        task.add_done_callback(lambda done: self._finish(key, run))
+        self._grabs[session_id] = _Grab(organ_id, queries, run)
+        return self._count(STATUS_STARTED)
+
+    async def _prepare(self, organ_id: str, organ_info: Dict[str, Any], phrasings: List[str],
+                       answer: Answerer) -> Optional[VRQueryResponse]:
+        """Answer the likeliest question and cache the answer under each of its phrasings."""
+        response = await answer(phrasings[0], organ_id, organ_info)
+        if response is not None:
+            for query in phrasings:
+                response_cache.put(organ_id, query, response)
+        return response
+
+    def _finish(self, key: RunKey, run: _Run) -> None:
+        if self._runs.get(key) is run:
+            del self._runs[key]
+        task = run.task
+        if task.cancelled():
+            self._count("cancelled")
+        elif task.exception() is not None:
+            logger.warning("Speculative answer failed", exc_info=task.exception())
+            self._count("failed")
+        else:
+            self._count("prepared" if task.result() is not None else "skipped")
+
+    def release(self, session_id: str) -> bool:
+        """
+        Stop preparing for a session that put its organ down.
+
+        The speculative run is cancelled unless another session that grabbed
+        the same organ still waits for it.
+
+        Args:
+            session_id: The VR session
+
+        Returns:
+            True if the session was holding an organ
+        """
+        grab = self._grabs.pop(session_id, None)
+        if grab is None:
+            return False
+        run = grab.run
+        if run is not None:
+            if not grab.counted and not run.failed:
+                # Put down before asking anything
+                self.unused += 1
+                metrics.PREFETCH_QUERIES.labels("unused").inc()
+            run.sessions.discard(session_id)
+            if not run.sessions and not run.task.done():
+                run.task.cancel()
+        return True
+
+    async def wait(self, session_id: str, organ_id: str, query: str, timeout: Optional[float]) -> None:
+        """
+        Wait for a speculative run that is preparing the answer to a query.
+
+        Args:
+            session_id: The VR session asking
+            organ_id: The unique identifier of the held organ
+            query: The user's query
+            timeout: Longest wait in seconds, or None for no limit
+        """
+        grab = self._grabs.get(session_id)
+        if grab is None or grab.run is None or grab.organ_id != organ_id or grab.run.task.done():
+            return
+        if normalize_cache_query(query) not in grab.queries:
+            return
+        # asyncio.wait neither raises the run's error nor cancels it on timeout
+        await asyncio.wait({grab.run.task}, timeout=timeout)
+
+    def record_query(self, session_id: str, organ_id: str, query: str, from_cache: bool) -> None:
+        """
+        Count whether a session's first agent-bound question after a grab was served by the speculative answer.
+
+        Args:
+            session_id: The VR session asking
+            organ_id: The unique identifier of the held organ
+            query: The user's query
+            from_cache: Whether the response cache served the query
+        """
+        grab = self._grabs.get(session_id)
+        if grab is None or grab.run is None or grab.counted or grab.organ_id != organ_id:
+            return
+        grab.counted = True
+        if grab.run.failed:
+            return
+        if from_cache and normalize_cache_query(query) in grab.queries:
+            self.hits += 1
+            metrics.PREFETCH_QUERIES.labels("hit").inc()
+        else:
+            self.misses += 1
+            metrics.PREFETCH_QUERIES.labels("miss").inc()
+
+    def reset(self) -> None:
+        """Cancel every speculative run and forget all sessions."""
+        for session_id in list(self._grabs):
+            self.release(session_id)
+        self._session_runs.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get prefetch statistics.
+
+        Returns:
+            Dictionary with the limits, sessions holding an organ, runs in
+            flight, counts by grab and run outcome, and the hit rate: the
+            share of speculative answers that served the next question
+        """
+        used = self.hits + self.misses + self.unused
+        return {
+            "enabled": self.enabled,
+            "max_runs_per_session": self.max_runs_per_session,
+            "max_concurrent": self.max_concurrent,
+            "holding": len(self._grabs),
+            "in_flight": len(self._runs),
+            "outcomes": dict(self.outcomes),
+            "hits": self.hits,
+            "misses": self.misses,
+            "unused": self.unused,
+            "hit_rate": round(self.hits / used, 4) if used else None,
+        }
+
+
+# Global prefetcher, fed by grab and release events
+prefetcher = Prefetcher()
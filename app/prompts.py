@@ -0,0 +1,280 @@
+"""Prompt layout for the agent, laid out for provider-side prompt caching.
+
+OpenAI caches the longest previously seen prefix of a prompt. The messages
+are therefore ordered from most to least stable: the static system prompt,
+then the held organ's facts (identical for every query about that organ),
+then the session's chat history, and finally the user's query. Reference
+passages retrieved for the query vary with every request, so they are part
+of the final human turn rather than the system messages.
+
+The provider only caches prefixes of at least PROMPT_CACHE_MIN_TOKENS
+tokens. The stable prefix is currently far shorter (about 240 tokens of
+system prompt plus under 100 per organ, with the tool schemas adding a few
+hundred more), so today no prompt is cached and this layout brings no
+latency gain. It only keeps the prefix reusable should the system prompt,
+tools or organ facts grow past the minimum; `/medtech/prompt/stats` shows
+whether any tokens are actually served from the cache.
+"""
+
+import logging
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import LLMResult
+
+from app.config import LLM_MODEL
+from app.knowledge_base import KnowledgeIndex, knowledge_base
+from app.retrieval import Passage
+
+logger = logging.getLogger(__name__)
+
+SYSTEM_PROMPT = """
+        You are an expert anatomy AI assistant for a medical training VR simulation.
+        Your role is to answer user questions about human organs and to trigger helpful actions in the VR scene.
+
+        You will receive the user's spoken question and the ID of the organ they are currently holding.
+
+        Your task is to:
+        1.  Provide a clear and concise answer to the user's question. This answer will be used for both display text and text-to-speech in the VR app.
+        2.  If the question is about location (e.g., "where does this go?"), you MUST use the `highlight_object` tool to highlight the correct anatomical socket for the held organ.
+        3.  You can use other tools, like `play_sound`, to provide additional feedback.
+        4.  Formulate a final response that includes the text answer and a list of all tool-generated actions.
+        5.  When reference passages are provided with the question, base your answer on them.
+        """
+
+STRUCTURED_OUTPUT_INSTRUCTIONS = """
+        Respond in a single step: put the spoken answer in `answer` and list every VR action to perform in `actions`.
+        Each action names its tool (`highlight_object` or `play_sound`) in `tool` together with that tool's arguments.
+        """
+
+# Shortest prompt prefix the provider caches
+PROMPT_CACHE_MIN_TOKENS = 1024
+
+_encoding = None
+
+
+def count_tokens(text: str) -> int:
+    """
+    Count the tokens in a piece of prompt text.
+
+    Uses the model's tiktoken encoding when it is available and falls back
+    to an estimate of four characters per token.
+
+    Args:
+        text: The text to measure
+
+    Returns:
+        Number of tokens
+    """
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.encoding_for_model(LLM_MODEL)
+        except Exception:
+            _encoding = False
+    if _encoding:
+        return len(_encoding.encode(text))
+    return (len(text) + 3) // 4
+
+
+# Layout of the prompt block describing the held organ
+ORGAN_BLOCK_TEMPLATE = """
+    Held Organ: {displayName} (ID: {organ_id})
+    Correct Socket ID for this organ: {socketID}
+    Function of this organ: {function}
+    General description: {description}
+    """
+
+
+def build_organ_block(organ_id: str, organ_info: Dict[str, Any]) -> str:
+    """
+    Build the prompt block describing a held organ.
+
+    Args:
+        organ_id: The unique identifier for the organ
+        organ_info: Knowledge base entry for the organ
+
+    Returns:
+        The organ's facts formatted for the prompt
+    """
+    return ORGAN_BLOCK_TEMPLATE.format(
+        organ_id=organ_id,
+        displayName=organ_info["displayName"],
+        socketID=organ_info["socketID"],
+        function=organ_info["function"],
+        description=organ_info["description"],
+    )
+
+
+def build_query_block(query: str, passages: Sequence[Passage] = ()) -> str:
+    """
+    Build the human turn for a query.
+
+    Args:
+        query: The user's spoken question
+        passages: Reference passages retrieved for the query
+
+    Returns:
+        The reference passages and query formatted for the prompt
+    """
+    if not passages:
+        return f'User Query: "{query}"'
+    references = "\n".join(f"[{i}] {passage.title}: {passage.text}" for i, passage in enumerate(passages, 1))
+    return f'Reference passages:\n{references}\n\nUser Query: "{query}"'
+
+
+# Organ prompt blocks, built on first use or during warm-up; token counts are measured on first use
+ORGAN_PROMPT_BLOCKS: Dict[str, str] = {}
+_ORGAN_BLOCK_TOKENS: Dict[str, int] = {}
+_SYSTEM_PROMPT_TOKENS: Optional[int] = None
+
+
+def build_organ_prompt_blocks(index: Optional[KnowledgeIndex] = None) -> Dict[str, str]:
+    """
+    Build the prompt blocks of every organ in the knowledge base.
+
+    Run during warm-up so the first query about each organ does not build
+    its block, and after every knowledge base reload.
+
+    Args:
+        index: The knowledge base index to build from; the current one if omitted
+
+    Returns:
+        Dictionary of organ ID to prompt block
+    """
+    if index is None:
+        index = knowledge_base.index
+    blocks = {organ_id: build_organ_block(organ_id, organ_info) for organ_id, organ_info in index.organs.items()}
+    ORGAN_PROMPT_BLOCKS.clear()
+    ORGAN_PROMPT_BLOCKS.update(blocks)
+    _ORGAN_BLOCK_TOKENS.clear()
+    return ORGAN_PROMPT_BLOCKS
+
+
+knowledge_base.add_reload_listener(build_organ_prompt_blocks)
+
+
+def get_organ_prompt_block(organ_id: str, organ_info: Dict[str, Any]) -> str:
+    """
+    Get the prompt block for an organ, building it on first use.
+
+    Args:
+        organ_id: The unique identifier for the organ
+        organ_info: Knowledge base entry, used if the block is not built yet
+
+    Returns:
+        The organ's prompt block
+    """
+    block = ORGAN_PROMPT_BLOCKS.get(organ_id)
+    if block is None:
+        block = ORGAN_PROMPT_BLOCKS[organ_id] = build_organ_block(organ_id, organ_info)
+    return block
+
+
+def log_prompt_sections(organ_id: str, organ_block: str, chat_history: List[BaseMessage], query_block: str) -> Dict[str, int]:
+    """
+    Log the token count of each prompt section.
+
+    Args:
+        organ_id: The unique identifier of the held organ
+        organ_block: The organ's prompt block
+        chat_history: The session's chat history
+        query_block: The human turn
+
+    Returns:
+        Dictionary of token counts per section
+    """
+    global _SYSTEM_PROMPT_TOKENS
+    if not logger.isEnabledFor(logging.INFO):
+        return {}
+    if _SYSTEM_PROMPT_TOKENS is None:
+        _SYSTEM_PROMPT_TOKENS = count_tokens(SYSTEM_PROMPT)
+    organ_tokens = _ORGAN_BLOCK_TOKENS.get(organ_id)
+    if organ_tokens is None:
+        organ_tokens = _ORGAN_BLOCK_TOKENS[organ_id] = count_tokens(organ_block)
+    sections = {
+        "system": _SYSTEM_PROMPT_TOKENS,
+        "organ": organ_tokens,
+        "history": sum(count_tokens(message.content) for message in chat_history),
+        "query": count_tokens(query_block),
+    }
+    sections["stable_prefix"] = sections["system"] + sections["organ"]
+    if sections["stable_prefix"] < PROMPT_CACHE_MIN_TOKENS:
+        logger.info("Prompt tokens by section: %s; the stable prefix is below the %d tokens the provider caches",
+                    sections, PROMPT_CACHE_MIN_TOKENS)
+    else:
+        logger.info("Prompt tokens by section: %s", sections)
+    return sections
+
+
+class PromptCacheStats(BaseCallbackHandler):
+    """Records prompt and cached token usage, and latency, for every LLM call."""
+
+    def __init__(self):
+        self._started: Dict[UUID, float] = {}
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.cached_calls = 0
+        self._cached_latency = 0.0
+        self._uncached_latency = 0.0
+
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages: List[List[BaseMessage]], *, run_id: UUID, **kwargs: Any) -> None:
+        self._started[run_id] = time.perf_counter()
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any) -> None:
+        started = self._started.pop(run_id, None)
+        latency = time.perf_counter() - started if started is not None else 0.0
+        prompt_tokens, cached_tokens = self._usage(response)
+        self.calls += 1
+        self.prompt_tokens += prompt_tokens
+        self.cached_tokens += cached_tokens
+        if cached_tokens:
+            self.cached_calls += 1
+            self._cached_latency += latency
+        else:
+            self._uncached_latency += latency
+        logger.info("LLM call: %d prompt tokens, %d cached, %.3fs", prompt_tokens, cached_tokens, latency)
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._started.pop(run_id, None)
+
+    @staticmethod
+    def _usage(response: LLMResult) -> Tuple[int, int]:
+        """Extract prompt and cached token counts from an LLM result."""
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                if usage:
+                    details = usage.get("input_token_details") or {}
+                    return usage.get("input_tokens", 0), details.get("cache_read", 0) or 0
+        token_usage = (response.llm_output or {}).get("token_usage") or {}
+        details = token_usage.get("prompt_tokens_details") or {}
+        return token_usage.get("prompt_tokens", 0), details.get("cached_tokens", 0) or 0
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get prompt caching statistics.
+
+        Returns:
+            Dictionary with token totals, the cached token ratio and the mean
+            latency of calls with and without a cache hit
+        """
+        uncached_calls = self.calls - self.cached_calls
+        return {
+            "calls": self.calls,
+            "prompt_tokens": self.prompt_tokens,
+            "cached_tokens": self.cached_tokens,
+            "cached_ratio": self.cached_tokens / self.prompt_tokens if self.prompt_tokens else 0.0,
+            "cached_calls": self.cached_calls,
+            "mean_latency_cached": self._cached_latency / self.cached_calls if self.cached_calls else None,
+            "mean_latency_uncached": self._uncached_latency / uncached_calls if uncached_calls else None,
+        }
+
+
+# Global prompt cache statistics, attached to the LLM as a callback
+prompt_cache_stats = PromptCacheStats()
@@ -0,0 +1,160 @@
+"""Circuit breaker for calls to the LLM.
+
+While the upstream API is failing or slow, waiting for it only makes every
+headset wait with it. The breaker watches recent agent runs and, once too
+many of them fail or run slow, sends queries straight to the knowledge base
+fallback for a while before letting a single trial run through.
+"""
+
+import logging
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Optional, Tuple
+
+from app import metrics
+from app.config import (
+    BREAKER_ENABLED,
+    BREAKER_WINDOW_SECONDS,
+    BREAKER_MIN_CALLS,
+    BREAKER_FAILURE_RATE,
+    BREAKER_SLOW_CALL_SECONDS,
+    BREAKER_SLOW_CALL_RATE,
+    BREAKER_OPEN_SECONDS,
+)
+
+logger = logging.getLogger(__name__)
+
+STATE_CLOSED = "closed"
+STATE_HALF_OPEN = "half_open"
+STATE_OPEN = "open"
+
+# Values of the state gauge
+_STATE_VALUES = {STATE_CLOSED: 0, STATE_HALF_OPEN: 1, STATE_OPEN: 2}
+
+
+class CircuitBreaker:
+    """
+    Opens when the failure or slow-call rate of recent calls crosses a threshold.
+
+    Closed: every call is allowed and its outcome recorded. Open: calls are
+    refused until `open_seconds` have passed. Half-open: one trial call is
+    allowed; its success closes the breaker and its failure opens it again.
+    """
+
+    def __init__(self, name: str, enabled: bool = BREAKER_ENABLED, window_seconds: float = BREAKER_WINDOW_SECONDS,
+                 min_calls: int = BREAKER_MIN_CALLS, failure_rate: float = BREAKER_FAILURE_RATE,
+                 slow_call_seconds: float = BREAKER_SLOW_CALL_SECONDS, slow_call_rate: float = BREAKER_SLOW_CALL_RATE,
+                 open_seconds: float = BREAKER_OPEN_SECONDS, clock: Callable[[], float] = time.monotonic):
+        self.name = name
+        self.enabled = enabled
+        self.window_seconds = window_seconds
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_rate = slow_call_rate
+        self.open_seconds = open_seconds
+        self._clock = clock
+        # (finished at, succeeded, slow) for calls in the window
+        self._calls: Deque[Tuple[float, bool, bool]] = deque()
+        self._state = STATE_CLOSED
+        self._opened_at = 0.0
+        self._trial_started: Optional[float] = None
+        self.rejected = 0
+        metrics.CIRCUIT_STATE.labels(name).set(_STATE_VALUES[STATE_CLOSED])
+
+    @property
+    def state(self) -> str:
+        """The current state, moving from open to half-open once the open period is over."""
+        if self._state == STATE_OPEN and self._clock() - self._opened_at >= self.open_seconds:
+            self._transition(STATE_HALF_OPEN)
+        return self._state
+
+    def allow(self) -> bool:
+        """
+        Check whether a call may go upstream.
+
+        Returns:
+            True if the call should be made, False if it should fall back
+        """
+        if not self.enabled:
+            return True
+        state = self.state
+        if state == STATE_CLOSED:
+            return True
+        now = self._clock()
+        # A trial whose outcome was never recorded (e.g. a cancelled request) expires
+        if state == STATE_HALF_OPEN and (self._trial_started is None or now - self._trial_started >= self.open_seconds):
+            self._trial_started = now
+            return True
+        self.rejected += 1
+        return False
+
+    def record(self, succeeded: bool, duration: float) -> None:
+        """
+        Record the outcome of an allowed call.
+
+        Args:
+            succeeded: False if the call raised or ran out of time
+            duration: Seconds the call took
+        """
+        if not self.enabled:
+            return
+        slow = duration >= self.slow_call_seconds
+        state = self.state
+        if state == STATE_HALF_OPEN:
+            self._trial_started = None
+            self._transition(STATE_CLOSED if succeeded and not slow else STATE_OPEN)
+            return
+        if state == STATE_OPEN:
+            return
+
+        now = self._clock()
+        self._calls.append((now, succeeded, slow))
+        while self._calls and now - self._calls[0][0] > self.window_seconds:
+            self._calls.popleft()
+        calls = len(self._calls)
+        if calls < self.min_calls:
+            return
+        failures = sum(1 for _, ok, _ in self._calls if not ok)
+        slow_calls = sum(1 for _, _, is_slow in self._calls if is_slow)
+        if failures / calls >= self.failure_rate or slow_calls / calls >= self.slow_call_rate:
+            self._transition(STATE_OPEN)
+
+    def reset(self) -> None:
+        """Close the breaker and forget recorded calls."""
+        self._trial_started = None
+        self._transition(STATE_CLOSED)
+        self._calls.clear()
+
+    def _transition(self, state: str) -> None:
+        if state == self._state:
+            return
+        logger.warning("Circuit breaker %s is now %s", self.name, state, extra={"breaker": self.name})
+        self._state = state
+        if state == STATE_OPEN:
+            self._opened_at = self._clock()
+        # Outcomes from before a state change say nothing about the upstream now
+        self._calls.clear()
+        metrics.CIRCUIT_STATE.labels(self.name).set(_STATE_VALUES[state])
+        metrics.CIRCUIT_TRANSITIONS.labels(self.name, state).inc()
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get breaker statistics.
+
+        Returns:
+            Dictionary with the state, calls in the window, their failure and
+            slow-call counts, and calls rejected while open
+        """
+        return {
+            "state": self.state,
+            "enabled": self.enabled,
+            "window_calls": len(self._calls),
+            "window_failures": sum(1 for _, ok, _ in self._calls if not ok),
+            "window_slow_calls": sum(1 for _, _, slow in self._calls if slow),
+            "rejected": self.rejected,
+        }
+
+
+# Global breaker in front of the agent's LLM calls
+llm_breaker = CircuitBreaker("llm")
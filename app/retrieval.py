@@ -0,0 +1,182 @@
+"""Local lexical retrieval over the anatomy reference corpus.
+
+Passages are loaded from a JSON file (``RETRIEVAL_CORPUS_PATH``) on first use
+and indexed with BM25. The per-term weights of every passage are precomputed
+into a NumPy matrix, so scoring a query is a column gather and a row sum
+with no network round-trip.
+"""
+
+import hashlib
+import json
+import re
+import threading
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from app.config import RETRIEVAL_CORPUS_PATH, RETRIEVAL_TOP_K, RETRIEVAL_ORGAN_BOOST
+
+# BM25 term frequency saturation and document length normalization
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+_STOP_WORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "can", "do", "does", "for", "from", "has",
+    "have", "how", "i", "in", "is", "it", "its", "me", "of", "on", "or", "so", "that", "the",
+    "their", "them", "there", "these", "they", "this", "to", "was", "what", "when", "where",
+    "which", "who", "why", "with", "you", "your", "about", "tell", "into", "than", "then",
+}
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Split text into index terms.
+
+    Args:
+        text: Passage or query text
+
+    Returns:
+        Lower-cased terms with stop words removed and plurals folded
+    """
+    terms = []
+    for word in _TOKEN_PATTERN.findall(text.lower()):
+        if word in _STOP_WORDS:
+            continue
+        if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        terms.append(word)
+    return terms
+
+
+class Passage:
+    """A reference passage from the corpus."""
+
+    __slots__ = ("id", "organ", "title", "text")
+
+    def __init__(self, id: str, organ: Optional[str], title: str, text: str):
+        self.id = id
+        self.organ = organ
+        self.title = title
+        self.text = text
+
+
+class PassageIndex:
+    """BM25 index over a fixed set of passages."""
+
+    def __init__(self, passages: List[Passage], version: str = ""):
+        self.passages = passages
+        # Content hash of the corpus file the passages were loaded from
+        self.version = version
+        documents = [tokenize(f"{passage.title} {passage.text}") for passage in passages]
+        self.vocabulary: Dict[str, int] = {}
+        for terms in documents:
+            for term in terms:
+                self.vocabulary.setdefault(term, len(self.vocabulary))
+
+        tf = np.zeros((len(passages), len(self.vocabulary)), dtype=np.float32)
+        for row, terms in enumerate(documents):
+            for term in terms:
+                tf[row, self.vocabulary[term]] += 1
+
+        lengths = tf.sum(axis=1, keepdims=True)
+        avg_length = lengths.mean() if len(passages) else 1.0
+        df = np.count_nonzero(tf, axis=0)
+        idf = np.log1p((len(passages) - df + 0.5) / (df + 0.5)).astype(np.float32)
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths / avg_length)
+        # Each passage's BM25 contribution per term, so scoring is a sum over query columns
+        self.weights = idf * tf * (BM25_K1 + 1) / (tf + norm)
+        self._organs = np.array([passage.organ or "" for passage in passages])
+
+    @classmethod
+    def from_file(cls, path: str) -> "PassageIndex":
+        """
+        Load and index a corpus file.
+
+        Args:
+            path: Path to the JSON corpus file
+
+        Returns:
+            The indexed corpus
+        """
+        with open(path, "rb") as f:
+            raw = f.read()
+        data = json.loads(raw)
+        return cls([Passage(**entry) for entry in data["passages"]], hashlib.sha256(raw).hexdigest()[:16])
+
+    def search(self, query: str, k: int, organ_id: Optional[str] = None) -> List[Passage]:
+        """
+        Find the passages most relevant to a query.
+
+        Args:
+            query: The text to match
+            k: Maximum number of passages to return
+            organ_id: Passages about this organ are ranked higher
+
+        Returns:
+            Up to k passages with a positive score, best first
+        """
+        columns = [self.vocabulary[term] for term in tokenize(query) if term in self.vocabulary]
+        if not columns or k <= 0:
+            return []
+        scores = self.weights[:, columns].sum(axis=1)
+        if organ_id is not None:
+            scores = np.where(self._organs == organ_id, scores * RETRIEVAL_ORGAN_BOOST, scores)
+        k = min(k, int(np.count_nonzero(scores)))
+        if k == 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [self.passages[i] for i in top]
+
+
+class PassageRetriever:
+    """Lazily built passage index."""
+
+    def __init__(self, path: str = RETRIEVAL_CORPUS_PATH):
+        self.path = path
+        self._index: Optional[PassageIndex] = None
+        self._load_lock = threading.Lock()
+
+    @property
+    def index(self) -> PassageIndex:
+        """The passage index, built from the corpus file on first access."""
+        index = self._index
+        if index is None:
+            with self._load_lock:
+                if self._index is None:
+                    self._index = PassageIndex.from_file(self.path)
+                index = self._index
+        return index
+
+    @property
+    def version(self) -> str:
+        """Content hash of the loaded corpus file."""
+        return self.index.version
+
+
+# Global passage retriever instance
+passage_retriever = PassageRetriever()
+
+
+def retrieve_passages(query: str, organ_id: str, organ_info: Dict[str, Any],
+                      k: int = RETRIEVAL_TOP_K) -> List[Passage]:
+    """
+    Select the reference passages to include in the prompt for a query.
+
+    The held organ's name is added to the query so that deictic questions
+    ("what does this do?") still match passages about the organ.
+
+    Args:
+        query: The user's query
+        organ_id: The unique identifier of the held organ
+        organ_info: Knowledge base entry for the organ
+        k: Maximum number of passages; 0 disables retrieval
+
+    Returns:
+        The most relevant passages, best first
+    """
+    if k <= 0:
+        return []
+    return passage_retriever.index.search(f"{query} {organ_info['displayName']}", k, organ_id=organ_id)
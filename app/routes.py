@@ -1,82 +1,1108 @@
 """API route handlers."""
 
-from fastapi import APIRouter
+import asyncio
+import json
+import logging
+import threading
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
 
-from app.models import VRQueryRequest, VRQueryResponse
-from app.knowledge_base import get_organ_info
+from fastapi import APIRouter, Header, HTTPException, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import ValidationError
+
+from app.config import ADMIN_TOKEN, WS_RELEASE_SESSION_ON_DISCONNECT, BATCH_MAX_CONCURRENCY, QUERY_DEADLINE_SECONDS
+from app.models import (
+    VRQueryRequest,
+    VRQueryResponse,
+    VRQueryContext,
+    VRQueryBatchRequest,
+    VRQueryBatchItem,
+    VRQueryBatchResponse,
+    VRBroadcastResponse,
+    VRContextEvent,
+    VRContextEventResponse,
+)
+from app.knowledge_base import get_organ_info, resolve_organ_id, knowledge_base
+from app.intent import classify_intent, answer_from_knowledge_base, fallback_answer
+from app.cache import response_cache, is_follow_up, normalize_cache_query
+from app.answer_pack import answer_pack
+from app.concurrency import KeyedLocks, SingleFlight
+from app.retrieval import retrieve_passages
+from app.prompts import (
+    build_query_block,
+    get_organ_prompt_block,
+    log_prompt_sections,
+    prompt_cache_stats,
+)
+from app.streaming import TTSChunker, format_sse, iter_agent_events
+from app.websocket import SessionSocket, connection_registry
 from app.agent import create_agent
+from app.http_client import llm_http_client
+from app.resilience import STATE_CLOSED, llm_breaker
+from app.routing import TIER_FULL, model_router
+from app.admission import (
+    AdmissionRejected,
+    check_rate_limits,
+    client_rate_limiter,
+    llm_admission,
+    session_rate_limiter,
+)
+from app.serialization import (
+    NEGOTIATED_RESPONSES,
+    encode_response,
+    encode_unknown_organ,
+    encoded_response,
+    negotiate,
+    unknown_organ_response,
+)
+from app.prefetch import prefetcher
 from app.session import session_manager
+from app.startup import startup_state
+from app import metrics
+from app.logs import bind_session
 
 router = APIRouter()
 
-# Initialize the agent once
-agent_executor = create_agent()
+logger = logging.getLogger(__name__)
+
+# Response header reporting which path served a query
+SERVED_BY_HEADER = "X-MeXR-Served-By"
+PATH_FAST = "fast-path"
+PATH_CACHE = "cache"
+PATH_PACK = "pack"
+PATH_AGENT = "agent"
+PATH_FALLBACK = "fallback"
+
+# Prefetch status of a grab of an object missing from the knowledge base
+PREFETCH_UNKNOWN_ORGAN = "unknown-organ"
+
+# Why a query that needed the agent was answered by the fallback
+FALLBACK_DEADLINE = "deadline"
+FALLBACK_CIRCUIT_OPEN = "circuit_open"
+FALLBACK_AGENT_ERROR = "agent_error"
 
+# The agent is created on first use or during startup warm-up
+agent_executor = None
+_agent_lock = threading.Lock()
 
-@router.post("/medtech/query", response_model=VRQueryResponse)
-async def process_vr_query(request: VRQueryRequest):
+# Turns of the same session run one at a time, in arrival order
+session_locks = KeyedLocks()
+
+# Identical in-flight queries share one answer
+query_flight = SingleFlight()
+
+
+def get_agent():
     """
-    Process a query from the VR application.
+    Get the agent, creating it on first use.
+    
+    Returns:
+        The configured agent
+    """
+    global agent_executor
+    if agent_executor is None:
+        with _agent_lock:
+            if agent_executor is None:
+                agent_executor = create_agent()
+    return agent_executor
+
+
+def get_tier_agent(tier: str):
+    """
+    Get the agent of a model tier.
     
     Args:
-        request: VRQueryRequest containing session ID, context, and user query
+        tier: TIER_FULL for the main agent, or TIER_FAST
         
     Returns:
-        VRQueryResponse with display text, spoken response, and actions
+        The tier's agent
     """
-    print(f"Received request for session {request.sessionID}: {request.query}")
-    print(f"Context (Held Object): {request.context.heldObject}")
+    if tier == TIER_FULL:
+        return get_agent()
+    return model_router.get_fast_agent(create_agent)
 
-    # Retrieve organ info from knowledge base
-    organ_id = request.context.heldObject
+
+async def close_agent() -> None:
+    """Cancel speculative runs, drop the agents and close the LLM connection pool they use."""
+    global agent_executor
+    prefetcher.reset()
+    with _agent_lock:
+        agent_executor = None
+    model_router.reset()
+    await llm_http_client.aclose()
+
+
+async def warm_up_agent() -> None:
+    """Send one agent request so the client's connections to the API are open before the first query."""
+    organ_id = next(iter(knowledge_base.index.organs))
     organ_info = get_organ_info(organ_id)
+    await get_agent().ainvoke({
+        "input": build_query_block("What is this organ?"),
+        "organ_context": get_organ_prompt_block(organ_id, organ_info),
+        "chat_history": [],
+    })
+
+
+def _lookup_organ(held_object: str) -> Tuple[str, Optional[Dict[str, Any]]]:
+    """
+    Resolve the held object to a knowledge base entry.
+    
+    Args:
+        held_object: The held object ID sent by the VR client
+        
+    Returns:
+        Tuple of the canonical organ ID (or the original ID if unknown) and
+        its knowledge base entry (None if unknown)
+    """
+    with metrics.stage("kb_lookup"):
+        organ_id = resolve_organ_id(held_object)
+        organ_info = get_organ_info(organ_id) if organ_id is not None else None
+        metrics.set_organ(organ_id if organ_info is not None else metrics.ORGAN_UNKNOWN)
+    if organ_info is None:
+        return held_object, None
+    return organ_id, organ_info
 
-    if not organ_info:
-        return VRQueryResponse(
-            displayText=f"Error: Organ with ID '{organ_id}' not found.",
-            spokenResponse="I'm sorry, I don't have information about that object.",
-            actions=[]
-        )
 
-    # Construct the input for the LangChain agent
-    input_prompt = f"""
-    User Query: "{request.query}"
-    Held Organ: {organ_info['displayName']} (ID: {organ_id})
-    Correct Socket ID for this organ: {organ_info['socketID']}
-    Function of this organ: {organ_info['function']}
-    General description: {organ_info['description']}
+def _may_need_agent(request: VRQueryRequest) -> bool:
     """
+    Tell whether a query may need the agent, without looking at the answer pack or cache.
+    
+    Used to charge a batch's rate limits before it runs; queries about
+    unknown objects and knowledge base questions never reach the agent.
+    """
+    organ_id = resolve_organ_id(request.context.heldObject)
+    organ_info = get_organ_info(organ_id) if organ_id is not None else None
+    return organ_info is not None and classify_intent(request.query, organ_id, organ_info) is None
+
+
+def _find_local_answer(
+    request: VRQueryRequest, organ_id: str, organ_info: Dict[str, Any]
+) -> Tuple[Optional[VRQueryResponse], str]:
+    """
+    Try to answer a query without running the agent.
+    
+    Placement and identification questions are answered from the knowledge
+    base, canonical questions from the pre-generated answer pack, and
+    repeated questions from the response cache.
+    
+    Args:
+        request: The incoming VR query
+        organ_id: The unique identifier of the held organ
+        organ_info: Knowledge base entry for the held organ
+        
+    Returns:
+        Tuple of the response (None if the agent is needed) and the serving path
+    """
+    intent = classify_intent(request.query, organ_id, organ_info)
+    if intent is not None:
+        return VRQueryResponse(**answer_from_knowledge_base(intent, organ_info)), PATH_FAST
+
+    # Follow-up questions depend on session history, so they bypass the pack and the cache
+    if not is_follow_up(request.query):
+        packed_response = answer_pack.get(organ_id, request.query)
+        if packed_response is not None:
+            return packed_response, PATH_PACK
+        cached_response = response_cache.get(organ_id, request.query)
+        if cached_response is not None:
+            prefetcher.record_query(request.sessionID, organ_id, request.query, from_cache=True)
+            return cached_response, PATH_CACHE
+
+    prefetcher.record_query(request.sessionID, organ_id, request.query, from_cache=False)
+    return None, PATH_AGENT
+
+
+def _deadline() -> Optional[float]:
+    """Get the time by which an agent answer must be ready, or None without a budget."""
+    return time.perf_counter() + QUERY_DEADLINE_SECONDS if QUERY_DEADLINE_SECONDS > 0 else None
+
+
+def _time_left(deadline: Optional[float]) -> Optional[float]:
+    """Get the seconds left before a deadline, or None without one."""
+    return None if deadline is None else max(0.0, deadline - time.perf_counter())
+
+
+def _client_key(connection: Any) -> Optional[str]:
+    """Get the address a request or WebSocket came from, used to rate limit per client."""
+    return connection.client.host if connection.client is not None else None
+
+
+def _fallback_response(organ_info: Dict[str, Any], reason: str) -> VRQueryResponse:
+    """Build the knowledge base answer served when the agent is unavailable."""
+    metrics.record_fallback(reason)
+    return VRQueryResponse(**fallback_answer(organ_info))
+
+
+async def _build_agent_input(request: VRQueryRequest, organ_id: str, organ_info: Dict[str, Any]) -> Dict[str, Any]:
+    """Build the agent input variables for a query about the held organ."""
+    # Each organ's block is built once, so the prompt prefix is identical across calls
+    organ_context = get_organ_prompt_block(organ_id, organ_info)
+    with metrics.stage("retrieval"):
+        passages = retrieve_passages(request.query, organ_id, organ_info)
+    input_prompt = build_query_block(request.query, passages)
     
     # Retrieve chat history for the current session
-    chat_history = session_manager.get_history(request.sessionID)
+    with metrics.stage("history_fetch"):
+        chat_history = await session_manager.aget_prompt_history(request.sessionID)
 
-    # Invoke the agent
-    result = await agent_executor.ainvoke({
+    log_prompt_sections(organ_id, organ_context, chat_history, input_prompt)
+    return {
         "input": input_prompt,
+        "organ_context": organ_context,
         "chat_history": chat_history
-    })
-    
-    # Extract the final answer and tool outputs
-    final_answer = result.get("output", "I'm sorry, I encountered an error.")
-    tool_outputs = result.get("intermediate_steps", [])
-    actions_list = [step[1] for step in tool_outputs]
+    }
 
+
+async def _record_turn(request: VRQueryRequest, answer: str) -> None:
+    """Append a turn to the session history."""
+    with metrics.stage("history_update"):
+        await session_manager.aupdate_history(request.sessionID, request.query, answer)
+
+
+async def _complete_agent_answer(
+    request: VRQueryRequest, organ_id: str, final_answer: str, actions_list: list
+) -> VRQueryResponse:
+    """Record an agent answer in the session history and the response cache."""
     # Update chat history
-    session_manager.update_history(request.sessionID, request.query, final_answer)
+    await _record_turn(request, final_answer)
     
-    # Format and return the response
+    # Format the response
     response_data = {
         "displayText": final_answer,
         "spokenResponse": final_answer,
         "actions": actions_list
     }
     
-    print(f"Sending response: {response_data}")
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Sending response", extra={"response": response_data})
+
+    vr_response = VRQueryResponse(**response_data)
+    if not is_follow_up(request.query):
+        response_cache.put(organ_id, request.query, vr_response)
+    return vr_response
+
+
+@router.post("/medtech/query", response_model=VRQueryResponse, responses=NEGOTIATED_RESPONSES)
+async def process_vr_query(request: VRQueryRequest, http_request: Request):
+    """
+    Process a query from the VR application.
+    
+    Placement and identification questions about the held organ are answered
+    directly from the knowledge base. Other questions are served from the
+    response cache when possible, and otherwise go to the agent. Turns of the
+    same session are applied in order, and duplicates of a query that is
+    already in flight share its answer. Queries that need the agent are
+    rate limited per session and per client and wait for one of a limited
+    number of agent slots; refused queries get 429 or 503 with Retry-After.
+    
+    The response is serialized once, as JSON or, for clients that accept
+    it, MessagePack.
+    
+    Args:
+        request: VRQueryRequest containing session ID, context, and user query
+        http_request: The raw HTTP request, used to identify the client and
+            the accepted encodings
+        
+    Returns:
+        VRQueryResponse with display text, spoken response, and actions
+    """
+    metrics.mark_handler_started()
+    bind_session(request.sessionID)
+    logger.info("Received query", extra={"query": request.query, "held_object": request.context.heldObject})
+    media_type = negotiate(http_request.headers.get("accept"))
+
+    organ_id, organ_info = _lookup_organ(request.context.heldObject)
+    if not organ_info:
+        metrics.record_query(None)
+        metrics.mark_handler_finished()
+        return encoded_response(encode_unknown_organ(organ_id, media_type), media_type)
+
+    vr_response, path = await _process_known_query(request, organ_id, organ_info, _client_key(http_request))
+    metrics.mark_handler_finished()
+    return encode_response(vr_response, media_type, headers={SERVED_BY_HEADER: path})
+
+
+async def _process_query(
+    request: VRQueryRequest, client: Optional[str] = None, rate_limit: bool = True
+) -> Tuple[VRQueryResponse, Optional[str]]:
+    """
+    Answer a single query.
+    
+    Args:
+        request: The incoming VR query
+        client: The client address for rate limiting, or None if not known
+        rate_limit: False if the query was already charged to its session's rate limit
+        
+    Returns:
+        Tuple of the response and the serving path (None for unknown organs)
+    """
+    # Retrieve organ info from knowledge base
+    organ_id, organ_info = _lookup_organ(request.context.heldObject)
+
+    if not organ_info:
+        metrics.record_query(None)
+        return unknown_organ_response(organ_id), None
 
-    return VRQueryResponse(**response_data)
+    return await _process_known_query(request, organ_id, organ_info, client, rate_limit)
+
+
+async def _process_known_query(
+    request: VRQueryRequest, organ_id: str, organ_info: Dict[str, Any], client: Optional[str] = None,
+    rate_limit: bool = True
+) -> Tuple[VRQueryResponse, str]:
+    """
+    Answer a single query about a known organ.
+    
+    Args:
+        request: The incoming VR query
+        organ_id: The unique identifier of the held organ
+        organ_info: Knowledge base entry for the held organ
+        client: The client address for rate limiting, or None if not known
+        rate_limit: False if the query was already charged to its session's rate limit
+        
+    Returns:
+        Tuple of the response and the serving path
+    """
+    # Retried duplicates of an in-flight query share its answer
+    flight_key = (request.sessionID, organ_id, normalize_cache_query(request.query))
+    vr_response, path = await query_flight.do(
+        flight_key, lambda: _answer_query(request, organ_id, organ_info, client, rate_limit)
+    )
+    metrics.record_query(path)
+    return vr_response, path
+
+
+async def _answer_query(
+    request: VRQueryRequest, organ_id: str, organ_info: Dict[str, Any], client: Optional[str] = None,
+    rate_limit: bool = True
+) -> Tuple[VRQueryResponse, str]:
+    """
+    Answer a query about a known organ, serialized with other turns of its session.
+    
+    Args:
+        request: The incoming VR query
+        organ_id: The unique identifier of the held organ
+        organ_info: Knowledge base entry for the held organ
+        client: The client address for rate limiting, or None if not known
+        rate_limit: False if the query was already charged to its session's rate limit
+        
+    Returns:
+        Tuple of the response and the path that served it
+        
+    Raises:
+        AdmissionRejected: If the query is rate limited or no agent slot is free
+    """
+    deadline = _deadline()
+    async with session_locks.hold(request.sessionID):
+        # A speculative run preparing this very question is waited for rather than repeated
+        await prefetcher.wait(request.sessionID, organ_id, request.query, _time_left(deadline))
+        local_response, path = _find_local_answer(request, organ_id, organ_info)
+        if local_response is not None:
+            await _record_turn(request, local_response.displayText)
+            return local_response, path
+
+        reason = None
+        if _time_left(deadline) == 0:
+            # The budget was spent waiting for earlier turns of the session
+            reason = FALLBACK_DEADLINE
+        else:
+            if rate_limit:
+                check_rate_limits(request.sessionID, client)
+            if not llm_breaker.allow():
+                reason = FALLBACK_CIRCUIT_OPEN
+        if reason is None:
+            async with llm_admission.slot(_time_left(deadline)) as admitted:
+                if not admitted:
+                    # The budget ran out waiting for an agent slot
+                    reason = FALLBACK_DEADLINE
+                else:
+                    reason, result = await _invoke_agent(request, organ_id, organ_info, deadline)
+
+        if reason is not None:
+            vr_response = _fallback_response(organ_info, reason)
+            await _record_turn(request, vr_response.displayText)
+            return vr_response, PATH_FALLBACK
+        
+        # Extract the final answer and tool outputs
+        final_answer = result.get("output", "I'm sorry, I encountered an error.")
+        tool_outputs = result.get("intermediate_steps", [])
+        actions_list = [step[1] for step in tool_outputs]
+
+        return await _complete_agent_answer(request, organ_id, final_answer, actions_list), PATH_AGENT
+
+
+async def _invoke_agent(
+    request: VRQueryRequest, organ_id: str, organ_info: Dict[str, Any], deadline: Optional[float]
+) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+    """
+    Invoke the agent, cancelling it if it runs past the deadline.
+    
+    A run that times out or fails upstream is answered by the fallback
+    rather than surfacing as an error.
+    
+    Returns:
+        Tuple of the fallback reason (None if the agent answered) and the agent result
+    """
+    agent_input = await _build_agent_input(request, organ_id, organ_info)
+    tier = model_router.choose_tier(request.query)
+    started = time.perf_counter()
+    try:
+        with metrics.agent_run():
+            result = await asyncio.wait_for(get_tier_agent(tier).ainvoke(agent_input), _time_left(deadline))
+    except asyncio.TimeoutError:
+        llm_breaker.record(False, time.perf_counter() - started)
+        logger.warning("Agent missed the latency budget", extra={"deadline_seconds": QUERY_DEADLINE_SECONDS})
+        return FALLBACK_DEADLINE, None
+    except Exception:
+        llm_breaker.record(False, time.perf_counter() - started)
+        logger.exception("Agent run failed")
+        return FALLBACK_AGENT_ERROR, None
+    duration = time.perf_counter() - started
+    llm_breaker.record(True, duration)
+    model_router.record(tier, duration)
+    if model_router.should_escalate(tier, result.get("output", "")):
+        result = await _escalate(agent_input, result, deadline)
+    return None, result
+
+
+async def _escalate(agent_input: Dict[str, Any], result: Dict[str, Any], deadline: Optional[float]) -> Dict[str, Any]:
+    """Rerun a low-confidence fast-tier answer on the full model, keeping it if the rerun fails."""
+    started = time.perf_counter()
+    try:
+        with metrics.agent_run():
+            escalated = await asyncio.wait_for(get_agent().ainvoke(agent_input), _time_left(deadline))
+    except asyncio.TimeoutError:
+        logger.warning("Escalated answer missed the latency budget", extra={"deadline_seconds": QUERY_DEADLINE_SECONDS})
+        return result
+    except Exception:
+        llm_breaker.record(False, time.perf_counter() - started)
+        logger.exception("Escalated answer failed")
+        return result
+    duration = time.perf_counter() - started
+    llm_breaker.record(True, duration)
+    model_router.record(TIER_FULL, duration)
+    return escalated
+
+
+@router.post("/medtech/query/batch", response_model=VRQueryBatchResponse, responses=NEGOTIATED_RESPONSES)
+async def process_vr_query_batch(batch: VRQueryBatchRequest, http_request: Request):
+    """
+    Process a batch of queries with bounded concurrency.
+    
+    Queries of different sessions run concurrently, up to
+    BATCH_MAX_CONCURRENCY at a time; queries of the same session run in
+    input order. A failing query is reported in its own result without
+    affecting the rest of the batch. Before anything runs, each session is
+    charged one rate limit token per query that may need the agent, in a
+    single all-or-nothing charge, so a batch is never cut off partway; the
+    client address is then charged for the admitted sessions' queries
+    together. The items of a session whose bucket holds too few tokens are
+    reported as rate limited, and a batch in which every session is refused,
+    or whose client is refused, gets 429 with Retry-After.
+    
+    Args:
+        batch: VRQueryBatchRequest containing the list of queries
+        http_request: The raw HTTP request, used to read the accepted encodings
+        
+    Returns:
+        VRQueryBatchResponse with one result per query, in input order
+    """
+    metrics.mark_handler_started()
+    logger.info("Received batch", extra={"batch_size": len(batch.requests)})
+
+    semaphore = asyncio.Semaphore(BATCH_MAX_CONCURRENCY)
+    results: List[Optional[VRQueryBatchItem]] = [None] * len(batch.requests)
+
+    # Group queries by session, keeping input order within each session
+    sessions: Dict[str, List[Tuple[int, VRQueryRequest]]] = {}
+    for index, item in enumerate(batch.requests):
+        sessions.setdefault(item.sessionID, []).append((index, item))
+
+    # Charge each session for all of its agent runs at once, then the client for the admitted ones
+    refused: Dict[str, AdmissionRejected] = {}
+    admitted_cost = 0
+    for session_id, items in sessions.items():
+        cost = sum(_may_need_agent(item) for _, item in items)
+        if not cost:
+            continue
+        try:
+            session_rate_limiter.acquire(session_id, cost)
+            admitted_cost += cost
+        except AdmissionRejected as exc:
+            refused[session_id] = exc
+    if refused and len(refused) == len(sessions):
+        raise next(iter(refused.values()))
+    client = _client_key(http_request)
+    if admitted_cost and client is not None:
+        client_rate_limiter.acquire(client, admitted_cost)
+
+    async def run_session(items: List[Tuple[int, VRQueryRequest]]) -> None:
+        for index, item in items:
+            rejection = refused.get(item.sessionID)
+            if rejection is not None:
+                results[index] = VRQueryBatchItem(index=index, error=rejection.detail)
+                continue
+            metrics.fork_query()
+            bind_session(item.sessionID)
+            async with semaphore:
+                try:
+                    vr_response, path = await _process_query(item, rate_limit=False)
+                    results[index] = VRQueryBatchItem(index=index, response=vr_response, servedBy=path)
+                except Exception as exc:
+                    metrics.record_error("batch_item")
+                    logger.exception("Batch item %d failed", index)
+                    results[index] = VRQueryBatchItem(index=index, error=str(exc) or type(exc).__name__)
+
+    await asyncio.gather(*(run_session(items) for items in sessions.values()))
+    metrics.mark_handler_finished()
+    return encode_response(VRQueryBatchResponse(results=results), negotiate(http_request.headers.get("accept")))
+
+
+async def _speculative_answer(query: str, organ_id: str, organ_info: Dict[str, Any]) -> Optional[VRQueryResponse]:
+    """
+    Answer a question before it is asked, for the prefetcher.
+    
+    Speculative runs only take an agent slot that is free right away, so they
+    never queue ahead of real queries, and carry no session history.
+    
+    Returns:
+        The response, or None if every agent slot is taken
+    """
+    if llm_admission.enabled and (llm_admission.in_flight >= llm_admission.max_concurrent or llm_admission.waiting):
+        return None
+    agent_input = {
+        "input": build_query_block(query, retrieve_passages(query, organ_id, organ_info)),
+        "organ_context": get_organ_prompt_block(organ_id, organ_info),
+        "chat_history": [],
+    }
+    tier = model_router.choose_tier(query)
+    async with llm_admission.slot():
+        started = time.perf_counter()
+        try:
+            with metrics.agent_run():
+                result = await asyncio.wait_for(get_tier_agent(tier).ainvoke(agent_input), _time_left(_deadline()))
+        except asyncio.CancelledError:
+            # Put down before the answer was ready
+            raise
+        except Exception:
+            llm_breaker.record(False, time.perf_counter() - started)
+            raise
+    duration = time.perf_counter() - started
+    llm_breaker.record(True, duration)
+    model_router.record(tier, duration)
+    answer = result.get("output", "")
+    return VRQueryResponse(
+        displayText=answer,
+        spokenResponse=answer,
+        actions=[step[1] for step in result.get("intermediate_steps", [])],
+    )
+
+
+def _grab(session_id: str, held_object: str) -> str:
+    """Start speculative work for an object a session picked up, returning the prefetch status."""
+    organ_id, organ_info = _lookup_organ(held_object)
+    if organ_info is None:
+        prefetcher.release(session_id)
+        return PREFETCH_UNKNOWN_ORGAN
+    return prefetcher.grab(session_id, organ_id, organ_info, _speculative_answer,
+                           agent_available=llm_breaker.state == STATE_CLOSED)
+
+
+@router.post("/medtech/context", response_model=VRContextEventResponse)
+async def context_event(event: VRContextEvent):
+    """
+    Report that the user picked up or put down an object.
+    
+    A grab starts speculative work for the held organ: its prompt block is
+    built, and the question most likely asked about it is answered in the
+    background and cached, so the spoken query that follows is often served
+    at once. A release, or a grab of another object, cancels work that is
+    still running.
+    
+    Args:
+        event: VRContextEvent with the session, the event and, for grabs, the held object
+        
+    Returns:
+        VRContextEventResponse reporting what the event did
+    """
+    bind_session(event.sessionID)
+    if event.event == "release":
+        return VRContextEventResponse(prefetch="released" if prefetcher.release(event.sessionID) else "idle")
+    if event.context is None:
+        raise HTTPException(status_code=422, detail="A grab event needs the context with the held object.")
+    logger.info("Object grabbed", extra={"held_object": event.context.heldObject})
+    return VRContextEventResponse(prefetch=_grab(event.sessionID, event.context.heldObject))
+
+
+def _publish_answer(group_id: str, request: VRQueryRequest, response: Any, path: Optional[str]) -> int:
+    """Push a query's answer to every connection subscribed to a broadcast group."""
+    return session_manager.groups.publish(
+        group_id,
+        "broadcast",
+        sessionID=request.sessionID,
+        query=request.query,
+        heldObject=request.context.heldObject,
+        servedBy=path,
+        response=response,
+    )
+
+
+@router.post("/medtech/groups/{group_id}/query", response_model=VRBroadcastResponse, responses=NEGOTIATED_RESPONSES)
+async def broadcast_vr_query(group_id: str, request: VRQueryRequest, http_request: Request):
+    """
+    Answer a query once and push the answer to every headset in a broadcast group.
+    
+    The query is answered like `/medtech/query`, in the asking session, and
+    the response is published as a `broadcast` message to each connection
+    subscribed to the group over its session WebSocket. Subscribers that
+    have fallen behind lose their oldest queued messages rather than slowing
+    the others.
+    
+    Args:
+        group_id: The broadcast group to publish to
+        request: VRQueryRequest of the asking session, usually the instructor's
+        http_request: The raw HTTP request, used to identify the client and
+            the accepted encodings
+        
+    Returns:
+        VRBroadcastResponse with the answer and the number of connections it was pushed to
+    """
+    metrics.mark_handler_started()
+    bind_session(request.sessionID)
+    logger.info("Received broadcast query",
+                extra={"query": request.query, "held_object": request.context.heldObject, "group_id": group_id})
+
+    vr_response, path = await _process_query(request, _client_key(http_request))
+    subscribers = _publish_answer(group_id, request, vr_response, path)
+    metrics.mark_handler_finished()
+    broadcast = VRBroadcastResponse(groupID=group_id, subscribers=subscribers, servedBy=path, response=vr_response)
+    return encode_response(broadcast, negotiate(http_request.headers.get("accept")))
+
+
+QueryEvent = Tuple[str, Dict[str, Any]]
+
+
+async def _stream_response(vr_response: VRQueryResponse, chunker: TTSChunker) -> AsyncIterator[QueryEvent]:
+    """Stream a complete response as action, text and done events."""
+    for action in vr_response.actions:
+        yield "action", action.model_dump()
+    for chunk in chunker.feed(vr_response.spokenResponse):
+        yield "text", {"text": chunk}
+    remainder = chunker.flush()
+    if remainder:
+        yield "text", {"text": remainder}
+    yield "done", vr_response.model_dump()
+
+
+async def _stream_local(
+    request: VRQueryRequest, vr_response: VRQueryResponse, chunker: TTSChunker
+) -> AsyncIterator[QueryEvent]:
+    """Record a locally answered turn in order with the session's other turns and stream it."""
+    async with session_locks.hold(request.sessionID):
+        await _record_turn(request, vr_response.displayText)
+    async for event in _stream_response(vr_response, chunker):
+        yield event
+
+
+async def _stream_agent(
+    request: VRQueryRequest, organ_id: str, organ_info: Dict[str, Any], chunker: TTSChunker
+) -> AsyncIterator[QueryEvent]:
+    """Run the agent and stream actions and answer text as they are produced."""
+    actions_list = []
+    deadline = _deadline()
+    started = None
+    try:
+        async with session_locks.hold(request.sessionID):
+            final_answer = None
+            streamed = False
+            reason = None
+            async with llm_admission.slot(_time_left(deadline)) as admitted:
+                if not admitted:
+                    # The budget ran out waiting for an agent slot
+                    reason = FALLBACK_DEADLINE
+                else:
+                    agent_input = await _build_agent_input(request, organ_id, organ_info)
+                    # Streamed text cannot be taken back, so streams are never escalated
+                    tier = model_router.choose_tier(request.query)
+                    started = time.perf_counter()
+                    with metrics.agent_run():
+                        events = iter_agent_events(get_tier_agent(tier), agent_input)
+                        while True:
+                            try:
+                                kind, payload = await asyncio.wait_for(anext(events), _time_left(deadline))
+                            except StopAsyncIteration:
+                                break
+                            except asyncio.TimeoutError:
+                                logger.warning("Agent missed the latency budget",
+                                               extra={"deadline_seconds": QUERY_DEADLINE_SECONDS})
+                                reason = FALLBACK_DEADLINE
+                                await events.aclose()
+                                break
+                            except Exception:
+                                logger.exception("Agent run failed")
+                                reason = FALLBACK_AGENT_ERROR
+                                break
+                            if kind == "action":
+                                actions_list.append(payload)
+                                yield "action", payload
+                            elif kind == "token":
+                                streamed = True
+                                for chunk in chunker.feed(payload):
+                                    yield "text", {"text": chunk}
+                            else:
+                                final_answer = payload
+                    duration = time.perf_counter() - started
+                    started = None
+                    llm_breaker.record(reason is None, duration)
+                    if reason is None:
+                        model_router.record(tier, duration)
+            if reason is not None:
+                # An unfinished sentence of the cut-off answer is dropped, and the fallback follows what was sent
+                chunker.flush()
+                vr_response = _fallback_response(organ_info, reason)
+                await _record_turn(request, vr_response.displayText)
+                async for event in _stream_response(vr_response, chunker):
+                    yield event
+            elif final_answer is not None:
+                if not streamed:
+                    # The structured engine returns the answer in one piece rather than token by token
+                    for chunk in chunker.feed(final_answer):
+                        yield "text", {"text": chunk}
+                remainder = chunker.flush()
+                if remainder:
+                    yield "text", {"text": remainder}
+                vr_response = await _complete_agent_answer(request, organ_id, final_answer, actions_list)
+                yield "done", vr_response.model_dump()
+    except AdmissionRejected as exc:
+        yield "error", {"detail": exc.detail, "retryAfter": exc.retry_after}
+    except Exception:
+        if started is not None:
+            llm_breaker.record(False, time.perf_counter() - started)
+        metrics.record_error("stream")
+        logger.exception("Streaming error")
+        yield "error", {"detail": "I'm sorry, I encountered an error."}
+
+
+def _start_query_events(
+    request: VRQueryRequest, client: Optional[str] = None
+) -> Tuple[Optional[str], AsyncIterator[QueryEvent]]:
+    """
+    Start processing a query as a stream of events.
+    
+    Args:
+        request: The incoming VR query
+        client: The client address for rate limiting, or None if not known
+        
+    Returns:
+        Tuple of the serving path (None for unknown organs) and an async
+        iterator of (event, data) pairs ending with a done or error event
+        
+    Raises:
+        AdmissionRejected: If the query is rate limited or the agent queue is full
+    """
+    organ_id, organ_info = _lookup_organ(request.context.heldObject)
+    chunker = TTSChunker()
+
+    if not organ_info:
+        metrics.record_query(None)
+        return None, _stream_response(unknown_organ_response(organ_id), chunker)
+
+    local_response, path = _find_local_answer(request, organ_id, organ_info)
+    if local_response is None:
+        # Refuse before any event is sent, so HTTP clients get a proper status code
+        check_rate_limits(request.sessionID, client)
+        if not llm_breaker.allow():
+            local_response, path = _fallback_response(organ_info, FALLBACK_CIRCUIT_OPEN), PATH_FALLBACK
+        else:
+            llm_admission.check_capacity()
+    metrics.record_query(path)
+    if local_response is not None:
+        return path, _stream_local(request, local_response, chunker)
+    return path, _stream_agent(request, organ_id, organ_info, chunker)
+
+
+async def _encode_sse(events: AsyncIterator[QueryEvent]) -> AsyncIterator[str]:
+    """Encode query events as server-sent events."""
+    async for event, data in events:
+        yield format_sse(event, data)
+
+
+@router.post("/medtech/query/stream")
+async def stream_vr_query(request: VRQueryRequest, http_request: Request):
+    """
+    Process a query from the VR application and stream the result as server-sent events.
+    
+    Emits an `action` event as soon as each VR action is produced, `text`
+    events with the answer in sentence-sized chunks for text-to-speech, and a
+    final `done` event carrying the complete VRQueryResponse. Queries refused
+    by admission control get 429 or 503 with Retry-After instead of a stream.
+    
+    Args:
+        request: VRQueryRequest containing session ID, context, and user query
+        http_request: The raw HTTP request, used to identify the client
+        
+    Returns:
+        StreamingResponse of server-sent events
+    """
+    bind_session(request.sessionID)
+    logger.info("Received streaming query", extra={"query": request.query, "held_object": request.context.heldObject})
+
+    path, events = _start_query_events(request, _client_key(http_request))
+    headers = {"Cache-Control": "no-cache"}
+    if path is not None:
+        headers[SERVED_BY_HEADER] = path
+
+    return StreamingResponse(_encode_sse(events), media_type="text/event-stream", headers=headers)
+
+
+async def _handle_socket_query(sock: SessionSocket, message: Dict[str, Any]) -> None:
+    """Run a query received over a session WebSocket and push its events back."""
+    context = message.get("context") or sock.context
+    if context is None:
+        await sock.send("error", requestID=message.get("requestID"), detail="No held object in context.")
+        return
+    try:
+        request = VRQueryRequest(sessionID=sock.session_id, context=context, query=message.get("query"))
+    except ValidationError as exc:
+        await sock.send("error", requestID=message.get("requestID"), detail=str(exc))
+        return
+
+    logger.info("Received WebSocket query", extra={"query": request.query, "held_object": request.context.heldObject})
+    request_id = message.get("requestID")
+    try:
+        path, events = _start_query_events(request, _client_key(sock.websocket))
+    except AdmissionRejected as exc:
+        await sock.send("error", requestID=request_id, detail=exc.detail, retryAfter=exc.retry_after)
+        return
+    async for event, data in events:
+        if event == "action":
+            await sock.send("action", requestID=request_id, action=data)
+        elif event == "text":
+            await sock.send("text", requestID=request_id, text=data["text"])
+        elif event == "done":
+            await sock.send("response", requestID=request_id, servedBy=path, response=data)
+            if message.get("broadcast") and sock.subscription is not None:
+                _publish_answer(sock.subscription.group.group_id, request, data, path)
+        else:
+            await sock.send("error", requestID=request_id, detail=data["detail"], retryAfter=data.get("retryAfter"))
+
+
+async def _join_group(sock: SessionSocket, group_id: Any) -> None:
+    """Subscribe a session WebSocket to a broadcast group, leaving any group it was in."""
+    if not isinstance(group_id, str) or not group_id:
+        await sock.send("error", detail="A groupID is required to join a group.")
+        return
+    _leave_group(sock)
+    subscription = session_manager.groups.subscribe(group_id, sock.session_id)
+    if subscription is None:
+        await sock.send("error", detail=f"Group {group_id!r} is full.")
+        return
+    sock.subscription = subscription
+    sock.broadcast_task = asyncio.create_task(sock.run_broadcasts(subscription))
+    await sock.send("joined", groupID=group_id, members=len(subscription.group.members))
+
+
+def _leave_group(sock: SessionSocket) -> Optional[str]:
+    """End a session WebSocket's broadcast subscription, returning the group it left."""
+    subscription = sock.subscription
+    if subscription is None:
+        return None
+    session_manager.groups.unsubscribe(subscription)
+    if sock.broadcast_task is not None:
+        sock.broadcast_task.cancel()
+    sock.subscription = None
+    sock.broadcast_task = None
+    return subscription.group.group_id
+
+
+async def _handle_socket_message(sock: SessionSocket, message: Dict[str, Any]) -> None:
+    """Dispatch a single message received over a session WebSocket."""
+    message_type = message.get("type")
+    if message_type == "query":
+        await _handle_socket_query(sock, message)
+    elif message_type == "context":
+        try:
+            sock.context = VRQueryContext(**(message.get("context") or {}))
+        except ValidationError as exc:
+            await sock.send("error", detail=str(exc))
+            return
+        await sock.send("context", context=sock.context.model_dump())
+        _grab(sock.session_id, sock.context.heldObject)
+    elif message_type == "release":
+        prefetcher.release(sock.session_id)
+        await sock.send("released")
+    elif message_type == "join":
+        await _join_group(sock, message.get("groupID"))
+    elif message_type == "leave":
+        await sock.send("left", groupID=_leave_group(sock))
+    elif message_type == "ping":
+        await sock.send("pong")
+    elif message_type != "pong":
+        await sock.send("error", detail=f"Unknown message type: {message_type!r}")
+
+
+@router.websocket("/medtech/ws/{session_id}")
+async def session_websocket(websocket: WebSocket, session_id: str):
+    """
+    Persistent WebSocket channel bound to a single VR session.
+    
+    The client sends `context` messages to set the held object once and
+    `query` messages with the spoken question. Actions, text chunks and the
+    final response are pushed back on the same connection, and the session
+    history is shared with the HTTP endpoints. The server sends `ping`
+    heartbeats and closes idle connections. A `join` message subscribes the
+    connection to a classroom broadcast group, whose answers are pushed as
+    `broadcast` messages.
+    
+    Args:
+        websocket: The client connection
+        session_id: The unique session identifier to bind to
+    """
+    await websocket.accept()
+    bind_session(session_id)
+    sock = SessionSocket(websocket, session_id)
+    connection_registry.register(sock)
+    heartbeat_task = asyncio.create_task(sock.run_heartbeat())
+    try:
+        while True:
+            raw = await websocket.receive_text()
+            sock.touch()
+            try:
+                message = json.loads(raw)
+            except ValueError:
+                await sock.send("error", detail="Messages must be JSON objects.")
+                continue
+            if not isinstance(message, dict):
+                await sock.send("error", detail="Messages must be JSON objects.")
+                continue
+            await _handle_socket_message(sock, message)
+            sock.touch()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        heartbeat_task.cancel()
+        _leave_group(sock)
+        last_connection = connection_registry.unregister(sock)
+        if last_connection:
+            prefetcher.release(session_id)
+            if WS_RELEASE_SESSION_ON_DISCONNECT:
+                await session_manager.aclear_history(session_id)
+        logger.info("WebSocket closed")
+
+
+@router.post("/admin/knowledge/reload")
+def reload_knowledge_base(x_admin_token: Optional[str] = Header(default=None)):
+    """
+    Reload the knowledge base file without restarting the workers.
+    
+    Requires the X-Admin-Token header when ADMIN_TOKEN is configured.
+    """
+    if ADMIN_TOKEN and x_admin_token != ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Invalid admin token.")
+    reloaded = knowledge_base.reload(force=True)
+    return {
+        "reloaded": reloaded,
+        "version": knowledge_base.version,
+        "organs": len(knowledge_base.index.organs)
+    }
+
+
+@router.post("/admin/answer-pack/reload")
+def reload_answer_pack(x_admin_token: Optional[str] = Header(default=None)):
+    """
+    Reload the answer pack artifact, e.g. after rebuilding it.
+    
+    Requires the X-Admin-Token header when ADMIN_TOKEN is configured.
+    """
+    if ADMIN_TOKEN and x_admin_token != ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Invalid admin token.")
+    answer_pack.load()
+    return answer_pack.stats()
+
+
+@router.get("/medtech/answer-pack/stats")
+def answer_pack_stats():
+    """Answer pack statistics endpoint."""
+    return answer_pack.stats()
+
+
+@router.get("/medtech/cache/stats")
+def cache_stats():
+    """Response cache statistics endpoint."""
+    return response_cache.stats()
+
+
+@router.get("/medtech/prompt/stats")
+def prompt_stats():
+    """Prompt caching statistics endpoint."""
+    return prompt_cache_stats.stats()
+
+
+@router.get("/medtech/llm/pool/stats")
+def llm_pool_stats():
+    """LLM HTTP connection pool statistics endpoint."""
+    return llm_http_client.stats()
+
+
+@router.get("/medtech/llm/breaker/stats")
+def llm_breaker_stats():
+    """LLM circuit breaker statistics endpoint."""
+    return llm_breaker.stats()
+
+
+@router.get("/medtech/llm/routing/stats")
+def llm_routing_stats():
+    """Model tier routing statistics endpoint."""
+    return model_router.stats()
+
+
+@router.get("/medtech/admission/stats")
+def admission_stats():
+    """Admission control statistics endpoint."""
+    return {
+        "agent_slots": llm_admission.stats(),
+        "session_rate_limit": session_rate_limiter.stats(),
+        "client_rate_limit": client_rate_limiter.stats(),
+    }
+
+
+@router.get("/medtech/prefetch/stats")
+def prefetch_stats():
+    """Speculative prefetch statistics endpoint."""
+    return prefetcher.stats()
+
+
+@router.get("/medtech/groups/stats")
+def group_stats():
+    """Classroom broadcast group statistics endpoint."""
+    return session_manager.groups.stats()
+
+
+@router.get("/medtech/sessions/stats")
+def session_stats():
+    """Session store statistics endpoint."""
+    return session_manager.stats()
+
+
+@router.get("/metrics")
+def metrics_endpoint():
+    """Prometheus metrics endpoint."""
+    return Response(metrics.registry.render(), media_type=metrics.CONTENT_TYPE)
 
 
 @router.get("/health")
 def health_check():
     """Health check endpoint."""
     return {"status": "healthy", "service": "MeXR Backend"}
+
+
+@router.get("/ready")
+def readiness_check():
+    """
+    Readiness endpoint.
+    
+    Returns 200 once startup warm-up has finished and 503 before, with the
+    state of each component and the measured import and time-to-ready durations.
+    """
+    stats = startup_state.stats()
+    return JSONResponse(stats, status_code=200 if stats["ready"] else 503)
@@ -0,0 +1,224 @@
+"""Routing of agent queries between model tiers.
+
+Most questions asked in the headset are short definitional ones ("what does
+this do?") that a small model answers as well as a large one, only faster
+and cheaper. A local classifier scores each query's complexity from its
+wording alone, with no network call, and queries below the threshold go to
+the fast tier. When the fast model hedges, its answer can be rerun on the
+full model.
+"""
+
+import logging
+import re
+import threading
+from typing import Any, Callable, Dict, Optional
+
+from app import metrics
+from app.cache import is_follow_up
+from app.config import (
+    LLM_MODEL,
+    LLM_FAST_MODEL,
+    MODEL_ROUTING_ENABLED,
+    ROUTING_COMPLEXITY_THRESHOLD,
+    ROUTING_ESCALATE_LOW_CONFIDENCE,
+)
+from app.intent import normalize_query
+
+logger = logging.getLogger(__name__)
+
+TIER_FAST = "fast"
+TIER_FULL = "full"
+
+# Words that ask for reasoning rather than a fact
+_REASONING_WORDS = re.compile(
+    r"\b(?:why|explain|compare|compared|comparison|difference|differences|differ|versus|vs|mechanism|"
+    r"relationship|relate|affect|affects|cause|causes|happen|happens|happened|if|would|could|"
+    r"regulate|regulates|interact|interacts|instead)\b"
+)
+# "how" asks for a process unless it asks for a quantity
+_HOW_PROCESS = re.compile(r"\bhow\b(?! (?:many|much|big|large|small|heavy|long|old|tall|wide)\b)")
+# Clinical topics need the careful answers of the full model
+_CLINICAL_WORDS = re.compile(
+    r"\b(?:disease|diseases|disorder|disorders|syndrome|failure|damage|damaged|injury|symptom|symptoms|"
+    r"treat|treatment|transplant|cancer|tumou?r|infection|diagnos\w*|surgery|medication|drug|drugs)\b"
+)
+# A second question joined to the first
+_COMPOUND_QUESTION = re.compile(r"\b(?:and|or|also) (?:what|why|how|where|which|when|who|does|is|can)\b")
+
+# Phrases with which a model admits it could not answer well
+_HEDGES = re.compile(
+    r"\b(?:i'?m not sure|i am not sure|not certain|i don'?t know|i do not know|unclear|"
+    r"can(?:no|')t answer|unable to|no information)\b"
+)
+
+# Words beyond which each extra word adds to the score
+_SHORT_QUERY_WORDS = 8
+
+
+def score_complexity(query: str) -> float:
+    """
+    Estimate how hard a query is to answer well.
+
+    Args:
+        query: The user's query
+
+    Returns:
+        Score between 0 (a simple fact) and 1 (reasoning over several facts)
+    """
+    text = normalize_query(query)
+    score = 0.1
+    reasoning = len(_REASONING_WORDS.findall(text)) + len(_HOW_PROCESS.findall(text))
+    if reasoning:
+        score += 0.4 + 0.15 * (reasoning - 1)
+    if _CLINICAL_WORDS.search(text):
+        score += 0.3
+    if query.count("?") > 1 or _COMPOUND_QUESTION.search(text):
+        score += 0.25
+    if is_follow_up(query):
+        # Answers that build on earlier turns need the context handled carefully
+        score += 0.2
+    score += min(0.3, 0.02 * max(0, len(text.split()) - _SHORT_QUERY_WORDS))
+    return min(1.0, score)
+
+
+def is_low_confidence(answer: str) -> bool:
+    """
+    Check whether an answer hedges or is too short to be useful.
+
+    Args:
+        answer: The agent's text answer
+
+    Returns:
+        True if the answer should be rerun on the full model
+    """
+    text = answer.strip().lower().replace("’", "'")
+    return len(text.split()) < 4 or _HEDGES.search(text) is not None
+
+
+class _TierStats:
+    """Run count and timing of one model tier."""
+
+    __slots__ = ("runs", "seconds", "max_seconds")
+
+    def __init__(self):
+        self.runs = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+
+
+class ModelRouter:
+    """
+    Sends each agent query to the fast or the full model tier.
+
+    The full tier is the app's main agent; the fast tier gets its own agent,
+    built on first use with the same prompt and tools on the fast model.
+    """
+
+    def __init__(self, enabled: bool = MODEL_ROUTING_ENABLED, threshold: float = ROUTING_COMPLEXITY_THRESHOLD,
+                 fast_model: str = LLM_FAST_MODEL, escalate: bool = ROUTING_ESCALATE_LOW_CONFIDENCE):
+        self.enabled = enabled
+        self.threshold = threshold
+        self.models = {TIER_FAST: fast_model, TIER_FULL: LLM_MODEL}
+        self.escalate = escalate
+        self._fast_agent: Optional[Any] = None
+        self._lock = threading.Lock()
+        self._tiers = {tier: _TierStats() for tier in self.models}
+        self.escalations = 0
+
+    def choose_tier(self, query: str) -> str:
+        """
+        Pick the model tier for a query.
+
+        Args:
+            query: The user's query
+
+        Returns:
+            TIER_FAST or TIER_FULL
+        """
+        if not self.enabled:
+            return TIER_FULL
+        return TIER_FAST if score_complexity(query) < self.threshold else TIER_FULL
+
+    def get_fast_agent(self, factory: Callable[..., Any]) -> Any:
+        """
+        Get the fast tier's agent, creating it on first use.
+
+        Args:
+            factory: Agent factory called with the fast model, e.g. `create_agent`
+
+        Returns:
+            The fast tier's agent
+        """
+        if self._fast_agent is None:
+            with self._lock:
+                if self._fast_agent is None:
+                    self._fast_agent = factory(model=self.models[TIER_FAST])
+        return self._fast_agent
+
+    def reset(self) -> None:
+        """Drop the fast tier's agent."""
+        with self._lock:
+            self._fast_agent = None
+
+    def should_escalate(self, tier: str, answer: str) -> bool:
+        """
+        Check whether a fast-tier answer should be rerun on the full model.
+
+        Args:
+            tier: The tier that produced the answer
+            answer: The agent's text answer
+
+        Returns:
+            True if escalation is on and the answer is low confidence
+        """
+        if tier != TIER_FAST or not self.escalate or not is_low_confidence(answer):
+            return False
+        self.escalations += 1
+        metrics.MODEL_ESCALATIONS.labels(*metrics.current_query().labels()).inc()
+        logger.info("Escalating a low-confidence fast-tier answer", extra={"model": self.models[TIER_FULL]})
+        return True
+
+    def record(self, tier: str, duration: float) -> None:
+        """
+        Record a completed agent run.
+
+        Args:
+            tier: The tier that ran
+            duration: Seconds the run took
+        """
+        stats = self._tiers[tier]
+        stats.runs += 1
+        stats.seconds += duration
+        stats.max_seconds = max(stats.max_seconds, duration)
+        metrics.MODEL_TIER_RUNS.labels(*metrics.current_query().labels(), tier).inc()
+        metrics.MODEL_TIER_DURATION.labels(tier).observe(duration)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get routing statistics.
+
+        Returns:
+            Dictionary with the settings, escalations and, per tier, its
+            model, runs, share of runs and mean and max run time
+        """
+        total = sum(stats.runs for stats in self._tiers.values())
+        return {
+            "enabled": self.enabled,
+            "threshold": self.threshold,
+            "escalate": self.escalate,
+            "escalations": self.escalations,
+            "tiers": {
+                tier: {
+                    "model": self.models[tier],
+                    "runs": stats.runs,
+                    "share": round(stats.runs / total, 4) if total else None,
+                    "mean_seconds": round(stats.seconds / stats.runs, 4) if stats.runs else None,
+                    "max_seconds": round(stats.max_seconds, 4),
+                }
+                for tier, stats in self._tiers.items()
+            },
+        }
+
+
+# Global router in front of the agent
+model_router = ModelRouter()
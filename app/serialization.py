@@ -0,0 +1,191 @@
+"""Encoding of query responses for the VR client.
+
+Responses are serialized once, straight from the response model by
+pydantic-core's Rust serializer, instead of being validated again and
+converted to plain Python objects through `response_model` before being
+dumped with the standard library. Clients that send
+`Accept: application/msgpack` get the same schema as MessagePack, which is
+smaller and cheaper to parse on the headset, when the optional `ormsgpack`
+package is installed. The unknown-organ error is pre-encoded in both
+formats, with only the held object's ID spliced in per request.
+"""
+
+import importlib.util
+from typing import Any, Dict, Optional, Tuple
+
+import pydantic_core
+from fastapi import Response
+from pydantic import BaseModel
+
+from app.config import RESPONSE_MSGPACK_ENABLED
+from app.models import VRQueryResponse
+
+MEDIA_JSON = "application/json"
+MEDIA_MSGPACK = "application/msgpack"
+# Media types clients use to ask for MessagePack
+_MSGPACK_MEDIA_TYPES = (MEDIA_MSGPACK, "application/x-msgpack", "application/vnd.msgpack")
+
+UNKNOWN_ORGAN_SPOKEN_RESPONSE = "I'm sorry, I don't have information about that object."
+
+
+def msgpack_available() -> bool:
+    """Whether the `ormsgpack` package needed for MessagePack responses is installed."""
+    return importlib.util.find_spec("ormsgpack") is not None
+
+
+_msgpack_enabled = RESPONSE_MSGPACK_ENABLED and msgpack_available()
+if _msgpack_enabled:
+    import ormsgpack
+
+
+def _accept_quality(params: str) -> float:
+    """Read the q parameter of an Accept header entry."""
+    for param in params.split(";"):
+        name, _, value = param.partition("=")
+        if name.strip().lower() == "q":
+            try:
+                return float(value)
+            except ValueError:
+                return 0.0
+    return 1.0
+
+
+def negotiate(accept: Optional[str]) -> str:
+    """
+    Choose the response encoding from an Accept header.
+
+    MessagePack is chosen when the client lists it and does not prefer JSON
+    over it; anything else, including a MessagePack request the server
+    cannot honour, gets JSON.
+
+    Args:
+        accept: The request's Accept header, if any
+
+    Returns:
+        MEDIA_MSGPACK or MEDIA_JSON
+    """
+    if not accept or not _msgpack_enabled:
+        return MEDIA_JSON
+    msgpack_quality = json_quality = 0.0
+    for entry in accept.split(","):
+        media_type, _, params = entry.partition(";")
+        media_type = media_type.strip().lower()
+        if media_type in _MSGPACK_MEDIA_TYPES:
+            msgpack_quality = max(msgpack_quality, _accept_quality(params))
+        elif media_type in (MEDIA_JSON, "application/*", "*/*"):
+            json_quality = max(json_quality, _accept_quality(params))
+    return MEDIA_MSGPACK if msgpack_quality > 0 and msgpack_quality >= json_quality else MEDIA_JSON
+
+
+def encode(model: BaseModel, media_type: str = MEDIA_JSON) -> bytes:
+    """
+    Serialize a response model in one pass.
+
+    Args:
+        model: The response to encode
+        media_type: MEDIA_JSON or MEDIA_MSGPACK
+
+    Returns:
+        The encoded body
+    """
+    if media_type == MEDIA_MSGPACK:
+        return ormsgpack.packb(model, option=ormsgpack.OPT_SERIALIZE_PYDANTIC)
+    return pydantic_core.to_json(model)
+
+
+def _encode_string(value: str, media_type: str) -> bytes:
+    if media_type == MEDIA_MSGPACK:
+        return ormsgpack.packb(value)
+    return pydantic_core.to_json(value)
+
+
+def _split_template(media_type: str) -> Tuple[bytes, bytes]:
+    """Encode the unknown-organ response with an empty displayText and split it where the text goes."""
+    encoded = encode(_unknown_organ_model(""), media_type)
+    empty = _encode_string("", media_type)
+    key = _encode_string("displayText", media_type) + (b":" if media_type == MEDIA_JSON else b"")
+    split_at = encoded.index(key + empty) + len(key)
+    return encoded[:split_at], encoded[split_at + len(empty):]
+
+
+def _unknown_organ_model(display_text: str) -> VRQueryResponse:
+    return VRQueryResponse(displayText=display_text, spokenResponse=UNKNOWN_ORGAN_SPOKEN_RESPONSE, actions=[])
+
+
+def unknown_organ_display_text(organ_id: str) -> str:
+    """The error text shown for a held object missing from the knowledge base."""
+    return f"Error: Organ with ID '{organ_id}' not found."
+
+
+def unknown_organ_response(organ_id: str) -> VRQueryResponse:
+    """
+    Build the error response for a held object missing from the knowledge base.
+
+    Args:
+        organ_id: The held object's ID
+
+    Returns:
+        The error response
+    """
+    return _unknown_organ_model(unknown_organ_display_text(organ_id))
+
+
+# Encoded unknown-organ response around its displayText, per media type
+_UNKNOWN_ORGAN_TEMPLATES: Dict[str, Tuple[bytes, bytes]] = {
+    media_type: _split_template(media_type)
+    for media_type in ((MEDIA_JSON, MEDIA_MSGPACK) if _msgpack_enabled else (MEDIA_JSON,))
+}
+
+
+def encode_unknown_organ(organ_id: str, media_type: str = MEDIA_JSON) -> bytes:
+    """
+    Encode the unknown-organ error from its pre-encoded template.
+
+    Args:
+        organ_id: The held object's ID
+        media_type: MEDIA_JSON or MEDIA_MSGPACK
+
+    Returns:
+        The same bytes as encoding `unknown_organ_response(organ_id)`
+    """
+    prefix, suffix = _UNKNOWN_ORGAN_TEMPLATES[media_type]
+    return prefix + _encode_string(unknown_organ_display_text(organ_id), media_type) + suffix
+
+
+def encoded_response(body: bytes, media_type: str, headers: Optional[Dict[str, str]] = None) -> Response:
+    """
+    Wrap an encoded body in a response.
+
+    Args:
+        body: The encoded body
+        media_type: MEDIA_JSON or MEDIA_MSGPACK
+        headers: Extra response headers
+
+    Returns:
+        The response, marked as varying with the Accept header
+    """
+    response = Response(content=body, media_type=media_type, headers=headers)
+    response.headers["Vary"] = "Accept"
+    return response
+
+
+def encode_response(model: BaseModel, media_type: str = MEDIA_JSON,
+                    headers: Optional[Dict[str, str]] = None) -> Response:
+    """
+    Serialize a response model in one pass and wrap it in a response.
+
+    Args:
+        model: The response to encode
+        media_type: MEDIA_JSON or MEDIA_MSGPACK
+        headers: Extra response headers
+
+    Returns:
+        The encoded response
+    """
+    return encoded_response(encode(model, media_type), media_type, headers)
+
+
+# OpenAPI description of the negotiated encodings, for routes that return encoded responses
+NEGOTIATED_RESPONSES: Dict[int, Dict[str, Any]] = {
+    200: {"content": {MEDIA_MSGPACK: {}}, "description": "JSON, or MessagePack with `Accept: application/msgpack`"},
+}
@@ -1,20 +1,122 @@
 """Session management for chat history."""
 
-from typing import Dict, List
-from langchain_core.messages import BaseMessage, HumanMessage, AIMessage
+import asyncio
+from typing import Any, Callable, Dict, List, Optional, Tuple, TypeVar
+from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, SystemMessage
 
-from app.config import MAX_CHAT_HISTORY
+from app.config import (
+    MAX_CHAT_HISTORY,
+    HISTORY_TOKEN_BUDGET,
+    HISTORY_SUMMARY_MAX_TOKENS,
+    SESSION_BACKEND,
+    SESSION_SQLITE_PATH,
+    SESSION_REDIS_URL,
+    SESSION_MAX_SESSIONS,
+    SESSION_IDLE_TTL_SECONDS,
+    SESSION_MAX_BYTES,
+    SESSION_SWEEP_INTERVAL_SECONDS,
+)
+from app.session_store import (
+    SessionBackend,
+    InMemorySessionBackend,
+    SQLiteSessionBackend,
+    RedisSessionBackend,
+    Turn,
+)
+from app.history import SUMMARY_HEADER, cached_token_count, extend_summary
+from app.broadcast import GroupRegistry
+
+T = TypeVar("T")
 
 
 class SessionManager:
-    """Manages chat history for user sessions."""
+    """
+    Manages chat history for user sessions.
+    
+    The most recent turns are kept verbatim as long as they fit both the
+    message limit and the history token budget. Older turns are folded into
+    a rolling extractive summary, so the history sent with each prompt stays
+    bounded however long a session runs. The classroom broadcast groups that
+    sessions' connections subscribe to are kept alongside, in `groups`.
+    """
+    
+    def __init__(
+        self,
+        backend: Optional[SessionBackend] = None,
+        max_history: int = MAX_CHAT_HISTORY,
+        max_sessions: int = SESSION_MAX_SESSIONS,
+        idle_ttl: float = SESSION_IDLE_TTL_SECONDS,
+        max_bytes: int = SESSION_MAX_BYTES,
+        token_budget: int = HISTORY_TOKEN_BUDGET,
+        summary_max_tokens: int = HISTORY_SUMMARY_MAX_TOKENS,
+        groups: Optional[GroupRegistry] = None,
+    ):
+        """
+        Args:
+            backend: Storage backend; defaults to an in-memory store built from the limits below
+            max_history: Number of most recent messages returned to the agent
+            max_sessions: Session limit for the default in-memory store
+            idle_ttl: Idle expiry in seconds for the default in-memory store
+            max_bytes: Memory ceiling for the default in-memory store
+            token_budget: Tokens of recent turns sent verbatim
+            summary_max_tokens: Size of the rolling summary of older turns
+            groups: Broadcast group registry; defaults to an empty one
+        """
+        self.max_history = max_history
+        # Keep enough turns to fill the most recent messages
+        self.max_turns = (max_history + 1) // 2
+        self.token_budget = token_budget
+        self.summary_max_tokens = summary_max_tokens
+        self.backend = backend or InMemorySessionBackend(
+            max_sessions=max_sessions, idle_ttl=idle_ttl, max_bytes=max_bytes
+        )
+        self.groups = groups or GroupRegistry()
+        self.history_requests = 0
+        self.history_tokens_sent = 0
+        self.max_history_tokens_sent = 0
+        self.compactions = 0
+        self.turns_summarized = 0
+        self.tokens_saved = 0
+    
+    def _recent_turns(self, turns: List[Turn]) -> Tuple[int, int]:
+        """
+        Find the most recent turns that fit the turn limit and the token budget.
+        
+        Args:
+            turns: Stored turns, oldest first
+            
+        Returns:
+            Tuple of the number of trailing turns that fit and their token count
+        """
+        kept = 0
+        tokens = 0
+        for query, response in reversed(turns):
+            if kept == self.max_turns:
+                break
+            turn_tokens = cached_token_count(query) + cached_token_count(response)
+            if tokens + turn_tokens > self.token_budget:
+                break
+            kept += 1
+            tokens += turn_tokens
+        return kept, tokens
     
-    def __init__(self):
-        self._chat_history_store: Dict[str, List[BaseMessage]] = {}
+    @staticmethod
+    def _to_messages(turns: List[Turn]) -> List[BaseMessage]:
+        messages: List[BaseMessage] = []
+        for query, response in turns:
+            messages.append(HumanMessage(content=query))
+            messages.append(AIMessage(content=response))
+        return messages
     
+    async def _offload(self, func: Callable[..., T], *args: Any) -> T:
+        """Run a history call, in a worker thread if the backend blocks."""
+        if self.backend.blocking:
+            return await asyncio.to_thread(func, *args)
+        return func(*args)
+
     def get_history(self, session_id: str) -> List[BaseMessage]:
         """
-        Retrieve chat history for a session.
+        Retrieve the recent chat history for a session, without the summary.
         
         Args:
             session_id: The unique session identifier
@@ -22,25 +124,81 @@ class SessionManager:
         Returns:
             List of chat messages
         """
-        return self._chat_history_store.get(session_id, [])
+        if not self.max_history:
+            return []
+        turns = self.backend.load_turns(session_id)
+        kept, _ = self._recent_turns(turns)
+        return self._to_messages(turns[len(turns) - kept:])[-self.max_history:]
+    
+    def get_prompt_history(self, session_id: str) -> List[BaseMessage]:
+        """
+        Retrieve the history to send to the agent: the summary of older turns and the recent turns.
+        
+        Args:
+            session_id: The unique session identifier
+            
+        Returns:
+            List of chat messages, starting with a system message carrying the
+            summary when older turns have been summarized
+        """
+        if not self.max_history:
+            return []
+        summary, turns = self.backend.load_session(session_id)
+        kept, tokens = self._recent_turns(turns)
+        messages = self._to_messages(turns[len(turns) - kept:])[-self.max_history:]
+        if summary:
+            tokens += cached_token_count(summary)
+            messages.insert(0, SystemMessage(content=f"{SUMMARY_HEADER}\n{summary}"))
+        self.history_requests += 1
+        self.history_tokens_sent += tokens
+        self.max_history_tokens_sent = max(self.max_history_tokens_sent, tokens)
+        return messages
     
+    async def aget_prompt_history(self, session_id: str) -> List[BaseMessage]:
+        """Async version of `get_prompt_history` that keeps backend I/O off the event loop."""
+        return await self._offload(self.get_prompt_history, session_id)
+
     def update_history(self, session_id: str, query: str, response: str) -> None:
         """
         Update chat history with new interaction.
         
+        Turns that no longer fit the turn limit or the token budget are
+        folded into the session's summary.
+        
         Args:
             session_id: The unique session identifier
             query: The user's query
             response: The AI's response
         """
-        history = self._chat_history_store.get(session_id, [])
-        history.extend([
-            HumanMessage(content=query),
-            AIMessage(content=response)
-        ])
-        # Keep only the most recent messages
-        self._chat_history_store[session_id] = history[-MAX_CHAT_HISTORY:]
+        if not self.max_turns:
+            return
+        # The backend may rerun the compaction if another worker changed the session meanwhile
+        outcome: List[Tuple[Optional[str], Optional[str], List[Turn]]] = []
+        
+        def compact(summary: Optional[str], turns: List[Turn]) -> Tuple[Optional[str], int]:
+            kept, _ = self._recent_turns(turns)
+            folded = turns[:len(turns) - kept]
+            new_summary = extend_summary(summary, folded, self.summary_max_tokens) if folded else summary
+            outcome[:] = [(summary, new_summary, folded)]
+            return new_summary, kept
+        
+        self.backend.append_and_compact(session_id, query, response, self.max_turns, compact)
+        summary, new_summary, folded = outcome[0]
+        if not folded:
+            return
+        
+        self.compactions += 1
+        self.turns_summarized += len(folded)
+        summary_growth = (cached_token_count(new_summary) if new_summary else 0) - (
+            cached_token_count(summary) if summary else 0
+        )
+        folded_tokens = sum(cached_token_count(q) + cached_token_count(r) for q, r in folded)
+        self.tokens_saved += folded_tokens - summary_growth
     
+    async def aupdate_history(self, session_id: str, query: str, response: str) -> None:
+        """Async version of `update_history` that keeps backend I/O off the event loop."""
+        await self._offload(self.update_history, session_id, query, response)
+
     def clear_history(self, session_id: str) -> None:
         """
         Clear chat history for a session.
@@ -48,9 +206,74 @@ class SessionManager:
         Args:
             session_id: The unique session identifier
         """
-        if session_id in self._chat_history_store:
-            del self._chat_history_store[session_id]
+        self.backend.delete(session_id)
+
+    async def aclear_history(self, session_id: str) -> None:
+        """Async version of `clear_history` that keeps backend I/O off the event loop."""
+        await self._offload(self.clear_history, session_id)
+
+    def sweep(self) -> int:
+        """
+        Remove sessions that have been idle longer than the TTL.
+        
+        Returns:
+            Number of sessions removed
+        """
+        return self.backend.sweep()
+
+    async def run_sweeper(self, interval: float = SESSION_SWEEP_INTERVAL_SECONDS) -> None:
+        """
+        Periodically remove idle sessions until cancelled.
+        
+        Args:
+            interval: Seconds between sweeps
+        """
+        while True:
+            await asyncio.sleep(interval)
+            await self._offload(self.sweep)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get session store statistics.
+        
+        Returns:
+            Dictionary of backend statistics such as session count and bytes
+            held, and history budget statistics: prompt history tokens sent
+            (mean and max), compactions, turns summarized, and the tokens
+            removed from later prompts by summarizing
+        """
+        stats = self.backend.stats()
+        stats["history"] = {
+            "token_budget": self.token_budget,
+            "summary_max_tokens": self.summary_max_tokens,
+            "requests": self.history_requests,
+            "mean_tokens_sent": self.history_tokens_sent / self.history_requests if self.history_requests else 0.0,
+            "max_tokens_sent": self.max_history_tokens_sent,
+            "compactions": self.compactions,
+            "turns_summarized": self.turns_summarized,
+            "tokens_saved": self.tokens_saved,
+        }
+        return stats
+
+
+def create_session_backend(kind: str = SESSION_BACKEND) -> SessionBackend:
+    """
+    Create the session storage backend selected in the configuration.
+    
+    Args:
+        kind: One of "memory", "sqlite" or "redis"
+        
+    Returns:
+        The configured session backend
+    """
+    if kind == "memory":
+        return InMemorySessionBackend()
+    if kind == "sqlite":
+        return SQLiteSessionBackend(SESSION_SQLITE_PATH)
+    if kind == "redis":
+        return RedisSessionBackend(url=SESSION_REDIS_URL)
+    raise ValueError(f"Unknown SESSION_BACKEND '{kind}'. Expected 'memory', 'sqlite' or 'redis'.")
 
 
 # Global session manager instance
-session_manager = SessionManager()
+session_manager = SessionManager(backend=create_session_backend())
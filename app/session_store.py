@@ -0,0 +1,588 @@
+"""Storage backends for session chat history."""
+
+import json
+import sqlite3
+import sys
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+from app.config import (
+    SESSION_MAX_SESSIONS,
+    SESSION_IDLE_TTL_SECONDS,
+    SESSION_MAX_BYTES,
+)
+
+# A stored (query, response) exchange
+Turn = Tuple[str, str]
+
+# Given a session's summary and its turns, oldest first, returns the new
+# summary and the number of most recent turns to keep
+Compactor = Callable[[Optional[str], List[Turn]], Tuple[Optional[str], int]]
+
+
+class SessionBackend(ABC):
+    """Interface for session history storage."""
+
+    # Whether calls wait on disk or the network, so callers on the event loop run them in a thread
+    blocking = False
+
+    @abstractmethod
+    def load_turns(self, session_id: str) -> List[Turn]:
+        """
+        Load the stored turns for a session and refresh its idle timer.
+
+        Args:
+            session_id: The unique session identifier
+
+        Returns:
+            List of (query, response) tuples, oldest first
+        """
+
+    @abstractmethod
+    def load_session(self, session_id: str) -> Tuple[Optional[str], List[Turn]]:
+        """
+        Load the summary of older turns and the stored turns, and refresh the idle timer.
+
+        Args:
+            session_id: The unique session identifier
+
+        Returns:
+            Tuple of the summary (None if there is none) and the list of
+            (query, response) tuples, oldest first
+        """
+
+    @abstractmethod
+    def append_turn(self, session_id: str, query: str, response: str, max_turns: int) -> None:
+        """
+        Append a turn and trim the session to its most recent turns in one operation.
+
+        Args:
+            session_id: The unique session identifier
+            query: The user's query
+            response: The AI's response
+            max_turns: Number of most recent turns to keep
+        """
+
+    @abstractmethod
+    def compact(self, session_id: str, summary: Optional[str], keep_turns: int) -> None:
+        """
+        Replace the summary and drop all but the most recent turns in one operation.
+
+        Args:
+            session_id: The unique session identifier
+            summary: The new summary covering the dropped turns, or None
+            keep_turns: Number of most recent turns to keep
+        """
+
+    @abstractmethod
+    def append_and_compact(self, session_id: str, query: str, response: str, max_turns: int,
+                           compactor: Compactor) -> None:
+        """
+        Append a turn and fold older turns into the summary in one atomic read-modify-write.
+
+        Workers sharing the backend cannot interleave between reading the
+        session and writing it back, so no turn is lost and the summary
+        always matches the turns kept. The compactor may be called more
+        than once if the session changes concurrently.
+
+        Args:
+            session_id: The unique session identifier
+            query: The user's query
+            response: The AI's response
+            max_turns: Most recent turns to keep at most
+            compactor: Decides the new summary and the turns to keep, given
+                the summary and the turns including the new one
+        """
+
+    @abstractmethod
+    def delete(self, session_id: str) -> None:
+        """
+        Delete all stored history and the summary for a session.
+
+        Args:
+            session_id: The unique session identifier
+        """
+
+    def sweep(self) -> int:
+        """
+        Remove sessions that have been idle longer than the TTL.
+
+        Returns:
+            Number of sessions removed
+        """
+        return 0
+
+    @abstractmethod
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get storage statistics.
+
+        Returns:
+            Dictionary of backend-specific counters
+        """
+
+
+class _TurnRecord:
+    """A single query/response exchange."""
+
+    __slots__ = ("query", "response")
+
+    def __init__(self, query: str, response: str):
+        self.query = query
+        self.response = response
+
+    def size(self) -> int:
+        """Approximate memory held by this turn in bytes."""
+        return sys.getsizeof(self) + sys.getsizeof(self.query) + sys.getsizeof(self.response)
+
+
+class _SessionEntry:
+    """Stored history and bookkeeping for one session."""
+
+    __slots__ = ("turns", "summary", "last_access", "size")
+
+    def __init__(self, max_turns: int):
+        self.turns: Deque[_TurnRecord] = deque(maxlen=max_turns)
+        self.summary: Optional[str] = None
+        self.last_access = time.monotonic()
+        self.size = 0
+
+
+class InMemorySessionBackend(SessionBackend):
+    """Process-local session store with idle TTL, LRU eviction and a memory ceiling."""
+
+    def __init__(
+        self,
+        max_sessions: int = SESSION_MAX_SESSIONS,
+        idle_ttl: float = SESSION_IDLE_TTL_SECONDS,
+        max_bytes: int = SESSION_MAX_BYTES,
+    ):
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.max_bytes = max_bytes
+        # Sessions in least-recently-used order
+        self._sessions: "OrderedDict[str, _SessionEntry]" = OrderedDict()
+        self._bytes = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def load_turns(self, session_id: str) -> List[Turn]:
+        entry = self._get_entry(session_id)
+        if entry is None:
+            return []
+        return [(turn.query, turn.response) for turn in entry.turns]
+
+    def load_session(self, session_id: str) -> Tuple[Optional[str], List[Turn]]:
+        entry = self._get_entry(session_id)
+        if entry is None:
+            return None, []
+        return entry.summary, [(turn.query, turn.response) for turn in entry.turns]
+
+    def append_turn(self, session_id: str, query: str, response: str, max_turns: int) -> None:
+        entry = self._get_entry(session_id)
+        if entry is None or entry.turns.maxlen != max_turns:
+            previous = entry
+            entry = _SessionEntry(max_turns=max_turns)
+            if previous is not None:
+                self._bytes -= previous.size
+                for turn in previous.turns:
+                    self._append(entry, turn)
+                self._set_summary(entry, previous.summary)
+            self._sessions[session_id] = entry
+            self._sessions.move_to_end(session_id)
+        self._append(entry, _TurnRecord(query, response))
+        self._enforce_limits(keep=session_id)
+
+    def compact(self, session_id: str, summary: Optional[str], keep_turns: int) -> None:
+        entry = self._get_entry(session_id)
+        if entry is None:
+            return
+        while len(entry.turns) > keep_turns:
+            dropped = entry.turns.popleft().size()
+            entry.size -= dropped
+            self._bytes -= dropped
+        self._set_summary(entry, summary)
+
+    def append_and_compact(self, session_id: str, query: str, response: str, max_turns: int,
+                           compactor: Compactor) -> None:
+        # Nothing else runs between the read and the writes in this process
+        summary, turns = self.load_session(session_id)
+        turns.append((query, response))
+        new_summary, keep = compactor(summary, turns)
+        self.append_turn(session_id, query, response, max_turns)
+        if new_summary != summary or keep < len(turns):
+            self.compact(session_id, new_summary, min(keep, max_turns))
+
+    def delete(self, session_id: str) -> None:
+        if session_id in self._sessions:
+            self._remove(session_id)
+
+    def sweep(self) -> int:
+        cutoff = time.monotonic() - self.idle_ttl
+        removed = 0
+        # Entries are in access order, so stop at the first live session
+        while self._sessions:
+            session_id, entry = next(iter(self._sessions.items()))
+            if entry.last_access > cutoff:
+                break
+            self._remove(session_id)
+            removed += 1
+        self.expirations += removed
+        return removed
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": "memory",
+            "sessions": len(self._sessions),
+            "turns": sum(len(entry.turns) for entry in self._sessions.values()),
+            "bytes": self._bytes,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+    def _append(self, entry: _SessionEntry, turn: _TurnRecord) -> None:
+        """Append a turn to an entry, accounting for any turn pushed out of the window."""
+        if entry.turns.maxlen is not None and len(entry.turns) == entry.turns.maxlen:
+            if entry.turns.maxlen == 0:
+                return
+            dropped = entry.turns[0].size()
+            entry.size -= dropped
+            self._bytes -= dropped
+        entry.turns.append(turn)
+        entry.size += turn.size()
+        self._bytes += turn.size()
+
+    def _set_summary(self, entry: _SessionEntry, summary: Optional[str]) -> None:
+        """Replace an entry's summary, accounting for its size."""
+        size_change = (sys.getsizeof(summary) if summary else 0) - (sys.getsizeof(entry.summary) if entry.summary else 0)
+        entry.summary = summary
+        entry.size += size_change
+        self._bytes += size_change
+
+    def _get_entry(self, session_id: str) -> Optional[_SessionEntry]:
+        """Look up a live session entry and mark it as recently used."""
+        entry = self._sessions.get(session_id)
+        if entry is None:
+            return None
+        now = time.monotonic()
+        if now - entry.last_access > self.idle_ttl:
+            self._remove(session_id)
+            self.expirations += 1
+            return None
+        entry.last_access = now
+        self._sessions.move_to_end(session_id)
+        return entry
+
+    def _enforce_limits(self, keep: str) -> None:
+        """Evict least recently used sessions until within the session and memory limits."""
+        while len(self._sessions) > self.max_sessions or self._bytes > self.max_bytes:
+            session_id = next(iter(self._sessions))
+            if session_id == keep:
+                break
+            self._remove(session_id)
+            self.evictions += 1
+
+    def _remove(self, session_id: str) -> None:
+        entry = self._sessions.pop(session_id)
+        self._bytes -= entry.size
+
+
+class SQLiteSessionBackend(SessionBackend):
+    """
+    Session store in a SQLite database file.
+
+    Every worker process on a host can share the same file. Writes run in a
+    single transaction per turn, so the append and the trim are atomic, and
+    a turn that also compacts the session reads it inside that transaction.
+    """
+
+    blocking = True
+
+    def __init__(self, path: str, idle_ttl: float = SESSION_IDLE_TTL_SECONDS):
+        self.path = path
+        self.idle_ttl = idle_ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS sessions (
+                    session_id TEXT PRIMARY KEY,
+                    last_access REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS turns (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    session_id TEXT NOT NULL,
+                    query TEXT NOT NULL,
+                    response TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_turns_session ON turns (session_id, seq);
+            """)
+            # Databases created before summaries were stored lack the column
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(sessions)")}
+            if "summary" not in columns:
+                self._conn.execute("ALTER TABLE sessions ADD COLUMN summary TEXT")
+
+    def load_turns(self, session_id: str) -> List[Turn]:
+        return self.load_session(session_id)[1]
+
+    def load_session(self, session_id: str) -> Tuple[Optional[str], List[Turn]]:
+        now = time.time()
+        with self._lock:
+            # The read refreshes last_access, so take the write lock up front rather than upgrading
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT last_access, summary FROM sessions WHERE session_id = ?", (session_id,)
+                ).fetchone()
+                if row is None:
+                    self._conn.execute("COMMIT")
+                    return None, []
+                if now - row[0] > self.idle_ttl:
+                    self._delete(session_id)
+                    self._conn.execute("COMMIT")
+                    return None, []
+                turns = self._conn.execute(
+                    "SELECT query, response FROM turns WHERE session_id = ? ORDER BY seq", (session_id,)
+                ).fetchall()
+                self._conn.execute(
+                    "UPDATE sessions SET last_access = ? WHERE session_id = ?", (now, session_id)
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return row[1], [(query, response) for query, response in turns]
+
+    def append_turn(self, session_id: str, query: str, response: str, max_turns: int) -> None:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "INSERT INTO sessions (session_id, last_access) VALUES (?, ?) "
+                    "ON CONFLICT(session_id) DO UPDATE SET last_access = excluded.last_access",
+                    (session_id, time.time())
+                )
+                self._conn.execute(
+                    "INSERT INTO turns (session_id, query, response) VALUES (?, ?, ?)",
+                    (session_id, query, response)
+                )
+                self._conn.execute(
+                    "DELETE FROM turns WHERE session_id = ? AND seq NOT IN "
+                    "(SELECT seq FROM turns WHERE session_id = ? ORDER BY seq DESC LIMIT ?)",
+                    (session_id, session_id, max_turns)
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def compact(self, session_id: str, summary: Optional[str], keep_turns: int) -> None:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute("UPDATE sessions SET summary = ? WHERE session_id = ?", (summary, session_id))
+                self._conn.execute(
+                    "DELETE FROM turns WHERE session_id = ? AND seq NOT IN "
+                    "(SELECT seq FROM turns WHERE session_id = ? ORDER BY seq DESC LIMIT ?)",
+                    (session_id, session_id, keep_turns)
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def append_and_compact(self, session_id: str, query: str, response: str, max_turns: int,
+                           compactor: Compactor) -> None:
+        now = time.time()
+        with self._lock:
+            # Take the write lock before reading, so no other worker can change the session in between
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT last_access, summary FROM sessions WHERE session_id = ?", (session_id,)
+                ).fetchone()
+                summary, turns = None, []
+                if row is not None and now - row[0] > self.idle_ttl:
+                    self._delete(session_id)
+                elif row is not None:
+                    summary = row[1]
+                    turns = [tuple(turn) for turn in self._conn.execute(
+                        "SELECT query, response FROM turns WHERE session_id = ? ORDER BY seq", (session_id,)
+                    )]
+                turns.append((query, response))
+                new_summary, keep = compactor(summary, turns)
+                self._conn.execute(
+                    "INSERT INTO sessions (session_id, last_access, summary) VALUES (?, ?, ?) "
+                    "ON CONFLICT(session_id) DO UPDATE SET last_access = excluded.last_access, "
+                    "summary = excluded.summary",
+                    (session_id, now, new_summary)
+                )
+                self._conn.execute(
+                    "INSERT INTO turns (session_id, query, response) VALUES (?, ?, ?)",
+                    (session_id, query, response)
+                )
+                self._conn.execute(
+                    "DELETE FROM turns WHERE session_id = ? AND seq NOT IN "
+                    "(SELECT seq FROM turns WHERE session_id = ? ORDER BY seq DESC LIMIT ?)",
+                    (session_id, session_id, min(keep, max_turns))
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def delete(self, session_id: str) -> None:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            self._delete(session_id)
+            self._conn.execute("COMMIT")
+
+    def sweep(self) -> int:
+        cutoff = time.time() - self.idle_ttl
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            self._conn.execute(
+                "DELETE FROM turns WHERE session_id IN "
+                "(SELECT session_id FROM sessions WHERE last_access < ?)", (cutoff,)
+            )
+            removed = self._conn.execute("DELETE FROM sessions WHERE last_access < ?", (cutoff,)).rowcount
+            self._conn.execute("COMMIT")
+        return removed
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            sessions = self._conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+            turns = self._conn.execute("SELECT COUNT(*) FROM turns").fetchone()[0]
+        return {"backend": "sqlite", "sessions": sessions, "turns": turns}
+
+    def close(self) -> None:
+        """Close the database connection."""
+        with self._lock:
+            self._conn.close()
+
+    def _delete(self, session_id: str) -> None:
+        self._conn.execute("DELETE FROM turns WHERE session_id = ?", (session_id,))
+        self._conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+
+
+class RedisSessionBackend(SessionBackend):
+    """
+    Session store in Redis, shared by every worker on every node.
+
+    Each session is a list of JSON-encoded turns, with the summary of older
+    turns in a separate string key. Appends, trims and TTL refreshes are
+    sent as one MULTI/EXEC pipeline, and a turn that also compacts the
+    session watches both keys so a concurrent change makes it retry. Idle
+    sessions are expired by Redis itself.
+    """
+
+    blocking = True
+
+    def __init__(self, client=None, url: Optional[str] = None, idle_ttl: float = SESSION_IDLE_TTL_SECONDS,
+                 key_prefix: str = "mexr:session:", summary_prefix: str = "mexr:summary:"):
+        if client is None:
+            try:
+                import redis
+            except ImportError as exc:
+                raise ImportError(
+                    "The Redis session backend requires the 'redis' package. Install it with: pip install redis"
+                ) from exc
+            client = redis.Redis.from_url(url)
+        self._redis = client
+        self.idle_ttl = idle_ttl
+        self.key_prefix = key_prefix
+        self.summary_prefix = summary_prefix
+
+    def _key(self, session_id: str) -> str:
+        return f"{self.key_prefix}{session_id}"
+
+    def _summary_key(self, session_id: str) -> str:
+        return f"{self.summary_prefix}{session_id}"
+
+    def load_turns(self, session_id: str) -> List[Turn]:
+        key = self._key(session_id)
+        pipe = self._redis.pipeline(transaction=True)
+        pipe.lrange(key, 0, -1)
+        pipe.expire(key, int(self.idle_ttl))
+        raw_turns, _ = pipe.execute()
+        return [tuple(json.loads(raw)) for raw in raw_turns]
+
+    def load_session(self, session_id: str) -> Tuple[Optional[str], List[Turn]]:
+        key, summary_key = self._key(session_id), self._summary_key(session_id)
+        pipe = self._redis.pipeline(transaction=True)
+        pipe.get(summary_key)
+        pipe.lrange(key, 0, -1)
+        pipe.expire(key, int(self.idle_ttl))
+        pipe.expire(summary_key, int(self.idle_ttl))
+        summary, raw_turns, _, _ = pipe.execute()
+        if isinstance(summary, bytes):
+            summary = summary.decode("utf-8")
+        return summary, [tuple(json.loads(raw)) for raw in raw_turns]
+
+    def append_turn(self, session_id: str, query: str, response: str, max_turns: int) -> None:
+        key = self._key(session_id)
+        pipe = self._redis.pipeline(transaction=True)
+        pipe.rpush(key, json.dumps([query, response]))
+        pipe.ltrim(key, -max_turns, -1)
+        pipe.expire(key, int(self.idle_ttl))
+        pipe.expire(self._summary_key(session_id), int(self.idle_ttl))
+        pipe.execute()
+
+    def compact(self, session_id: str, summary: Optional[str], keep_turns: int) -> None:
+        key, summary_key = self._key(session_id), self._summary_key(session_id)
+        pipe = self._redis.pipeline(transaction=True)
+        if summary:
+            pipe.set(summary_key, summary, ex=int(self.idle_ttl))
+        else:
+            pipe.delete(summary_key)
+        if keep_turns > 0:
+            pipe.ltrim(key, -keep_turns, -1)
+        else:
+            pipe.delete(key)
+        pipe.execute()
+
+    def append_and_compact(self, session_id: str, query: str, response: str, max_turns: int,
+                           compactor: Compactor) -> None:
+        from redis.exceptions import WatchError
+
+        key, summary_key = self._key(session_id), self._summary_key(session_id)
+        ttl = int(self.idle_ttl)
+        with self._redis.pipeline(transaction=True) as pipe:
+            while True:
+                try:
+                    # EXEC fails if another worker changes either key after WATCH, and the update is retried
+                    pipe.watch(key, summary_key)
+                    summary = pipe.get(summary_key)
+                    if isinstance(summary, bytes):
+                        summary = summary.decode("utf-8")
+                    turns = [tuple(json.loads(raw)) for raw in pipe.lrange(key, 0, -1)]
+                    turns.append((query, response))
+                    new_summary, keep = compactor(summary, turns)
+                    keep = min(keep, max_turns)
+                    pipe.multi()
+                    if new_summary:
+                        pipe.set(summary_key, new_summary, ex=ttl)
+                    else:
+                        pipe.delete(summary_key)
+                    if keep > 0:
+                        pipe.rpush(key, json.dumps([query, response]))
+                        pipe.ltrim(key, -keep, -1)
+                        pipe.expire(key, ttl)
+                    else:
+                        pipe.delete(key)
+                    pipe.execute()
+                    return
+                except WatchError:
+                    continue
+
+    def delete(self, session_id: str) -> None:
+        self._redis.delete(self._key(session_id), self._summary_key(session_id))
+
+    def stats(self) -> Dict[str, Any]:
+        sessions = sum(1 for _ in self._redis.scan_iter(match=f"{self.key_prefix}*", count=1000))
+        return {"backend": "redis", "sessions": sessions}
@@ -0,0 +1,100 @@
+"""Startup timing, background warm-up and readiness reporting."""
+
+import asyncio
+import logging
+import time
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Set when main.py starts importing the app
+_PROCESS_STARTED = time.perf_counter()
+
+
+class StartupState:
+    """Tracks which components are warm and how long startup took."""
+
+    def __init__(self, started: float = _PROCESS_STARTED):
+        self.started = started
+        self.import_seconds: Optional[float] = None
+        self.ready_seconds: Optional[float] = None
+        self.components: Dict[str, bool] = {}
+        self.errors: Dict[str, str] = {}
+
+    def record_imports(self) -> None:
+        """Record that the application modules have finished importing."""
+        self.import_seconds = time.perf_counter() - self.started
+
+    def expect(self, component: str) -> None:
+        """
+        Register a component that must be warm before the app is ready.
+
+        Args:
+            component: Name of the component
+        """
+        self.components.setdefault(component, False)
+
+    def mark_ready(self, component: str) -> None:
+        """
+        Mark a component as warm.
+
+        Args:
+            component: Name of the component
+        """
+        self.components[component] = True
+        self.errors.pop(component, None)
+
+    @property
+    def ready(self) -> bool:
+        """Whether warm-up has finished and every expected component is warm."""
+        return self.ready_seconds is not None and all(self.components.values())
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get readiness and startup timing.
+
+        Returns:
+            Dictionary with the ready flag, per-component state, warm-up
+            errors, and import and time-to-ready durations in seconds
+        """
+        return {
+            "ready": self.ready,
+            "components": dict(self.components),
+            "errors": dict(self.errors),
+            "import_seconds": self.import_seconds,
+            "time_to_ready_seconds": self.ready_seconds,
+        }
+
+
+async def warm_up(state: StartupState, steps: Dict[str, Callable[[], Any]]) -> None:
+    """
+    Warm components one after another without blocking the event loop.
+
+    Synchronous steps run in a worker thread; coroutine functions are
+    awaited. A failing step is recorded and the remaining steps still run.
+
+    Args:
+        state: Startup state to update
+        steps: Component name to zero-argument warm-up function, in order
+    """
+    for component in steps:
+        state.expect(component)
+    for component, step in steps.items():
+        try:
+            if asyncio.iscoroutinefunction(step):
+                await step()
+            else:
+                await asyncio.to_thread(step)
+        except Exception as exc:
+            state.errors[component] = f"{type(exc).__name__}: {exc}"
+            logger.error("Warm-up of %s failed: %s", component, exc)
+            continue
+        state.mark_ready(component)
+    if all(state.components.values()):
+        state.ready_seconds = time.perf_counter() - state.started
+        logger.info("Startup: ready after %.2fs (imports took %.2fs)", state.ready_seconds, state.import_seconds or 0,
+                    extra={"time_to_ready_seconds": state.ready_seconds, "import_seconds": state.import_seconds})
+
+
+# Global startup state
+startup_state = StartupState()
@@ -0,0 +1,158 @@
+"""Helpers for streaming agent output to the VR client as server-sent events."""
+
+import json
+import re
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from app.config import STREAM_TTS_MIN_CHARS, STREAM_TTS_MAX_CHARS
+
+# Names of the tools whose outputs are VR actions
+ACTION_TOOLS = {"highlight_object", "play_sound"}
+
+_SENTENCE_END = re.compile(r"[.!?;:](?:[\"')\]]*)\s")
+# A complete sentence in a model call's text, after which the call is taken to be answering
+_FIRST_SENTENCE = re.compile(r"[.!?](?:[\"')\]]*)\s")
+
+
+def format_sse(event: str, data: Any) -> str:
+    """
+    Format a server-sent event.
+
+    Args:
+        event: The event name
+        data: JSON-serializable event payload
+
+    Returns:
+        The encoded event, terminated by a blank line
+    """
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class TTSChunker:
+    """Buffers streamed tokens and releases them in sentence-sized chunks for text-to-speech."""
+
+    def __init__(self, min_chars: int = STREAM_TTS_MIN_CHARS, max_chars: int = STREAM_TTS_MAX_CHARS):
+        self.min_chars = min_chars
+        self.max_chars = max_chars
+        self._buffer = ""
+
+    def feed(self, text: str) -> List[str]:
+        """
+        Add streamed text to the buffer.
+
+        Args:
+            text: The next token or fragment of the answer
+
+        Returns:
+            Chunks that are ready to be spoken
+        """
+        self._buffer += text
+        chunks = []
+        while True:
+            chunk = self._next_chunk()
+            if chunk is None:
+                return chunks
+            chunks.append(chunk)
+
+    def flush(self) -> Optional[str]:
+        """
+        Release whatever text remains in the buffer.
+
+        Returns:
+            The remaining text, or None if the buffer is empty
+        """
+        chunk = self._buffer.strip()
+        self._buffer = ""
+        return chunk or None
+
+    def _next_chunk(self) -> Optional[str]:
+        # Prefer to break at the end of a sentence once the chunk is long enough
+        for match in _SENTENCE_END.finditer(self._buffer):
+            if match.end() >= self.min_chars:
+                return self._take(match.end())
+        # Otherwise break overly long text at the last word boundary
+        if len(self._buffer) > self.max_chars:
+            split = self._buffer.rfind(" ", 0, self.max_chars)
+            return self._take(split + 1 if split > 0 else self.max_chars)
+        return None
+
+    def _take(self, end: int) -> str:
+        chunk, self._buffer = self._buffer[:end], self._buffer[end:]
+        return chunk.strip()
+
+
+def _requests_tools(message: Any) -> bool:
+    """Whether a streamed chunk or finished model message asks for tool calls."""
+    return bool(getattr(message, "tool_call_chunks", None) or getattr(message, "tool_calls", None))
+
+
+async def iter_agent_events(agent_executor, agent_input: Dict[str, Any]) -> AsyncIterator[Tuple[str, Any]]:
+    """
+    Translate the agent's async event stream into actions, text and the final answer.
+
+    A model call may produce some text before deciding to call a tool, and
+    that text is not part of the answer. The tokens of each model call are
+    therefore held back until they complete a first sentence without any
+    tool call, and then streamed as they arrive; a call that requests tools
+    before that has its text dropped. Text of a call that ends before a
+    sentence boundary is released when the call ends without tool calls.
+
+    Args:
+        agent_executor: The agent to run
+        agent_input: Input variables for the agent
+
+    Yields:
+        ("action", dict) when an action tool returns, ("token", str) for each
+        answer token, and finally ("output", str) with the full answer
+    """
+    tokens = []
+    # Held-back tokens of model calls still in progress, or None once a call requests tools
+    pending: Dict[Any, Optional[List[str]]] = {}
+    # Model calls whose text is being streamed
+    answering = set()
+    final_answer = None
+    async for event in agent_executor.astream_events(agent_input, version="v2"):
+        kind = event["event"]
+        run_id = event.get("run_id")
+        if kind == "on_tool_end" and event.get("name") in ACTION_TOOLS:
+            output = event["data"].get("output")
+            if isinstance(output, dict):
+                yield "action", output
+        elif kind == "on_chat_model_stream":
+            chunk = event["data"].get("chunk")
+            content = getattr(chunk, "content", "")
+            if not isinstance(content, str):
+                content = ""
+            if run_id in answering:
+                if content:
+                    tokens.append(content)
+                    yield "token", content
+                continue
+            run_tokens = pending.setdefault(run_id, [])
+            if run_tokens is None:
+                continue
+            if _requests_tools(chunk):
+                pending[run_id] = None
+                continue
+            if content:
+                run_tokens.append(content)
+                if _FIRST_SENTENCE.search("".join(run_tokens)):
+                    answering.add(run_id)
+                    del pending[run_id]
+                    for token in run_tokens:
+                        tokens.append(token)
+                        yield "token", token
+        elif kind == "on_chat_model_end":
+            answering.discard(run_id)
+            run_tokens = pending.pop(run_id, None)
+            if run_tokens and not _requests_tools(event["data"].get("output")):
+                for token in run_tokens:
+                    tokens.append(token)
+                    yield "token", token
+        elif kind == "on_chain_end" and not event.get("parent_ids"):
+            output = event["data"].get("output")
+            if isinstance(output, dict):
+                final_answer = output.get("output")
+    if final_answer is None:
+        final_answer = "".join(tokens) or "I'm sorry, I encountered an error."
+    yield "output", final_answer
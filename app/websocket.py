@@ -0,0 +1,159 @@
+"""Connection tracking and heartbeats for persistent VR session WebSockets."""
+
+import asyncio
+import time
+from typing import Any, Awaitable, Dict, Optional, Set
+
+from fastapi import WebSocket
+
+from app.broadcast import Subscription
+from app.config import WS_HEARTBEAT_INTERVAL_SECONDS, WS_IDLE_TIMEOUT_SECONDS
+from app.models import VRQueryContext
+
+# Close code sent when a client stops responding to heartbeats
+IDLE_CLOSE_CODE = 4408
+
+
+class SessionSocket:
+    """A WebSocket connection bound to a single VR session."""
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        session_id: str,
+        heartbeat_interval: float = WS_HEARTBEAT_INTERVAL_SECONDS,
+        idle_timeout: float = WS_IDLE_TIMEOUT_SECONDS,
+    ):
+        self.websocket = websocket
+        self.session_id = session_id
+        self.heartbeat_interval = heartbeat_interval
+        self.idle_timeout = idle_timeout
+        self.context: Optional[VRQueryContext] = None
+        # Classroom broadcast group subscription and the task forwarding it
+        self.subscription: Optional[Subscription] = None
+        self.broadcast_task: Optional[asyncio.Task] = None
+        self.last_seen = time.monotonic()
+        self._send_lock = asyncio.Lock()
+
+    def touch(self) -> None:
+        """Record activity from the client."""
+        self.last_seen = time.monotonic()
+
+    async def send(self, message_type: str, **fields: Any) -> None:
+        """
+        Send a typed JSON message to the client.
+
+        Args:
+            message_type: Value of the message's "type" field
+            **fields: Additional message fields
+        """
+        message: Dict[str, Any] = {"type": message_type}
+        message.update({key: value for key, value in fields.items() if value is not None})
+        async with self._send_lock:
+            await self.websocket.send_json(message)
+
+    async def send_encoded(self, message: str) -> None:
+        """
+        Send a message that is already encoded as JSON.
+
+        Args:
+            message: The encoded message
+        """
+        async with self._send_lock:
+            await self.websocket.send_text(message)
+
+    @staticmethod
+    async def _until_disconnected(sending: Awaitable[None]) -> None:
+        """
+        Run a send loop, ending quietly if the connection drops.
+
+        The receive loop notices the disconnect and handles teardown.
+
+        Args:
+            sending: The send loop to run
+        """
+        try:
+            await sending
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            return
+
+    async def run_broadcasts(self, subscription: Subscription) -> None:
+        """Forward a broadcast group's messages to the client until the subscription is closed."""
+        await self._until_disconnected(subscription.run(self.send_encoded))
+
+    async def run_heartbeat(self) -> None:
+        """Send periodic pings and close the connection once the client goes idle."""
+        await self._until_disconnected(self._heartbeat())
+
+    async def _heartbeat(self) -> None:
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            if time.monotonic() - self.last_seen > self.idle_timeout:
+                await self.websocket.close(code=IDLE_CLOSE_CODE)
+                return
+            await self.send("ping")
+
+
+class ConnectionRegistry:
+    """Tracks open WebSocket connections per session."""
+
+    def __init__(self):
+        self._connections: Dict[str, Set[SessionSocket]] = {}
+
+    def register(self, sock: SessionSocket) -> None:
+        """
+        Register an open connection.
+
+        Args:
+            sock: The connection to register
+        """
+        self._connections.setdefault(sock.session_id, set()).add(sock)
+
+    def unregister(self, sock: SessionSocket) -> bool:
+        """
+        Remove a closed connection.
+
+        Args:
+            sock: The connection to remove
+
+        Returns:
+            True if this was the last open connection for its session
+        """
+        connections = self._connections.get(sock.session_id)
+        if connections is None:
+            return False
+        connections.discard(sock)
+        if connections:
+            return False
+        del self._connections[sock.session_id]
+        return True
+
+    def connections_for(self, session_id: str) -> Set[SessionSocket]:
+        """
+        Get the open connections for a session.
+
+        Args:
+            session_id: The unique session identifier
+
+        Returns:
+            Set of open connections
+        """
+        return set(self._connections.get(session_id, ()))
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Get connection statistics.
+
+        Returns:
+            Dictionary with the number of connected sessions and open connections
+        """
+        return {
+            "sessions": len(self._connections),
+            "connections": sum(len(conns) for conns in self._connections.values()),
+        }
+
+
+# Global connection registry instance
+connection_registry = ConnectionRegistry()
@@ -0,0 +1,232 @@
+"""Local stand-in for the OpenAI chat completions API.
+
+Lets the real agent (`create_agent`, LangChain and the OpenAI client) run end
+to end without network access. Point the backend at it with
+``LLM_BASE_URL=http://127.0.0.1:8100/v1``.
+
+Usage:
+    python benchmarks/fake_openai.py --port 8100 --latency-ms 300 --token-latency-ms 5
+
+Behaviour:
+- The first model call of a turn requests the `highlight_object` tool for
+  the held organ's socket (with probability --tool-call-rate), and the call
+  after the tool result returns the text answer.
+- Forced function calls and `json_schema` response formats (the structured
+  engine) return an answer with a highlight action.
+- Streaming responses send the answer word by word, with usage in the final
+  chunk when requested.
+- Prompts whose system messages were seen before report cached tokens,
+  like the provider's prompt cache.
+- Models with "mini" in their name answer --fast-latency-factor times as
+  slow, to stand in for the fast tier of model routing.
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import re
+import time
+import uuid
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+_SOCKET_PATTERN = re.compile(r"Correct Socket ID for this organ: (\S+)")
+_ORGAN_PATTERN = re.compile(r"Held Organ: ([^(\n]+)")
+
+# The provider caches prompt prefixes in blocks once they reach this size
+_CACHE_MIN_TOKENS = 1024
+_CACHE_BLOCK_TOKENS = 128
+
+
+class FakeLLMConfig:
+    """Behaviour of the stand-in server."""
+
+    def __init__(self, latency_ms: float = 300, token_latency_ms: float = 5, jitter_ms: float = 50,
+                 tool_call_rate: float = 0.5, answer_words: int = 40, error_rate: float = 0.0, seed: Optional[int] = None,
+                 fast_latency_factor: float = 1.0):
+        self.latency_ms = latency_ms
+        self.token_latency_ms = token_latency_ms
+        self.jitter_ms = jitter_ms
+        self.tool_call_rate = tool_call_rate
+        self.answer_words = answer_words
+        self.error_rate = error_rate
+        self.fast_latency_factor = fast_latency_factor
+        self.random = random.Random(seed)
+
+
+def _count_tokens(text: str) -> int:
+    return (len(text) + 3) // 4
+
+
+def _text(content: Any) -> str:
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        return " ".join(part.get("text", "") for part in content if isinstance(part, dict))
+    return ""
+
+
+def create_app(config: FakeLLMConfig) -> FastAPI:
+    """
+    Build the stand-in API.
+
+    Args:
+        config: Latency, tool call and error behaviour
+
+    Returns:
+        The FastAPI application
+    """
+    app = FastAPI(title="Fake OpenAI")
+    seen_prefixes = set()
+    stats = {"requests": 0, "streamed": 0, "tool_calls": 0, "errors": 0}
+
+    def answer_text(organ: str) -> str:
+        words = f"The {organ} is shown in its anatomical position and this simulated answer describes it".split()
+        return " ".join(words[i % len(words)] for i in range(config.answer_words)) + "."
+
+    def usage(messages: List[Dict[str, Any]], completion: str) -> Dict[str, Any]:
+        prompt_tokens = sum(_count_tokens(_text(message.get("content"))) for message in messages) + 4 * len(messages)
+        prefix = "".join(_text(m.get("content")) for m in messages if m.get("role") == "system")
+        prefix_tokens = _count_tokens(prefix)
+        key = hashlib.sha256(prefix.encode()).digest()
+        cached = 0
+        if key in seen_prefixes and prefix_tokens >= _CACHE_MIN_TOKENS:
+            cached = prefix_tokens // _CACHE_BLOCK_TOKENS * _CACHE_BLOCK_TOKENS
+        seen_prefixes.add(key)
+        completion_tokens = _count_tokens(completion)
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "prompt_tokens_details": {"cached_tokens": cached},
+        }
+
+    def plan(body: Dict[str, Any]) -> Dict[str, Any]:
+        """Decide the assistant message for a request."""
+        messages = body.get("messages", [])
+        system = "\n".join(_text(m.get("content")) for m in messages if m.get("role") == "system")
+        socket_match = _SOCKET_PATTERN.search(system)
+        organ_match = _ORGAN_PATTERN.search(system)
+        socket_id = socket_match.group(1) if socket_match else "socket_heart"
+        organ = organ_match.group(1).strip() if organ_match else "organ"
+        text = answer_text(organ)
+        structured = {"answer": text, "actions": [{"tool": "highlight_object", "target_id": socket_id}]}
+
+        tool_choice = body.get("tool_choice")
+        if isinstance(tool_choice, dict):
+            name = tool_choice["function"]["name"]
+            return {"tool_calls": [(name, structured)]}
+        response_format = body.get("response_format") or {}
+        if response_format.get("type") in ("json_schema", "json_object"):
+            return {"content": json.dumps(structured)}
+
+        tool_names = {tool["function"]["name"] for tool in body.get("tools", [])}
+        answered_tool = messages and messages[-1].get("role") == "tool"
+        if "highlight_object" in tool_names and not answered_tool and config.random.random() < config.tool_call_rate:
+            return {"tool_calls": [("highlight_object", {"target_id": socket_id})]}
+        return {"content": text}
+
+    async def sleep(ms: float, factor: float = 1.0) -> None:
+        delay = ms + config.random.uniform(-config.jitter_ms, config.jitter_ms) if config.jitter_ms else ms
+        delay *= factor
+        if delay > 0:
+            await asyncio.sleep(delay / 1000)
+
+    @app.get("/stats")
+    def server_stats():
+        return stats
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        stats["requests"] += 1
+        model = body.get("model", "gpt-4o")
+        factor = config.fast_latency_factor if "mini" in model else 1.0
+        if config.error_rate and config.random.random() < config.error_rate:
+            stats["errors"] += 1
+            await sleep(config.latency_ms, factor)
+            return JSONResponse({"error": {"message": "Simulated overload", "type": "server_error"}}, status_code=503)
+
+        reply = plan(body)
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        created = int(time.time())
+        tool_calls = [
+            {"id": f"call_{uuid.uuid4().hex[:24]}", "type": "function",
+             "function": {"name": name, "arguments": json.dumps(arguments)}}
+            for name, arguments in reply.get("tool_calls", [])
+        ]
+        stats["tool_calls"] += len(tool_calls)
+        content = reply.get("content")
+        completion_text = content or "".join(call["function"]["arguments"] for call in tool_calls)
+        finish_reason = "tool_calls" if tool_calls else "stop"
+        token_usage = usage(body.get("messages", []), completion_text)
+
+        if not body.get("stream"):
+            await sleep(config.latency_ms + config.token_latency_ms * token_usage["completion_tokens"], factor)
+            message = {"role": "assistant", "content": content, "refusal": None}
+            if tool_calls:
+                message["tool_calls"] = tool_calls
+            return {
+                "id": completion_id, "object": "chat.completion", "created": created, "model": model,
+                "choices": [{"index": 0, "message": message, "finish_reason": finish_reason, "logprobs": None}],
+                "usage": token_usage,
+            }
+
+        stats["streamed"] += 1
+        include_usage = (body.get("stream_options") or {}).get("include_usage", False)
+
+        def chunk(delta: Dict[str, Any], finish: Optional[str] = None, **extra: Any) -> str:
+            data = {
+                "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish, "logprobs": None}], **extra,
+            }
+            return f"data: {json.dumps(data)}\n\n"
+
+        async def events() -> AsyncIterator[str]:
+            await sleep(config.latency_ms, factor)
+            yield chunk({"role": "assistant", "content": "" if content is not None else None})
+            if content is not None:
+                for i, word in enumerate(content.split(" ")):
+                    await sleep(config.token_latency_ms, factor)
+                    yield chunk({"content": word if i == 0 else " " + word})
+            for index, call in enumerate(tool_calls):
+                yield chunk({"tool_calls": [{"index": index, "id": call["id"], "type": "function",
+                                             "function": {"name": call["function"]["name"], "arguments": ""}}]})
+                await sleep(config.token_latency_ms, factor)
+                yield chunk({"tool_calls": [{"index": index, "function": {"arguments": call["function"]["arguments"]}}]})
+            yield chunk({}, finish_reason)
+            if include_usage:
+                yield f"data: {json.dumps({'id': completion_id, 'object': 'chat.completion.chunk', 'created': created, 'model': model, 'choices': [], 'usage': token_usage})}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--latency-ms", type=float, default=300, help="time to first token")
+    parser.add_argument("--token-latency-ms", type=float, default=5, help="delay per streamed word or completion token")
+    parser.add_argument("--jitter-ms", type=float, default=50, help="uniform jitter added to each delay")
+    parser.add_argument("--tool-call-rate", type=float, default=0.5, help="probability that a turn calls highlight_object")
+    parser.add_argument("--answer-words", type=int, default=40, help="length of the text answer")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with HTTP 503")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--fast-latency-factor", type=float, default=1.0, help="latency multiplier for 'mini' models")
+    args = parser.parse_args()
+
+    import uvicorn
+    config = FakeLLMConfig(args.latency_ms, args.token_latency_ms, args.jitter_ms, args.tool_call_rate,
+                           args.answer_words, args.error_rate, args.seed, args.fast_latency_factor)
+    uvicorn.run(create_app(config), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
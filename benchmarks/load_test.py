@@ -0,0 +1,291 @@
+"""Load and latency benchmark for the query endpoint.
+
+Starts the local fake OpenAI server and the backend (`main:app` under
+uvicorn, pointed at the fake with LLM_BASE_URL), drives /medtech/query at a
+fixed concurrency, and writes a JSON report.
+
+Usage:
+    python benchmarks/load_test.py --concurrency 32 --requests 2000 --sessions 200
+    python benchmarks/load_test.py --engine structured --agent-ratio 1.0 --no-cache
+    python benchmarks/load_test.py --agent-ratio 1.0 --no-cache --llm-error-rate 0.05
+    python benchmarks/load_test.py --agent-ratio 1.0 --no-cache --model-routing --fast-latency-factor 0.4
+    python benchmarks/load_test.py --target http://127.0.0.1:8000   # an already running backend
+
+The report contains throughput, latency percentiles, the serving path and
+status of every response, the backend's memory growth (Linux), event-loop
+lag from the backend's /metrics, and the LLM connection pool, circuit
+breaker, admission control and model routing statistics. All simulated headsets share one
+address, so the per-client rate limit is off unless CLIENT_RATE_LIMIT_PER_MINUTE
+is set.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import re
+import socket
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ORGANS = ["heart", "liver", "stomach", "left_lung", "right_lung"]
+
+# Answered from the knowledge base without the agent
+FAST_PATH_QUERIES = ["Where does this go?", "What is this?", "Where should I put this organ?"]
+
+AGENT_QUERIES = [
+    "What does this organ do?",
+    "Why is it shaped like this?",
+    "What happens if it stops working?",
+    "How big is it in an adult?",
+    "Which blood vessels are connected to it?",
+    "What diseases commonly affect it?",
+]
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def rss_bytes(pid: Optional[int]) -> Optional[int]:
+    """Resident memory of a process, read from /proc."""
+    if pid is None:
+        return None
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        return None
+    return None
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def histogram_summary(metrics_text: str, name: str) -> Dict[str, Optional[float]]:
+    """Mean and bucket-estimated p99 of an unlabelled histogram in Prometheus text."""
+    buckets = [(float("inf") if le == "+Inf" else float(le), float(count))
+               for le, count in re.findall(rf'^{name}_bucket{{le="([^"]+)"}} (\S+)$', metrics_text, re.M)]
+    total = re.search(rf"^{name}_sum (\S+)$", metrics_text, re.M)
+    count = re.search(rf"^{name}_count (\S+)$", metrics_text, re.M)
+    if not buckets or not count or float(count.group(1)) == 0:
+        return {"mean": None, "p99_upper_bound": None, "samples": 0}
+    samples = float(count.group(1))
+    p99 = next((bound for bound, cumulative in buckets if cumulative >= 0.99 * samples), None)
+    return {"mean": float(total.group(1)) / samples, "p99_upper_bound": p99, "samples": int(samples)}
+
+
+async def wait_until_ready(client: httpx.AsyncClient, base_url: str, timeout: float) -> float:
+    started = time.perf_counter()
+    while time.perf_counter() - started < timeout:
+        try:
+            if (await client.get(f"{base_url}/ready")).status_code == 200:
+                return time.perf_counter() - started
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.1)
+    raise TimeoutError(f"{base_url} was not ready after {timeout}s")
+
+
+async def drive(base_url: str, args: argparse.Namespace) -> Dict[str, Any]:
+    """Send the configured requests and collect per-request results."""
+    rng = random.Random(args.seed)
+    sessions = [f"bench-{i}" for i in range(args.sessions)]
+    plan = []
+    for _ in range(args.requests):
+        query = rng.choice(AGENT_QUERIES) if rng.random() < args.agent_ratio else rng.choice(FAST_PATH_QUERIES)
+        plan.append({"sessionID": rng.choice(sessions), "context": {"heldObject": rng.choice(ORGANS)}, "query": query})
+
+    latencies: List[float] = []
+    served_by: Dict[str, int] = {}
+    statuses: Dict[str, int] = {}
+    queue: "asyncio.Queue[Dict[str, Any]]" = asyncio.Queue()
+    for body in plan:
+        queue.put_nowait(body)
+
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=args.timeout) as client:
+        async def worker() -> None:
+            while not queue.empty():
+                body = queue.get_nowait()
+                started = time.perf_counter()
+                try:
+                    response = await client.post(f"{base_url}/medtech/query", json=body)
+                    status = str(response.status_code)
+                    path = response.headers.get("X-MeXR-Served-By", "none")
+                except httpx.HTTPError as exc:
+                    status, path = type(exc).__name__, "error"
+                latencies.append(time.perf_counter() - started)
+                statuses[status] = statuses.get(status, 0) + 1
+                served_by[path] = served_by.get(path, 0) + 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - started
+
+    errors = sum(count for status, count in statuses.items() if status != "200")
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "duration_seconds": elapsed,
+        "throughput_rps": len(latencies) / elapsed if elapsed else None,
+        "latency_seconds": {
+            "mean": sum(latencies) / len(latencies) if latencies else None,
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "p99": percentile(latencies, 99),
+            "max": max(latencies) if latencies else None,
+        },
+        "statuses": statuses,
+        "served_by": served_by,
+    }
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    processes: List[subprocess.Popen] = []
+    backend_pid = None
+    base_url = args.target
+    try:
+        if base_url is None:
+            fake_port, app_port = free_port(), free_port()
+            processes.append(subprocess.Popen([
+                sys.executable, os.path.join(ROOT, "benchmarks", "fake_openai.py"), "--port", str(fake_port),
+                "--latency-ms", str(args.llm_latency_ms), "--token-latency-ms", str(args.llm_token_latency_ms),
+                "--tool-call-rate", str(args.tool_call_rate), "--error-rate", str(args.llm_error_rate),
+                "--seed", str(args.seed), "--fast-latency-factor", str(args.fast_latency_factor),
+            ], cwd=ROOT))
+            env = dict(os.environ,
+                       LLM_BASE_URL=f"http://127.0.0.1:{fake_port}/v1",
+                       OPENAI_API_KEY=os.environ.get("OPENAI_API_KEY", "sk-benchmark"),
+                       AGENT_ENGINE=args.engine,
+                       LOG_LEVEL=os.environ.get("LOG_LEVEL", "WARNING"),
+                       KNOWLEDGE_BASE_WATCH_INTERVAL_SECONDS="0",
+                       CLIENT_RATE_LIMIT_PER_MINUTE=os.environ.get("CLIENT_RATE_LIMIT_PER_MINUTE", "0"))
+            if args.no_cache:
+                env["RESPONSE_CACHE_ENABLED"] = "false"
+            if args.model_routing:
+                env["MODEL_ROUTING_ENABLED"] = "true"
+            backend = subprocess.Popen([
+                sys.executable, "-m", "uvicorn", "main:app", "--port", str(app_port),
+                "--workers", str(args.workers), "--log-level", "warning", "--no-access-log",
+            ], cwd=ROOT, env=env)
+            processes.append(backend)
+            backend_pid = backend.pid if args.workers == 1 else None
+            base_url = f"http://127.0.0.1:{app_port}"
+
+        async with httpx.AsyncClient(timeout=10) as client:
+            time_to_ready = await wait_until_ready(client, base_url, args.startup_timeout)
+            rss_start = rss_bytes(backend_pid)
+            results = await drive(base_url, args)
+            rss_end = rss_bytes(backend_pid)
+            metrics_text = (await client.get(f"{base_url}/metrics")).text
+            pool_stats = (await client.get(f"{base_url}/medtech/llm/pool/stats")).json()
+            breaker_stats = (await client.get(f"{base_url}/medtech/llm/breaker/stats")).json()
+            admission_stats = (await client.get(f"{base_url}/medtech/admission/stats")).json()
+            routing_stats = (await client.get(f"{base_url}/medtech/llm/routing/stats")).json()
+    finally:
+        for process in reversed(processes):
+            process.terminate()
+        for process in processes:
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "git_revision": git_revision(),
+        "python": platform.python_version(),
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+        "time_to_ready_seconds": time_to_ready,
+        **results,
+        "memory": {
+            "rss_start_bytes": rss_start,
+            "rss_end_bytes": rss_end,
+            "rss_growth_bytes": rss_end - rss_start if rss_start is not None and rss_end is not None else None,
+        },
+        "event_loop_lag_seconds": histogram_summary(metrics_text, "mexr_event_loop_lag_seconds"),
+        "llm_pool": pool_stats,
+        "llm_breaker": breaker_stats,
+        "admission": admission_stats,
+        "admission_wait_seconds": histogram_summary(metrics_text, "mexr_admission_wait_seconds"),
+        "model_routing": routing_stats,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--target", default=None, help="URL of a running backend; by default one is started")
+    parser.add_argument("--concurrency", type=int, default=16, help="requests in flight at once")
+    parser.add_argument("--requests", type=int, default=500, help="total requests to send")
+    parser.add_argument("--sessions", type=int, default=50, help="distinct session IDs")
+    parser.add_argument("--agent-ratio", type=float, default=0.7, help="fraction of queries that need the agent")
+    parser.add_argument("--engine", default="executor", choices=["executor", "structured"])
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers (memory is only tracked for 1)")
+    parser.add_argument("--no-cache", action="store_true", help="disable the response cache")
+    parser.add_argument("--llm-latency-ms", type=float, default=300, help="fake LLM time to first token")
+    parser.add_argument("--llm-token-latency-ms", type=float, default=5, help="fake LLM delay per token")
+    parser.add_argument("--tool-call-rate", type=float, default=0.5, help="fraction of turns that call a tool")
+    parser.add_argument("--llm-error-rate", type=float, default=0.0, help="fraction of fake LLM calls that return 503")
+    parser.add_argument("--model-routing", action="store_true", help="send simple queries to the fast model tier")
+    parser.add_argument("--fast-latency-factor", type=float, default=1.0, help="fake LLM latency multiplier for the fast tier")
+    parser.add_argument("--timeout", type=float, default=60, help="per-request timeout in seconds")
+    parser.add_argument("--startup-timeout", type=float, default=60)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", default=None, help="report path (default: benchmarks/results/<timestamp>.json)")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    output = args.output or os.path.join(
+        ROOT, "benchmarks", "results", f"load-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+    )
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    latency = report["latency_seconds"]
+    print(f"{report['requests']} requests, {report['errors']} errors, {report['throughput_rps']:.1f} req/s")
+    print(f"latency p50 {latency['p50'] * 1000:.1f} ms, p95 {latency['p95'] * 1000:.1f} ms, "
+          f"p99 {latency['p99'] * 1000:.1f} ms")
+    print(f"served by {report['served_by']}")
+    pool = report["llm_pool"]
+    print(f"LLM pool: {pool['requests']} requests, {pool['retries']} retries, {pool['failures']} failures, "
+          f"{pool['connections']} connections")
+    if report["model_routing"]["enabled"]:
+        tiers = report["model_routing"]["tiers"]
+        print("model tiers: " + ", ".join(
+            f"{tier} {stats['runs']} runs, mean {(stats['mean_seconds'] or 0) * 1000:.0f} ms" for tier, stats in tiers.items()
+        ) + f", {report['model_routing']['escalations']} escalations")
+    slots = report["admission"]["agent_slots"]
+    print(f"admission: {slots['admitted']} admitted, {slots['rejected']} refused by the queue, "
+          f"{report['admission']['session_rate_limit']['rejected']} rate limited")
+    print(f"report written to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""Compare prompt size and latency with retrieved passages against the full corpus.
+
+Usage:
+    python benchmarks/retrieval_benchmark.py            # prompt tokens and retrieval latency
+    python benchmarks/retrieval_benchmark.py --live     # also time agent calls (needs OPENAI_API_KEY)
+
+For every sample query the human turn is built three ways: without
+reference passages, with the top-k retrieved passages, and with the whole
+corpus pasted in. The report lists the tokens of each full prompt and, in
+live mode, the end-to-end agent latency for the top-k and full variants.
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+SAMPLE_QUERIES = [
+    ("heart", "Which valve sits between the left atrium and the left ventricle?"),
+    ("heart", "What starts each heartbeat?"),
+    ("heart", "Which blood vessels supply the heart muscle itself?"),
+    ("liver", "Why does the liver get blood from two places?"),
+    ("liver", "What does bile do?"),
+    ("liver", "Can this grow back if part of it is removed?"),
+    ("stomach", "Why doesn't the acid damage the stomach?"),
+    ("stomach", "Which cells make the acid?"),
+    ("left_lung", "Why does the left lung only have two lobes?"),
+    ("right_lung", "Why do swallowed objects usually end up in the right lung?"),
+]
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--live", action="store_true", help="time real agent calls for each prompt variant")
+    parser.add_argument("--k", type=int, default=None, help="passages to retrieve (default: RETRIEVAL_TOP_K)")
+    parser.add_argument("--repeat", type=int, default=200, help="retrieval timing iterations per query")
+    args = parser.parse_args()
+
+    from app.config import RETRIEVAL_TOP_K
+    from app.knowledge_base import get_organ_info
+    from app.prompts import SYSTEM_PROMPT, build_query_block, count_tokens, get_organ_prompt_block
+    from app.retrieval import passage_retriever, retrieve_passages
+
+    k = RETRIEVAL_TOP_K if args.k is None else args.k
+
+    started = time.perf_counter()
+    index = passage_retriever.index
+    build_ms = (time.perf_counter() - started) * 1000
+    corpus = index.passages
+
+    rows = []
+    retrieval_ms = []
+    for organ_id, query in SAMPLE_QUERIES:
+        organ_info = get_organ_info(organ_id)
+        prefix = count_tokens(SYSTEM_PROMPT) + count_tokens(get_organ_prompt_block(organ_id, organ_info))
+
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            passages = retrieve_passages(query, organ_id, organ_info, k=k)
+            retrieval_ms.append((time.perf_counter() - started) * 1000)
+
+        rows.append({
+            "organ_id": organ_id,
+            "query": query,
+            "passages": [passage.id for passage in passages],
+            "none": prefix + count_tokens(build_query_block(query)),
+            "top_k": prefix + count_tokens(build_query_block(query, passages)),
+            "full": prefix + count_tokens(build_query_block(query, corpus)),
+        })
+
+    print(f"Corpus: {len(corpus)} passages, {len(index.vocabulary)} terms, index built in {build_ms:.1f} ms")
+    print(f"Retrieval (k={k}): p50 {percentile(retrieval_ms, 50):.3f} ms, p95 {percentile(retrieval_ms, 95):.3f} ms\n")
+    print(f"{'organ':<11} {'none':>6} {'top-k':>6} {'full':>6}  passages")
+    for row in rows:
+        print(f"{row['organ_id']:<11} {row['none']:>6} {row['top_k']:>6} {row['full']:>6}  {', '.join(row['passages'])}")
+    mean_top_k = statistics.mean(row["top_k"] for row in rows)
+    mean_full = statistics.mean(row["full"] for row in rows)
+    print(f"\nMean prompt tokens: top-k {mean_top_k:.0f}, full corpus {mean_full:.0f} "
+          f"({100 * (1 - mean_top_k / mean_full):.0f}% fewer with retrieval)")
+
+    if args.live:
+        asyncio.run(run_live(rows, corpus))
+
+
+async def run_live(rows, corpus):
+    """Time agent calls with the top-k and full corpus prompts."""
+    from app.agent import create_agent
+    from app.knowledge_base import get_organ_info
+    from app.prompts import build_query_block, get_organ_prompt_block
+    from app.retrieval import passage_retriever
+
+    agent = create_agent()
+    by_id = {passage.id: passage for passage in passage_retriever.index.passages}
+    latencies = {"top_k": [], "full": []}
+    for row in rows:
+        organ_info = get_organ_info(row["organ_id"])
+        organ_context = get_organ_prompt_block(row["organ_id"], organ_info)
+        variants = {
+            "top_k": [by_id[passage_id] for passage_id in row["passages"]],
+            "full": corpus,
+        }
+        for name, passages in variants.items():
+            started = time.perf_counter()
+            await agent.ainvoke({
+                "input": build_query_block(row["query"], passages),
+                "organ_context": organ_context,
+                "chat_history": [],
+            })
+            latencies[name].append(time.perf_counter() - started)
+
+    print("\nEnd-to-end agent latency:")
+    for name, values in latencies.items():
+        print(f"  {name:<6} p50 {percentile(values, 50):.2f} s, p95 {percentile(values, 95):.2f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""Compare response encoding cost and payload size for JSON and MessagePack.
+
+Usage:
+    python benchmarks/serialization_benchmark.py
+    python benchmarks/serialization_benchmark.py --repeat 20000
+
+Each sample payload is encoded three ways: the way FastAPI encodes a
+`response_model` (dump, validate again, convert to JSON-compatible objects,
+then `json.dumps`), the one-pass JSON encoding the query routes now use, and
+MessagePack (needs the optional `ormsgpack` package). The report lists the
+median encode time, the decode time as a stand-in for parsing on the
+headset, and the payload size of each.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def sample_payloads():
+    """Representative responses: fast path, agent answer with actions, unknown organ and a batch."""
+    from app.intent import answer_from_knowledge_base, classify_intent
+    from app.knowledge_base import get_organ_info
+    from app.models import VRQueryBatchItem, VRQueryBatchResponse, VRQueryResponse
+    from app.serialization import unknown_organ_response
+
+    organ_info = get_organ_info("heart")
+    fast_path = VRQueryResponse(**answer_from_knowledge_base(classify_intent("Where does this go?", "heart", organ_info), organ_info))
+    answer = (
+        "The heart is a muscular pump that moves blood through two circuits. The right side sends "
+        "oxygen-poor blood to the lungs, and the left side pumps oxygen-rich blood to the rest of the "
+        "body. It sits in the chest between the lungs, just behind the sternum."
+    )
+    agent = VRQueryResponse(displayText=answer, spokenResponse=answer, actions=[
+        {"command": "highlight", "targetID": "heart", "options": {"color": "#00FF00", "duration": 3.0, "pattern": "pulse"}},
+        {"command": "highlight", "targetID": "left_lung", "options": {"color": "#FFFF00", "duration": 3.0, "pattern": "steady"}},
+        {"command": "playSound", "targetID": "positive_feedback_chime"},
+    ])
+    batch = VRQueryBatchResponse(results=[
+        VRQueryBatchItem(index=index, response=agent if index % 2 else fast_path, servedBy="agent" if index % 2 else "fast-path")
+        for index in range(50)
+    ])
+    return {
+        "fast-path": fast_path,
+        "agent": agent,
+        "unknown-organ": unknown_organ_response("scalpel"),
+        "batch-50": batch,
+    }
+
+
+def time_call(func, repeat):
+    """Median seconds per call over batches of calls."""
+    rounds = 7
+    per_round = max(1, repeat // rounds)
+    samples = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        for _ in range(per_round):
+            func()
+        samples.append((time.perf_counter() - started) / per_round)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5000, help="encodings timed per payload and method")
+    args = parser.parse_args()
+
+    from pydantic import TypeAdapter
+
+    from app.serialization import MEDIA_JSON, MEDIA_MSGPACK, encode, encode_unknown_organ, msgpack_available
+
+    def response_model_encoder(model):
+        # What FastAPI does for a route with `response_model`
+        adapter = TypeAdapter(type(model))
+
+        def encode_response_model():
+            validated = adapter.validate_python(model.model_dump())
+            content = adapter.dump_python(validated, mode="json")
+            return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None,
+                              separators=(",", ":")).encode("utf-8")
+        return encode_response_model
+
+    methods = {"response_model": (response_model_encoder, json.loads)}
+    methods["one-pass json"] = (lambda model: lambda: encode(model, MEDIA_JSON), json.loads)
+    if msgpack_available():
+        import ormsgpack
+        methods["msgpack"] = (lambda model: lambda: encode(model, MEDIA_MSGPACK), ormsgpack.unpackb)
+    else:
+        print("ormsgpack is not installed; skipping MessagePack (pip install ormsgpack)\n")
+
+    print(f"{'payload':<14} {'method':<15} {'encode µs':>10} {'decode µs':>10} {'bytes':>7}")
+    for name, model in sample_payloads().items():
+        for method, (make_encoder, decoder) in methods.items():
+            encoder = make_encoder(model)
+            body = encoder()
+            encode_us = time_call(encoder, args.repeat) * 1e6
+            decode_us = time_call(lambda: decoder(body), args.repeat) * 1e6
+            print(f"{name:<14} {method:<15} {encode_us:>10.2f} {decode_us:>10.2f} {len(body):>7}")
+
+    print("\nUnknown organ from the pre-encoded template:")
+    media_types = [MEDIA_JSON] + ([MEDIA_MSGPACK] if msgpack_available() else [])
+    for media_type in media_types:
+        encode_us = time_call(lambda: encode_unknown_organ("scalpel", media_type), args.repeat) * 1e6
+        print(f"  {media_type:<20} {encode_us:.2f} µs")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,15 +3,80 @@ MeXR Backend - Main Application Entry Point
 A FastAPI backend for VR medical training simulation using LangChain and OpenAI.
 """
 
+from app.startup import startup_state, warm_up
+
+import asyncio
+import contextlib
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
-from app.routes import router
+from app.config import (
+    KNOWLEDGE_BASE_WATCH_INTERVAL_SECONDS,
+    EVENT_LOOP_LAG_INTERVAL_SECONDS,
+    STARTUP_WARMUP,
+    STARTUP_WARMUP_REQUEST,
+    MODEL_ROUTING_ENABLED,
+)
+from app.routes import router, get_agent, get_tier_agent, warm_up_agent, close_agent
+from app.routing import TIER_FAST
+from app.knowledge_base import knowledge_base
+from app.answer_pack import answer_pack
+from app.prompts import build_organ_prompt_blocks
+from app.metrics import MetricsMiddleware, monitor_event_loop_lag
+from app.logs import RequestContextMiddleware, setup_logging, shutdown_logging
+from app.retrieval import passage_retriever
+from app.session import session_manager
+
+startup_state.record_imports()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start background tasks on startup and stop them on shutdown."""
+    setup_logging()
+    tasks = [asyncio.create_task(session_manager.run_sweeper())]
+    if KNOWLEDGE_BASE_WATCH_INTERVAL_SECONDS > 0:
+        tasks.append(asyncio.create_task(knowledge_base.run_watcher()))
+    if EVENT_LOOP_LAG_INTERVAL_SECONDS > 0:
+        tasks.append(asyncio.create_task(monitor_event_loop_lag(EVENT_LOOP_LAG_INTERVAL_SECONDS)))
+    
+    # Warm up in the background so /health answers while the agent is built
+    steps = {}
+    if STARTUP_WARMUP:
+        steps = {
+            "knowledge_base": lambda: knowledge_base.index,
+            "prompts": build_organ_prompt_blocks,
+            "answer_pack": answer_pack.load,
+            "retrieval": lambda: passage_retriever.index,
+            "agent": get_agent,
+        }
+        if MODEL_ROUTING_ENABLED:
+            steps["agent_fast"] = lambda: get_tier_agent(TIER_FAST)
+        if STARTUP_WARMUP_REQUEST:
+            steps["connection_pool"] = warm_up_agent
+    tasks.append(asyncio.create_task(warm_up(startup_state, steps)))
+    yield
+    for task in tasks:
+        task.cancel()
+    for task in tasks:
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
+    await close_agent()
+    shutdown_logging()
+
 
 app = FastAPI(
     title="MeXR Backend API",
     description="API endpoint to process queries for a VR medical simulation using LangChain and OpenAI.",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
+# Per-request timing for /metrics
+app.add_middleware(MetricsMiddleware)
+# Request IDs and trace sampling for logs; added last so it runs first
+app.add_middleware(RequestContextMiddleware)
+
 # Include API routes
 app.include_router(router)
 
@@ -22,7 +87,8 @@ def root():
     return {
         "message": "MeXR Backend is running",
         "documentation": "/docs",
-        "health": "/health"
+        "health": "/health",
+        "ready": "/ready"
     }
 
 
@@ -33,3 +33,42 @@ def sample_vr_request():
         "context": {"heldObject": "heart"},
         "query": "Where does this go?"
     }
+
+
+@pytest.fixture(autouse=True)
+def clear_response_cache():
+    """Fixture that isolates tests from answers cached by earlier tests."""
+    from app.cache import response_cache
+    response_cache.clear()
+    yield
+    response_cache.clear()
+
+
+@pytest.fixture(autouse=True)
+def reset_llm_breaker():
+    """Fixture that keeps agent failures in one test from opening the breaker for the next."""
+    from app.resilience import llm_breaker
+    llm_breaker.reset()
+    yield
+    llm_breaker.reset()
+
+
+@pytest.fixture(autouse=True)
+def reset_rate_limits():
+    """Fixture that gives every test full session and client rate limit buckets."""
+    from app.admission import session_rate_limiter, client_rate_limiter
+    session_rate_limiter.reset()
+    client_rate_limiter.reset()
+    yield
+    session_rate_limiter.reset()
+    client_rate_limiter.reset()
+
+
+@pytest.fixture(autouse=True)
+def disable_prefetch():
+    """Fixture that keeps speculative agent runs out of tests that do not expect them."""
+    from app.prefetch import prefetcher
+    prefetcher.enabled = False
+    yield
+    prefetcher.reset()
+    prefetcher.enabled = True
@@ -3,15 +3,26 @@ Unit tests for MeXR Backend
 Run with: pytest tests/test_app.py -v
 """
 
+import json
 import pytest
 from fastapi.testclient import TestClient
 from unittest.mock import Mock, patch, AsyncMock
-from langchain_core.messages import HumanMessage, AIMessage
+from langchain_core.messages import HumanMessage, AIMessage, AIMessageChunk
 
-from app.knowledge_base import get_organ_info, get_all_organs
+from app.knowledge_base import (
+    get_organ_info,
+    get_all_organs,
+    resolve_organ_id,
+    get_organ_by_socket,
+    KnowledgeBase,
+)
 from app.tools import highlight_object, play_sound, get_all_tools
-from app.session import SessionManager
+from app.session import SessionManager, create_session_backend
+from app.session_store import InMemorySessionBackend, SQLiteSessionBackend, RedisSessionBackend
 from app.models import VRQueryRequest, VRQueryContext, VRQueryResponse
+from app.intent import QueryIntent, classify_intent, answer_from_knowledge_base, normalize_query
+from app.cache import ResponseCache, normalize_cache_query, is_follow_up
+from app.streaming import TTSChunker, format_sse
 from main import app
 
 
@@ -47,6 +58,66 @@ class TestKnowledgeBase:
         assert "right_lung" in organs
 
 
+    def test_alias_and_separator_lookup(self):
+        """Test that scene-specific IDs resolve to canonical organs."""
+        assert resolve_organ_id("Left-Lung") == "left_lung"
+        assert resolve_organ_id("SM_Lung_Right") == "right_lung"
+        assert resolve_organ_id("organ_heart") == "heart"
+        assert get_organ_info("lung_l")["displayName"] == "Left Lung"
+    
+    def test_fuzzy_lookup(self):
+        """Test that typos resolve while unrelated IDs do not."""
+        assert resolve_organ_id("stomache") == "stomach"
+        assert resolve_organ_id("livr") == "liver"
+        assert resolve_organ_id("invalid_organ") is None
+    
+    def test_fuzzy_lookup_rejects_ambiguous_match(self):
+        """Test that a misspelling equally close to two organs' aliases resolves to neither."""
+        assert resolve_organ_id("lung") is None
+        assert resolve_organ_id("lungs") is None
+        assert resolve_organ_id("lung_r") == "right_lung"
+        assert get_organ_info("stomache") is None
+    
+    def test_socket_reverse_lookup(self):
+        """Test finding an organ by its socket."""
+        assert get_organ_by_socket("socket_liver") == "liver"
+        assert get_organ_by_socket("socket_missing") is None
+    
+    def test_hot_reload_swaps_index(self, tmp_path):
+        """Test that reloading picks up file changes and notifies listeners."""
+        import json
+        path = tmp_path / "kb.json"
+        organ = {"displayName": "Spleen", "socketID": "socket_spleen", "description": "d", "function": "f"}
+        path.write_text(json.dumps({"organs": {"spleen": organ}}))
+        kb = KnowledgeBase(str(path))
+        reloaded = []
+        kb.add_reload_listener(reloaded.append)
+        
+        old_index = kb.index
+        assert kb.reload() is False
+        path.write_text(json.dumps({"organs": {"spleen": dict(organ, aliases=["lien"])}}))
+        assert kb.reload(force=True) is True
+        
+        assert kb.index is not old_index
+        assert kb.index.version != old_index.version
+        assert kb.index.resolve("lien") == "spleen"
+        assert old_index.resolve("lien", fuzzy=False) is None
+        assert reloaded == [kb.index]
+    
+    def test_query_with_alias_held_object(self):
+        """Test that the query endpoint accepts aliased held object IDs."""
+        response = client.post("/medtech/query", json={
+            "sessionID": "alias_session", "context": {"heldObject": "Heart_Model"}, "query": "Where does this go?"
+        })
+        assert response.json()["actions"][0]["targetID"] == "socket_heart"
+    
+    def test_admin_reload_endpoint(self):
+        """Test the admin-triggered reload."""
+        response = client.post("/admin/knowledge/reload")
+        assert response.status_code == 200
+        assert response.json()["organs"] == 5
+
+
 class TestTools:
     """Tests for LangChain tools."""
     
@@ -132,6 +203,87 @@ class TestSessionManager:
         manager.clear_history("session1")
         assert len(manager.get_history("session1")) == 0
     
+    def test_odd_history_limit(self):
+        """Test that an odd message limit keeps exactly that many messages."""
+        manager = SessionManager(max_history=3)
+        for i in range(4):
+            manager.update_history("session1", f"Question {i}", f"Answer {i}")
+        
+        history = manager.get_history("session1")
+        assert [message.content for message in history] == ["Answer 2", "Question 3", "Answer 3"]
+    
+    def test_lru_eviction(self):
+        """Test that the least recently used session is evicted beyond the limit."""
+        manager = SessionManager(max_sessions=2)
+        manager.update_history("session1", "Question", "Answer")
+        manager.update_history("session2", "Question", "Answer")
+        manager.get_history("session1")
+        manager.update_history("session3", "Question", "Answer")
+        
+        assert manager.get_history("session2") == []
+        assert len(manager.get_history("session1")) == 2
+        assert manager.stats()["evictions"] == 1
+    
+    def test_idle_expiry_and_sweep(self):
+        """Test that idle sessions expire and are removed by the sweeper."""
+        manager = SessionManager(idle_ttl=0)
+        manager.update_history("session1", "Question", "Answer")
+        manager.update_history("session2", "Question", "Answer")
+        
+        assert manager.sweep() == 2
+        assert manager.stats()["sessions"] == 0
+        assert manager.stats()["expirations"] == 2
+    
+    def test_memory_ceiling(self):
+        """Test that the byte limit evicts old sessions and stats track bytes held."""
+        manager = SessionManager(max_bytes=2000)
+        for i in range(20):
+            manager.update_history(f"session{i}", "Question " * 5, "Answer " * 5)
+        
+        stats = manager.stats()
+        assert 0 < stats["bytes"] <= 2000
+        assert stats["sessions"] < 20
+        assert len(manager.get_history("session19")) == 2
+    
+    def test_bytes_released_on_clear(self):
+        """Test that clearing every session releases all tracked bytes."""
+        manager = SessionManager()
+        for i in range(8):
+            manager.update_history("session1", f"Question {i}", f"Answer {i}")
+        manager.clear_history("session1")
+        assert manager.stats()["bytes"] == 0
+    
+    def test_long_turns_summarized_within_budget(self):
+        """Test that turns beyond the token budget are summarized instead of sent verbatim."""
+        from langchain_core.messages import SystemMessage
+        from app.history import SUMMARY_HEADER, cached_token_count
+        manager = SessionManager(token_budget=200, summary_max_tokens=80)
+        long_answer = "The heart pumps blood through the body. " + "It has many details worth knowing. " * 20
+        for i in range(40):
+            manager.update_history("session1", f"Question {i}?", long_answer)
+        
+        history = manager.get_prompt_history("session1")
+        assert isinstance(history[0], SystemMessage)
+        assert history[0].content.startswith(SUMMARY_HEADER)
+        assert "Answered: The heart pumps blood through the body." in history[0].content
+        assert "details" not in history[0].content
+        assert history[-1].content == long_answer
+        sent = sum(cached_token_count(message.content) for message in history)
+        assert sent <= 200 + 80 + cached_token_count(SUMMARY_HEADER) + 1
+        
+        stats = manager.stats()["history"]
+        assert stats["turns_summarized"] == 40 - len(history[1:]) // 2
+        assert stats["max_tokens_sent"] <= 280
+        assert stats["tokens_saved"] > 0
+    
+    def test_summary_keeps_newest_lines(self):
+        """Test that the rolling summary drops its oldest lines beyond its limit."""
+        from app.history import extend_summary
+        summary = extend_summary(None, [(f"Question {i}?", f"Answer {i}.") for i in range(50)], max_tokens=40)
+        lines = summary.splitlines()
+        assert 0 < len(lines) < 50
+        assert lines[-1] == "- Asked: Question 49? Answered: Answer 49."
+    
     def test_multiple_sessions(self):
         """Test that different sessions have separate histories."""
         manager = SessionManager()
@@ -147,6 +299,1067 @@ class TestSessionManager:
         assert history2[0].content == "Question 2"
 
 
+class TestIntentClassifier:
+    """Tests for the local intent classifier."""
+    
+    def test_normalize_query(self):
+        """Test that case, punctuation and fillers are removed."""
+        assert normalize_query("  Um, WHERE does this go?? ") == "where does this go"
+    
+    def test_location_queries(self):
+        """Test placement questions about the held organ."""
+        heart = get_organ_info("heart")
+        for query in ["Where does this go?", "where should I put this?",
+                      "Where does the heart go?", "Show me where it goes please"]:
+            assert classify_intent(query, "heart", heart) == QueryIntent.LOCATION
+    
+    def test_identify_queries(self):
+        """Test "what is this" questions."""
+        liver = get_organ_info("liver")
+        assert classify_intent("What is this?", "liver", liver) == QueryIntent.IDENTIFY
+        assert classify_intent("what organ is this", "liver", liver) == QueryIntent.IDENTIFY
+    
+    def test_ambiguous_queries_fall_through(self):
+        """Test that compound or unrelated questions are left to the agent."""
+        heart = get_organ_info("heart")
+        assert classify_intent("Where does the liver go?", "heart", heart) is None
+        assert classify_intent("Where does this go and why is it shaped like that?", "heart", heart) is None
+        assert classify_intent("How many chambers does it have?", "heart", heart) is None
+    
+    def test_location_answer_highlights_socket(self):
+        """Test that the location answer includes the highlight action."""
+        data = answer_from_knowledge_base(QueryIntent.LOCATION, get_organ_info("stomach"))
+        assert "Stomach" in data["displayText"]
+        assert data["actions"] == [highlight_object.invoke({"target_id": "socket_stomach"})]
+
+
+class TestResponseCache:
+    """Tests for the agent response cache."""
+    
+    def _response(self, text="The heart has four chambers."):
+        return VRQueryResponse(
+            displayText=text,
+            spokenResponse=text,
+            actions=[{"command": "playSound", "targetID": "chime"}]
+        )
+    
+    def test_normalized_queries_share_key(self):
+        """Test that case, punctuation and fillers do not change the key."""
+        assert normalize_cache_query("Um, how many CHAMBERS does it have?") == \
+            normalize_cache_query("how many chambers does it have")
+    
+    def test_follow_up_detection(self):
+        """Test that history-dependent questions are detected."""
+        assert is_follow_up("Tell me more about that")
+        assert is_follow_up("What about the other one?")
+        assert not is_follow_up("How many chambers does it have?")
+    
+    def test_hit_and_miss(self):
+        """Test cache hits, misses and keying on the held organ."""
+        cache = ResponseCache(max_entries=10, ttl_seconds=60, max_bytes=10000, enabled=True)
+        assert cache.get("heart", "How big is it?") is None
+        cache.put("heart", "How big is it?", self._response())
+        
+        cached = cache.get("heart", "how big is it")
+        assert cached.actions[0].command == "playSound"
+        assert cache.get("liver", "How big is it?") is None
+        assert cache.stats()["hits"] == 1
+        assert cache.stats()["misses"] == 2
+    
+    def test_lru_eviction(self):
+        """Test that the least recently used entry is evicted."""
+        cache = ResponseCache(max_entries=2, ttl_seconds=60, max_bytes=10000, enabled=True)
+        cache.put("heart", "q1", self._response())
+        cache.put("heart", "q2", self._response())
+        cache.get("heart", "q1")
+        cache.put("heart", "q3", self._response())
+        
+        assert cache.get("heart", "q2") is None
+        assert cache.get("heart", "q1") is not None
+        assert cache.stats()["evictions"] == 1
+    
+    def test_ttl_expiry(self):
+        """Test that expired entries are not served."""
+        cache = ResponseCache(max_entries=10, ttl_seconds=0, max_bytes=10000, enabled=True)
+        cache.put("heart", "q1", self._response())
+        assert cache.get("heart", "q1") is None
+        assert cache.stats()["expirations"] == 1
+    
+    def test_memory_cap(self):
+        """Test that the byte limit bounds the cache size."""
+        cache = ResponseCache(max_entries=100, ttl_seconds=60, max_bytes=400, enabled=True)
+        for i in range(10):
+            cache.put("heart", f"question {i}", self._response())
+        assert cache.stats()["bytes"] <= 400
+        assert cache.stats()["entries"] < 10
+    
+    @patch('app.routes.agent_executor')
+    def test_endpoint_serves_repeated_query_from_cache(self, mock_agent):
+        """Test that a repeated question from another session skips the agent."""
+        mock_agent.ainvoke = AsyncMock(return_value={
+            "output": "The liver weighs about 3 pounds.",
+            "intermediate_steps": []
+        })
+        query = "How heavy is it?"
+        first = client.post("/medtech/query", json={
+            "sessionID": "cache_session_a", "context": {"heldObject": "liver"}, "query": query
+        })
+        second = client.post("/medtech/query", json={
+            "sessionID": "cache_session_b", "context": {"heldObject": "liver"}, "query": query.upper()
+        })
+        
+        assert first.headers["X-MeXR-Served-By"] == "agent"
+        assert second.headers["X-MeXR-Served-By"] == "cache"
+        assert second.json() == first.json()
+        mock_agent.ainvoke.assert_awaited_once()
+    
+    @patch('app.routes.agent_executor')
+    def test_endpoint_skips_cache_for_follow_ups(self, mock_agent):
+        """Test that follow-up questions always reach the agent."""
+        mock_agent.ainvoke = AsyncMock(return_value={"output": "More detail.", "intermediate_steps": []})
+        for session_id in ("follow_up_a", "follow_up_b"):
+            response = client.post("/medtech/query", json={
+                "sessionID": session_id, "context": {"heldObject": "heart"}, "query": "Tell me more"
+            })
+            assert response.headers["X-MeXR-Served-By"] == "agent"
+        assert mock_agent.ainvoke.await_count == 2
+
+
+class TestAnswerPack:
+    """Tests for the pre-generated answer pack."""
+
+    @staticmethod
+    def _generate(organ_ids=("heart",)):
+        import asyncio
+        from app.answer_pack import generate_pack
+        agent = Mock()
+        agent.ainvoke = AsyncMock(return_value={
+            "output": "It pumps blood.",
+            "intermediate_steps": [(Mock(), {"command": "highlight", "targetID": "socket_heart"})],
+        })
+        return asyncio.run(generate_pack(agent, list(organ_ids))), agent
+
+    def test_generate_and_round_trip(self, tmp_path):
+        """Test that each canonical question is asked once and every phrasing survives a round trip."""
+        from app.answer_pack import AnswerPack, CANONICAL_QUESTIONS
+        pack, agent = self._generate()
+        assert agent.ainvoke.await_count == len(CANONICAL_QUESTIONS)
+
+        path = str(tmp_path / "pack.json")
+        pack.write(path)
+        loaded = AnswerPack.from_file(path)
+        assert len(loaded) == len(pack)
+        assert len(json.load(open(path))["answers"]) == len(CANONICAL_QUESTIONS)
+        response = loaded.get("heart", "Um, what does this do?")
+        assert response.displayText == "It pumps blood."
+        assert response.actions[0].targetID == "socket_heart"
+        assert loaded.get("liver", "What does this do?") is None
+
+    def test_stale_pack_not_served(self, tmp_path):
+        """Test that a pack built from another knowledge base version is not served."""
+        from app.answer_pack import AnswerPackStore
+        pack, _ = self._generate()
+        pack.knowledge_base_version = "outdated"
+        path = str(tmp_path / "pack.json")
+        pack.write(path)
+        store = AnswerPackStore(path)
+        assert store.get("heart", "What does this do?") is None
+        assert store.stats()["status"] == "stale_knowledge_base"
+        assert AnswerPackStore(str(tmp_path / "missing.json")).stats()["status"] == "missing"
+
+    def test_pack_versioned_with_engine_and_prompt_inputs(self, tmp_path):
+        """Test that a pack built for another engine, organ block template or corpus is not served."""
+        import asyncio
+        from app.answer_pack import AnswerPackStore, generate_pack, prompt_version
+        from app.retrieval import passage_retriever
+        agent = Mock()
+        agent.ainvoke = AsyncMock(return_value={"output": "It pumps blood.", "intermediate_steps": []})
+        for engine, status in (("executor", "loaded"), ("structured", "stale_prompt")):
+            pack = asyncio.run(generate_pack(agent, ["heart"], engine=engine))
+            path = str(tmp_path / f"{engine}.json")
+            pack.write(path)
+            store = AnswerPackStore(path)
+            assert store.stats()["status"] == status
+            assert json.load(open(path))["engine"] == engine
+        
+        version = prompt_version("executor")
+        with patch('app.answer_pack.ORGAN_BLOCK_TEMPLATE', "Held Organ: {displayName}"):
+            assert prompt_version("executor") != version
+        with patch.object(passage_retriever.index, "version", "other-corpus"):
+            assert prompt_version("executor") != version
+    
+    @patch('app.routes.agent_executor')
+    def test_endpoint_serves_pack(self, mock_agent, tmp_path):
+        """Test that canonical questions are answered from the pack in well under a millisecond."""
+        import time
+        from app.answer_pack import AnswerPackStore
+        pack, _ = self._generate()
+        path = str(tmp_path / "pack.json")
+        pack.write(path)
+        store = AnswerPackStore(path)
+        mock_agent.ainvoke = AsyncMock(return_value={"output": "Live answer.", "intermediate_steps": []})
+
+        with patch('app.routes.answer_pack', store):
+            response = client.post("/medtech/query", json={
+                "sessionID": "pack_session", "context": {"heldObject": "heart"}, "query": "What is its function?"
+            })
+            follow_up = client.post("/medtech/query", json={
+                "sessionID": "pack_session", "context": {"heldObject": "heart"}, "query": "What does it do again?"
+            })
+        assert response.headers["X-MeXR-Served-By"] == "pack"
+        assert response.json()["displayText"] == "It pumps blood."
+        assert follow_up.headers["X-MeXR-Served-By"] == "agent"
+        assert mock_agent.ainvoke.await_count == 1
+
+        started = time.perf_counter()
+        for _ in range(1000):
+            store.get("heart", "What is the function of the heart?")
+        assert (time.perf_counter() - started) / 1000 < 0.001
+        assert store.stats()["hits"] >= 1001
+
+
+def parse_sse(body):
+    """Parse a server-sent event stream into (event, data) pairs."""
+    import json
+    events = []
+    for block in body.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+class TestStreaming:
+    """Tests for the streaming query endpoint."""
+    
+    def test_format_sse(self):
+        """Test server-sent event encoding."""
+        assert format_sse("text", {"text": "Hi"}) == 'event: text\ndata: {"text": "Hi"}\n\n'
+    
+    def test_chunker_splits_on_sentences(self):
+        """Test that text is released in sentence-sized chunks."""
+        chunker = TTSChunker(min_chars=10, max_chars=100)
+        chunks = []
+        for token in ["The heart ", "pumps blood. ", "It has four ", "chambers. And"]:
+            chunks.extend(chunker.feed(token))
+        assert chunks == ["The heart pumps blood.", "It has four chambers."]
+        assert chunker.flush() == "And"
+    
+    def test_chunker_splits_long_text(self):
+        """Test that text without punctuation is split at word boundaries."""
+        chunker = TTSChunker(min_chars=10, max_chars=20)
+        chunks = chunker.feed("one two three four five six seven")
+        assert all(len(chunk) <= 20 for chunk in chunks)
+        assert " ".join(chunks + [chunker.flush()]) == "one two three four five six seven"
+    
+    def test_stream_fast_path(self):
+        """Test streaming a knowledge base answer."""
+        response = client.post("/medtech/query/stream", json={
+            "sessionID": "stream_fast", "context": {"heldObject": "heart"}, "query": "Where does this go?"
+        })
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/event-stream")
+        events = parse_sse(response.text)
+        assert events[0] == ("action", highlight_object.invoke({"target_id": "socket_heart"}))
+        assert events[-1][0] == "done"
+        assert set(events[-1][1]) == {"displayText", "spokenResponse", "actions"}
+    
+    @patch('app.routes.agent_executor')
+    def test_stream_agent_events(self, mock_agent):
+        """Test that actions and text chunks are streamed before the final response."""
+        async def fake_events(agent_input, version):
+            yield {"event": "on_tool_end", "name": "highlight_object", "parent_ids": ["run"],
+                   "data": {"output": {"command": "highlight", "targetID": "socket_liver"}}}
+            for token in ["The liver ", "filters the blood. ", "It is large."]:
+                yield {"event": "on_chat_model_stream", "run_id": "answer", "parent_ids": ["run"],
+                       "data": {"chunk": AIMessageChunk(content=token)}}
+            yield {"event": "on_chat_model_end", "run_id": "answer", "parent_ids": ["run"],
+                   "data": {"output": AIMessageChunk(content="The liver filters the blood. It is large.")}}
+            yield {"event": "on_chain_end", "parent_ids": [],
+                   "data": {"output": {"output": "The liver filters the blood. It is large."}}}
+        mock_agent.astream_events = fake_events
+        
+        response = client.post("/medtech/query/stream", json={
+            "sessionID": "stream_agent", "context": {"heldObject": "liver"}, "query": "What does it filter?"
+        })
+        events = parse_sse(response.text)
+        assert events[0][0] == "action"
+        text_chunks = [data["text"] for kind, data in events if kind == "text"]
+        assert " ".join(text_chunks) == "The liver filters the blood. It is large."
+        assert events[-1][1]["displayText"] == "The liver filters the blood. It is large."
+        assert events[-1][1]["actions"][0]["targetID"] == "socket_liver"
+
+    @pytest.mark.asyncio
+    async def test_text_before_tool_call_is_not_spoken(self):
+        """Test that text a model call produces before requesting a tool mid-sentence is dropped."""
+        from app.streaming import iter_agent_events
+
+        class FakeAgent:
+            async def astream_events(self, agent_input, version):
+                yield {"event": "on_chat_model_stream", "run_id": "tools", "data": {"chunk": AIMessageChunk(content="Let me show you")}}
+                yield {"event": "on_chat_model_stream", "run_id": "tools", "data": {"chunk": AIMessageChunk(
+                    content="", tool_call_chunks=[{"name": "highlight_object", "args": "{}", "id": "call_1", "index": 0}])}}
+                yield {"event": "on_chat_model_end", "run_id": "tools", "data": {"output": AIMessageChunk(content="Let me show you")}}
+                yield {"event": "on_tool_end", "name": "highlight_object", "data": {"output": {"command": "highlight", "targetID": "heart"}}}
+                yield {"event": "on_chat_model_stream", "run_id": "answer", "data": {"chunk": AIMessageChunk(content="It pumps blood.")}}
+                yield {"event": "on_chat_model_end", "run_id": "answer", "data": {"output": AIMessageChunk(content="It pumps blood.")}}
+                yield {"event": "on_chain_end", "parent_ids": [], "data": {"output": {"output": "It pumps blood."}}}
+
+        events = [event async for event in iter_agent_events(FakeAgent(), {"input": "What does it do?"})]
+        assert events == [
+            ("action", {"command": "highlight", "targetID": "heart"}),
+            ("token", "It pumps blood."),
+            ("output", "It pumps blood."),
+        ]
+
+
+    @pytest.mark.asyncio
+    async def test_answer_tokens_streamed_before_call_ends(self):
+        """Test that tokens are streamed once a sentence is complete, before the model call ends."""
+        from app.streaming import iter_agent_events
+        seen = []
+
+        class FakeAgent:
+            async def astream_events(self, agent_input, version):
+                for token in ["The heart ", "pumps blood. ", "It has four chambers."]:
+                    yield {"event": "on_chat_model_stream", "run_id": "answer", "data": {"chunk": AIMessageChunk(content=token)}}
+                seen.append("model_end")
+                yield {"event": "on_chat_model_end", "run_id": "answer", "data": {"output": AIMessageChunk(content="")}}
+                yield {"event": "on_chain_end", "parent_ids": [], "data": {"output": {"output": "Done."}}}
+
+        async for kind, payload in iter_agent_events(FakeAgent(), {"input": "What does it do?"}):
+            seen.append((kind, payload))
+        assert seen[:4] == [
+            ("token", "The heart "), ("token", "pumps blood. "), ("token", "It has four chambers."), "model_end"
+        ]
+
+
+class TestWebSocket:
+    """Tests for the persistent session WebSocket."""
+    
+    def test_context_then_query(self):
+        """Test binding context once and querying over the same connection."""
+        with client.websocket_connect("/medtech/ws/ws_session") as ws:
+            ws.send_json({"type": "context", "context": {"heldObject": "heart"}})
+            assert ws.receive_json() == {"type": "context", "context": {"heldObject": "heart"}}
+            
+            ws.send_json({"type": "query", "query": "Where does this go?", "requestID": "r1"})
+            messages = []
+            while not messages or messages[-1]["type"] != "response":
+                messages.append(ws.receive_json())
+            assert messages[0]["type"] == "action"
+            assert messages[0]["action"]["targetID"] == "socket_heart"
+            assert messages[-1]["requestID"] == "r1"
+            assert messages[-1]["servedBy"] == "fast-path"
+            assert set(messages[-1]["response"]) == {"displayText", "spokenResponse", "actions"}
+    
+    def test_ping_and_errors(self):
+        """Test heartbeats and malformed messages."""
+        with client.websocket_connect("/medtech/ws/ws_errors") as ws:
+            ws.send_json({"type": "ping"})
+            assert ws.receive_json() == {"type": "pong"}
+            ws.send_json({"type": "query", "query": "What is this?"})
+            assert ws.receive_json()["type"] == "error"
+            ws.send_text("not json")
+            assert ws.receive_json()["type"] == "error"
+    
+    def test_shares_history_and_keeps_it_on_disconnect(self):
+        """Test that history is shared with HTTP and kept on disconnect unless release is configured."""
+        from app.session import session_manager
+        from app.websocket import connection_registry
+
+        def ask(session_id):
+            with client.websocket_connect(f"/medtech/ws/{session_id}") as ws:
+                ws.send_json({"type": "query", "query": "What is this?", "context": {"heldObject": "liver"}})
+                while ws.receive_json()["type"] != "response":
+                    pass
+                assert len(session_manager.get_history(session_id)) == 2
+                assert connection_registry.stats()["sessions"] == 1
+
+        ask("ws_history")
+        assert len(session_manager.get_history("ws_history")) == 2
+        assert connection_registry.stats()["sessions"] == 0
+
+        with patch('app.routes.WS_RELEASE_SESSION_ON_DISCONNECT', True):
+            ask("ws_released")
+        assert session_manager.get_history("ws_released") == []
+
+
+class TestBroadcast:
+    """Tests for classroom broadcast groups."""
+
+    def test_fan_out_with_slow_subscriber(self):
+        """Test that one publish reaches hundreds of subscribers and a full queue drops its oldest message."""
+        import asyncio
+        from app.broadcast import GroupRegistry
+        groups = GroupRegistry(queue_size=4, max_subscribers=500)
+        subscriptions = [groups.subscribe("hall", f"headset_{i}") for i in range(300)]
+        assert groups.subscribe("hall", "late") is not None
+        small = GroupRegistry(max_subscribers=1)
+        assert small.subscribe("full", "a") is not None
+        assert small.subscribe("full", "b") is None
+
+        for i in range(6):
+            assert groups.publish("hall", "broadcast", index=i) == 301
+        first = json.loads(asyncio.run(subscriptions[0].get()))
+        assert first == {"type": "broadcast", "groupID": "hall", "seq": 3, "index": 2}
+        assert subscriptions[1].dropped == 2
+        assert groups.stats()["groups"]["hall"]["pending"] == 301 * 4 - 1
+
+        for subscription in subscriptions:
+            groups.unsubscribe(subscription)
+        assert groups.stats()["groups"]["hall"]["subscribers"] == 1
+        assert groups.publish("empty", "broadcast") == 0
+
+    @patch('app.routes.agent_executor')
+    def test_group_query_runs_agent_once(self, mock_agent):
+        """Test that a group query runs the agent once and queues the answer for every subscriber."""
+        import asyncio
+        from app.session import session_manager
+        mock_agent.ainvoke = AsyncMock(return_value={
+            "output": "The heart pumps blood.",
+            "intermediate_steps": [(Mock(), {"command": "highlight", "targetID": "heart"})],
+        })
+        subscriptions = [session_manager.groups.subscribe("anatomy_101", f"student_{i}") for i in range(30)]
+        try:
+            response = client.post("/medtech/groups/anatomy_101/query", json={
+                "sessionID": "instructor", "context": {"heldObject": "heart"}, "query": "Why does it beat?",
+            })
+            assert response.status_code == 200
+            assert response.json()["subscribers"] == 30
+            assert response.json()["servedBy"] == "agent"
+            assert mock_agent.ainvoke.await_count == 1
+            for subscription in subscriptions:
+                message = json.loads(asyncio.run(subscription.get()))
+                assert message["sessionID"] == "instructor"
+                assert message["response"]["actions"][0]["targetID"] == "heart"
+        finally:
+            for subscription in subscriptions:
+                session_manager.groups.unsubscribe(subscription)
+
+    def test_websocket_join_and_broadcast(self):
+        """Test joining a group over the WebSocket and broadcasting an answer to it."""
+        with client.websocket_connect("/medtech/ws/ws_teacher") as ws:
+            ws.send_json({"type": "join", "groupID": "ws_class"})
+            assert ws.receive_json() == {"type": "joined", "groupID": "ws_class", "members": 1}
+            ws.send_json({"type": "query", "query": "Where does this go?", "broadcast": True,
+                          "context": {"heldObject": "heart"}})
+            messages = []
+            while not messages or messages[-1]["type"] != "broadcast":
+                messages.append(ws.receive_json())
+            assert messages[-2]["type"] == "response"
+            assert messages[-1]["response"] == messages[-2]["response"]
+            assert client.get("/medtech/groups/stats").json()["groups"]["ws_class"]["subscribers"] == 1
+            ws.send_json({"type": "leave"})
+            assert ws.receive_json() == {"type": "left", "groupID": "ws_class"}
+        assert "ws_class" not in client.get("/medtech/groups/stats").json()["groups"]
+
+
+@pytest.fixture(params=["memory", "sqlite", "redis"])
+def session_backend(request, tmp_path):
+    """Fixture providing each session storage backend."""
+    if request.param == "memory":
+        yield InMemorySessionBackend()
+    elif request.param == "sqlite":
+        backend = SQLiteSessionBackend(str(tmp_path / "sessions.db"))
+        yield backend
+        backend.close()
+    else:
+        fakeredis = pytest.importorskip("fakeredis")
+        yield RedisSessionBackend(client=fakeredis.FakeRedis())
+
+
+class TestSessionBackends:
+    """Tests for the pluggable session storage backends."""
+    
+    def test_history_round_trip(self, session_backend):
+        """Test that history survives a round trip through the backend."""
+        manager = SessionManager(backend=session_backend)
+        manager.update_history("session1", "What is this?", "This is a heart.")
+        
+        history = manager.get_history("session1")
+        assert isinstance(history[0], HumanMessage)
+        assert [message.content for message in history] == ["What is this?", "This is a heart."]
+    
+    def test_history_trimmed_by_backend(self, session_backend):
+        """Test that the backend keeps only the most recent turns."""
+        manager = SessionManager(backend=session_backend)
+        for i in range(15):
+            manager.update_history("session1", f"Question {i}", f"Answer {i}")
+        
+        assert len(session_backend.load_turns("session1")) == 5
+        assert manager.get_history("session1")[-1].content == "Answer 14"
+    
+    def test_summary_round_trip(self, session_backend):
+        """Test that compaction stores the summary and keeps only the newest turns."""
+        for i in range(3):
+            session_backend.append_turn("session1", f"Question {i}", f"Answer {i}", max_turns=5)
+        session_backend.compact("session1", "- Asked: Question 0 Answered: Answer 0", keep_turns=2)
+        
+        summary, turns = session_backend.load_session("session1")
+        assert summary == "- Asked: Question 0 Answered: Answer 0"
+        assert turns == [("Question 1", "Answer 1"), ("Question 2", "Answer 2")]
+        session_backend.delete("session1")
+        assert session_backend.load_session("session1") == (None, [])
+    
+    def test_clear_and_isolation(self, session_backend):
+        """Test that sessions are isolated and can be cleared."""
+        manager = SessionManager(backend=session_backend)
+        manager.update_history("session1", "Question 1", "Answer 1")
+        manager.update_history("session2", "Question 2", "Answer 2")
+        manager.clear_history("session1")
+        
+        assert manager.get_history("session1") == []
+        assert manager.get_history("session2")[0].content == "Question 2"
+        assert manager.stats()["sessions"] == 1
+    
+    def test_sqlite_shared_between_managers(self, tmp_path):
+        """Test that two workers using the same database file see the same history."""
+        path = str(tmp_path / "shared.db")
+        worker_a = SessionManager(backend=SQLiteSessionBackend(path))
+        worker_b = SessionManager(backend=SQLiteSessionBackend(path))
+        worker_a.update_history("session1", "Question", "Answer")
+        assert worker_b.get_history("session1")[1].content == "Answer"
+    
+    def test_sqlite_concurrent_compaction_between_managers(self, tmp_path):
+        """Test that two workers compacting the same session lose no turn and keep the summary consistent."""
+        import threading
+        path = str(tmp_path / "shared.db")
+        workers = [
+            SessionManager(backend=SQLiteSessionBackend(path), token_budget=20, summary_max_tokens=100000)
+            for _ in range(2)
+        ]
+        
+        def ask(worker, name):
+            for i in range(25):
+                worker.update_history("session1", f"Question {name}{i}", f"Answer {name}{i}.")
+        
+        threads = [threading.Thread(target=ask, args=(worker, name)) for worker, name in zip(workers, "ab")]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        summary, turns = workers[0].backend.load_session("session1")
+        summarized = [line.split(" Answered:")[0].removeprefix("- Asked: ") for line in summary.splitlines()]
+        asked = summarized + [query for query, _ in turns]
+        assert sorted(asked) == sorted(f"Question {name}{i}" for name in "ab" for i in range(25))
+        assert sum(worker.stats()["history"]["turns_summarized"] for worker in workers) == len(summarized)
+    
+    def test_sqlite_concurrent_reads_and_writes_between_managers(self, tmp_path):
+        """Test that a history read racing another worker's turn waits for the lock instead of failing."""
+        import threading
+        path = str(tmp_path / "shared.db")
+        reader = SessionManager(backend=SQLiteSessionBackend(path))
+        writer = SessionManager(backend=SQLiteSessionBackend(path))
+        writer.update_history("session1", "Question", "Answer")
+        errors = []
+        
+        def run(step):
+            try:
+                for i in range(200):
+                    step(i)
+            except Exception as exc:
+                errors.append(exc)
+        
+        threads = [
+            threading.Thread(target=run, args=(lambda i: reader.get_prompt_history("session1"),)),
+            threading.Thread(target=run, args=(lambda i: writer.update_history("session1", f"Q{i}", f"A{i}"),)),
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        assert errors == []
+    
+    @pytest.mark.asyncio
+    async def test_blocking_backend_runs_off_event_loop(self, tmp_path):
+        """Test that SQLite history calls run in a worker thread while in-memory ones stay inline."""
+        import threading
+        loop_thread = threading.get_ident()
+        for backend, offloaded in ((SQLiteSessionBackend(str(tmp_path / "s.db")), True),
+                                   (InMemorySessionBackend(), False)):
+            manager = SessionManager(backend=backend)
+            threads = []
+            original = backend.load_session
+            
+            def load_session(session_id, original=original):
+                threads.append(threading.get_ident())
+                return original(session_id)
+            
+            with patch.object(backend, "load_session", side_effect=load_session):
+                await manager.aupdate_history("session1", "Question", "Answer")
+                history = await manager.aget_prompt_history("session1")
+            
+            assert [message.content for message in history] == ["Question", "Answer"]
+            assert (threads[-1] != loop_thread) is offloaded
+    
+    def test_redis_compaction_retries_after_concurrent_turn(self):
+        """Test that a compaction racing another worker's turn is retried on the new state."""
+        fakeredis = pytest.importorskip("fakeredis")
+        server = fakeredis.FakeServer()
+        worker_a = SessionManager(backend=RedisSessionBackend(client=fakeredis.FakeRedis(server=server)),
+                                  token_budget=20, summary_max_tokens=100000)
+        worker_b = SessionManager(backend=RedisSessionBackend(client=fakeredis.FakeRedis(server=server)))
+        worker_a.update_history("session1", "Question 1", "Answer 1.")
+        
+        calls = []
+        original = worker_a._recent_turns
+        
+        def racing_recent_turns(turns):
+            calls.append(list(turns))
+            if len(calls) == 1:
+                # Another worker records a turn between worker A's read and write
+                worker_b.update_history("session1", "Question 2", "Answer 2.")
+            return original(turns)
+        
+        with patch.object(worker_a, "_recent_turns", side_effect=racing_recent_turns):
+            worker_a.update_history("session1", "Question 3", "Answer 3.")
+        
+        assert [query for query, _ in calls[-1]] == ["Question 1", "Question 2", "Question 3"]
+        summary, turns = worker_a.backend.load_session("session1")
+        summarized = [line.split(" Answered:")[0].removeprefix("- Asked: ") for line in (summary or "").splitlines()]
+        assert summarized + [query for query, _ in turns] == ["Question 1", "Question 2", "Question 3"]
+    
+    def test_sqlite_adds_summary_column(self, tmp_path):
+        """Test that a database created without the summary column is upgraded."""
+        import sqlite3
+        path = str(tmp_path / "old.db")
+        conn = sqlite3.connect(path)
+        conn.execute("CREATE TABLE sessions (session_id TEXT PRIMARY KEY, last_access REAL NOT NULL)")
+        conn.close()
+        backend = SQLiteSessionBackend(path)
+        backend.append_turn("session1", "Question", "Answer", max_turns=5)
+        backend.compact("session1", "Earlier turns", keep_turns=1)
+        assert backend.load_session("session1") == ("Earlier turns", [("Question", "Answer")])
+        backend.close()
+    
+    def test_sqlite_idle_sweep(self, tmp_path):
+        """Test that idle SQLite sessions are swept."""
+        backend = SQLiteSessionBackend(str(tmp_path / "sweep.db"), idle_ttl=0)
+        backend.append_turn("session1", "Question", "Answer", max_turns=5)
+        assert backend.sweep() == 1
+        assert backend.stats()["turns"] == 0
+    
+    def test_unknown_backend(self):
+        """Test that an unknown backend name is rejected."""
+        with pytest.raises(ValueError):
+            create_session_backend("postgres")
+
+
+class TestConcurrency:
+    """Tests for per-session ordering and in-flight deduplication."""
+    
+    @pytest.mark.asyncio
+    async def test_keyed_locks_serialize_in_order(self):
+        """Test that work for one key runs one at a time in arrival order."""
+        import asyncio
+        from app.concurrency import KeyedLocks
+        locks = KeyedLocks()
+        order = []
+        
+        async def work(i):
+            async with locks.hold("session1"):
+                order.append(("start", i))
+                await asyncio.sleep(0.01)
+                order.append(("end", i))
+        
+        await asyncio.gather(*(work(i) for i in range(3)))
+        assert order == [("start", 0), ("end", 0), ("start", 1), ("end", 1), ("start", 2), ("end", 2)]
+        assert len(locks) == 0
+    
+    @pytest.mark.asyncio
+    async def test_single_flight_shares_result(self):
+        """Test that concurrent calls with the same key run once."""
+        import asyncio
+        from app.concurrency import SingleFlight
+        flight = SingleFlight()
+        calls = []
+        
+        async def work():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return "answer"
+        
+        results = await asyncio.gather(*(flight.do("key", work) for _ in range(3)))
+        assert results == ["answer"] * 3
+        assert len(calls) == 1
+        assert flight.stats() == {"executed": 1, "shared": 2, "in_flight": 0}
+    
+    @pytest.mark.asyncio
+    @patch('app.routes.agent_executor')
+    async def test_duplicate_requests_share_agent_run(self, mock_agent):
+        """Test that a retried query shares the original agent invocation."""
+        import asyncio
+        import httpx
+        from app.session import session_manager
+        
+        async def slow_answer(agent_input):
+            await asyncio.sleep(0.05)
+            return {"output": "It has four chambers.", "intermediate_steps": []}
+        mock_agent.ainvoke = AsyncMock(side_effect=slow_answer)
+        
+        request_data = {
+            "sessionID": "dedup_session", "context": {"heldObject": "heart"},
+            "query": "How many chambers does it have?"
+        }
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as async_client:
+            responses = await asyncio.gather(
+                async_client.post("/medtech/query", json=request_data),
+                async_client.post("/medtech/query", json=request_data),
+            )
+        
+        assert responses[0].json() == responses[1].json()
+        assert mock_agent.ainvoke.await_count == 1
+        assert len(session_manager.get_history("dedup_session")) == 2
+    
+    @pytest.mark.asyncio
+    @patch('app.routes.agent_executor')
+    async def test_session_turns_applied_in_order(self, mock_agent):
+        """Test that concurrent turns of one session do not overlap or reorder."""
+        import asyncio
+        import httpx
+        from app.session import session_manager
+        active = []
+        
+        async def answer(agent_input):
+            active.append(1)
+            assert len(active) == 1
+            await asyncio.sleep(0.02)
+            active.pop()
+            return {"output": f"Answer to {agent_input['input'].strip()}", "intermediate_steps": []}
+        mock_agent.ainvoke = AsyncMock(side_effect=answer)
+        
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as async_client:
+            first = asyncio.ensure_future(async_client.post("/medtech/query", json={
+                "sessionID": "ordered_session", "context": {"heldObject": "heart"}, "query": "Why is it red?"
+            }))
+            await asyncio.sleep(0.005)
+            second = asyncio.ensure_future(async_client.post("/medtech/query", json={
+                "sessionID": "ordered_session", "context": {"heldObject": "heart"}, "query": "Where does this go?"
+            }))
+            await asyncio.gather(first, second)
+        
+        history = session_manager.get_history("ordered_session")
+        assert [message.content for message in history[::2]] == ["Why is it red?", "Where does this go?"]
+
+
+class TestStructuredEngine:
+    """Tests for the single-call structured output engine."""
+    
+    def _engine(self, answer):
+        from langchain_core.prompts import ChatPromptTemplate
+        from langchain_core.runnables import RunnableLambda
+        from app.agent import StructuredOutputEngine
+        
+        llm = Mock()
+        llm.with_structured_output = lambda schema: RunnableLambda(lambda _: schema(**answer))
+        prompt = ChatPromptTemplate.from_messages([("human", "{input}")])
+        return StructuredOutputEngine(llm, get_all_tools(), prompt)
+    
+    def test_action_schema_validates_tool_arguments(self):
+        """Test that the schema accepts known tools and rejects invalid actions."""
+        from pydantic import ValidationError
+        from app.agent import build_action_schema
+        schema = build_action_schema(get_all_tools())
+        
+        answer = schema(answer="Done.", actions=[{"tool": "play_sound", "sound_id": "chime"}])
+        assert answer.actions[0].sound_id == "chime"
+        with pytest.raises(ValidationError):
+            schema(answer="Done.", actions=[{"tool": "delete_scene"}])
+        with pytest.raises(ValidationError):
+            schema(answer="Done.", actions=[{"tool": "highlight_object"}])
+    
+    @pytest.mark.asyncio
+    async def test_engine_runs_tools_locally(self):
+        """Test that requested actions are executed locally in AgentExecutor result format."""
+        engine = self._engine({
+            "answer": "It goes in the chest.",
+            "actions": [{"tool": "highlight_object", "target_id": "socket_heart", "color": "#FF0000"}]
+        })
+        result = await engine.ainvoke({"input": "Where?", "chat_history": []})
+        
+        assert result["output"] == "It goes in the chest."
+        assert result["intermediate_steps"][0][1] == highlight_object.invoke(
+            {"target_id": "socket_heart", "color": "#FF0000"}
+        )
+    
+    @pytest.mark.asyncio
+    async def test_engine_event_stream(self):
+        """Test that the engine reports actions and output as agent events."""
+        from app.streaming import iter_agent_events
+        engine = self._engine({"answer": "Ding.", "actions": [{"tool": "play_sound", "sound_id": "chime"}]})
+        events = [event async for event in iter_agent_events(engine, {"input": "Hi", "chat_history": []})]
+        assert events == [("action", {"command": "playSound", "targetID": "chime"}), ("output", "Ding.")]
+    
+    @patch('app.routes.agent_executor')
+    def test_stream_speaks_structured_answer(self, mock_agent):
+        """Test that a streamed structured engine answer is sent as text chunks for speech."""
+        engine = self._engine({
+            "answer": "The liver filters the blood. It also stores energy as glycogen.",
+            "actions": [{"tool": "highlight_object", "target_id": "liver"}]
+        })
+        mock_agent.astream_events = engine.astream_events
+
+        response = client.post("/medtech/query/stream", json={
+            "sessionID": "stream_structured", "context": {"heldObject": "liver"}, "query": "How does it store energy?"
+        })
+        events = parse_sse(response.text)
+        text_chunks = [data["text"] for kind, data in events if kind == "text"]
+        assert text_chunks
+        assert " ".join(text_chunks) == "The liver filters the blood. It also stores energy as glycogen."
+        assert events[0][0] == "action"
+        assert events[-1][0] == "done"
+    
+    def test_create_agent_engine_switch(self):
+        """Test selecting the agent engine."""
+        from langchain.agents import AgentExecutor
+        from app.agent import create_agent, StructuredOutputEngine
+        assert isinstance(create_agent("executor"), AgentExecutor)
+        assert isinstance(create_agent("structured"), StructuredOutputEngine)
+        with pytest.raises(ValueError):
+            create_agent("unknown")
+
+
+class TestBatchQuery:
+    """Tests for the batch query endpoint."""
+    
+    @patch('app.routes.agent_executor')
+    def test_results_in_input_order_with_errors(self, mock_agent):
+        """Test that results keep input order and a failed agent run falls back for its item only."""
+        async def answer(agent_input):
+            if "explode" in agent_input["input"]:
+                raise RuntimeError("upstream failure")
+            return {"output": "An answer.", "intermediate_steps": []}
+        mock_agent.ainvoke = AsyncMock(side_effect=answer)
+        
+        response = client.post("/medtech/query/batch", json={"requests": [
+            {"sessionID": "batch_a", "context": {"heldObject": "heart"}, "query": "Where does this go?"},
+            {"sessionID": "batch_b", "context": {"heldObject": "liver"}, "query": "Why does it explode?"},
+            {"sessionID": "batch_c", "context": {"heldObject": "spleen"}, "query": "What is this?"},
+            {"sessionID": "batch_a", "context": {"heldObject": "heart"}, "query": "How big is it?"},
+        ]})
+        assert response.status_code == 200
+        results = response.json()["results"]
+        
+        assert [result["index"] for result in results] == [0, 1, 2, 3]
+        assert results[0]["servedBy"] == "fast-path"
+        assert results[1]["servedBy"] == "fallback"
+        assert "Liver" in results[1]["response"]["displayText"]
+        assert "spleen" in results[2]["response"]["displayText"]
+        assert results[3]["response"]["displayText"] == "An answer."
+    
+    @patch('app.routes.agent_executor')
+    def test_batch_charged_per_agent_query(self, mock_agent):
+        """Test that a batch is charged one token per agent query, up front, against its session and client."""
+        from app.admission import session_rate_limiter, client_rate_limiter
+        mock_agent.ainvoke = AsyncMock(return_value={"output": "An answer.", "intermediate_steps": []})
+        burst = session_rate_limiter.burst
+        requests = [
+            {"sessionID": "batch_big", "context": {"heldObject": "heart"}, "query": f"Question number {i}?"}
+            for i in range(burst)
+        ]
+        free = {"sessionID": "batch_big", "context": {"heldObject": "heart"}, "query": "Where does this go?"}
+        session_allowed = session_rate_limiter.stats()["allowed"]
+        client_allowed = client_rate_limiter.stats()["allowed"]
+        
+        response = client.post("/medtech/query/batch", json={"requests": requests + [free]})
+        assert response.status_code == 200
+        assert [result["servedBy"] for result in response.json()["results"]] == ["agent"] * burst + ["fast-path"]
+        assert session_rate_limiter.stats()["allowed"] == session_allowed + burst
+        assert client_rate_limiter.stats()["allowed"] == client_allowed + burst
+        
+        # The session's bucket is empty, so its items are refused while another session's run
+        response = client.post("/medtech/query/batch", json={"requests": requests[:1] + [
+            {"sessionID": "batch_other", "context": {"heldObject": "heart"}, "query": "Question number 99?"}
+        ]})
+        results = response.json()["results"]
+        assert results[0]["error"] == "Too many questions, please wait a moment."
+        assert results[-1]["servedBy"] == "agent"
+    
+    @patch('app.routes.agent_executor')
+    def test_oversized_batch_refused(self, mock_agent):
+        """Test that a batch with more agent queries than the session's burst is refused before any run."""
+        from app.admission import session_rate_limiter
+        mock_agent.ainvoke = AsyncMock(return_value={"output": "An answer.", "intermediate_steps": []})
+        requests = [
+            {"sessionID": "batch_huge", "context": {"heldObject": "heart"}, "query": f"Question number {i}?"}
+            for i in range(session_rate_limiter.burst + 1)
+        ]
+        
+        response = client.post("/medtech/query/batch", json={"requests": requests})
+        assert response.status_code == 429
+        assert int(response.headers["Retry-After"]) >= 1
+        mock_agent.ainvoke.assert_not_called()
+    
+    @pytest.mark.asyncio
+    @patch('app.routes.BATCH_MAX_CONCURRENCY', 2)
+    @patch('app.routes.agent_executor')
+    async def test_bounded_concurrency_and_session_order(self, mock_agent):
+        """Test the concurrency limit and in-order processing within a session."""
+        import asyncio
+        import re
+        import httpx
+        active = []
+        peak = []
+        seen = []
+        
+        async def answer(agent_input):
+            active.append(1)
+            peak.append(len(active))
+            seen.append(agent_input["input"])
+            await asyncio.sleep(0.01)
+            active.pop()
+            return {"output": "An answer.", "intermediate_steps": []}
+        mock_agent.ainvoke = AsyncMock(side_effect=answer)
+        
+        requests = [
+            {"sessionID": f"limit_{i % 3}", "context": {"heldObject": "heart"}, "query": f"Question number {i}?"}
+            for i in range(9)
+        ]
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as async_client:
+            response = await async_client.post("/medtech/query/batch", json={"requests": requests})
+        
+        assert response.status_code == 200
+        assert max(peak) == 2
+        numbers = [int(re.search(r"number (\d+)\?", text).group(1)) for text in seen]
+        assert [n for n in numbers if n % 3 == 0] == [0, 3, 6]
+    
+    def test_empty_batch_rejected(self):
+        """Test that an empty batch fails validation."""
+        response = client.post("/medtech/query/batch", json={"requests": []})
+        assert response.status_code == 422
+
+
+class TestPromptLayout:
+    """Tests for the cache-friendly prompt layout."""
+    
+    def test_organ_blocks_built_lazily(self):
+        """Test that importing the prompts does not load the knowledge base and that blocks are built on demand."""
+        import os
+        import subprocess
+        import sys
+        from app.prompts import ORGAN_PROMPT_BLOCKS, build_organ_prompt_blocks, get_organ_prompt_block
+        code = ("import app.prompts\nfrom app.knowledge_base import knowledge_base\n"
+                "assert knowledge_base._index is None and not app.prompts.ORGAN_PROMPT_BLOCKS")
+        subprocess.run([sys.executable, "-c", code], check=True, cwd=os.path.dirname(os.path.dirname(__file__)))
+
+        assert set(build_organ_prompt_blocks()) == set(get_all_organs())
+        assert get_organ_prompt_block("heart", get_organ_info("heart")) is ORGAN_PROMPT_BLOCKS["heart"]
+        assert "socket_heart" in ORGAN_PROMPT_BLOCKS["heart"]
+    
+    def test_stable_prefix_order(self):
+        """Test that the system prompt and organ facts precede history and the query."""
+        from langchain_core.messages import SystemMessage
+        from app.agent import create_agent
+        from app.prompts import SYSTEM_PROMPT, get_organ_prompt_block
+        organ_block = get_organ_prompt_block("liver", get_organ_info("liver"))
+        
+        for engine in ("executor", "structured"):
+            template = _find_prompt(create_agent(engine))
+            messages = template.format_messages(
+                input="User Query: \"Why?\"",
+                organ_context=organ_block,
+                chat_history=[HumanMessage(content="Q"), AIMessage(content="A")],
+                agent_scratchpad=[]
+            )
+            assert isinstance(messages[0], SystemMessage) and messages[0].content.startswith(SYSTEM_PROMPT)
+            assert messages[1].content == organ_block
+            assert [m.content for m in messages[2:5]] == ["Q", "A", "User Query: \"Why?\""]
+    
+    @patch('app.routes.agent_executor')
+    def test_agent_input_separates_query_from_organ_facts(self, mock_agent):
+        """Test that the human turn carries the query and its passages, not the organ facts."""
+        mock_agent.ainvoke = AsyncMock(return_value={"output": "Answer.", "intermediate_steps": []})
+        client.post("/medtech/query", json={
+            "sessionID": "prompt_session", "context": {"heldObject": "stomach"}, "query": "Why is it acidic?"
+        })
+        agent_input = mock_agent.ainvoke.call_args[0][0]
+        assert agent_input["input"].endswith('User Query: "Why is it acidic?"')
+        assert "socket_stomach" not in agent_input["input"]
+        assert "socket_stomach" in agent_input["organ_context"]
+    
+    def test_prompt_cache_stats(self):
+        """Test that cached token usage and latency are recorded per LLM call."""
+        from uuid import uuid4
+        from langchain_core.outputs import ChatGeneration, LLMResult
+        from app.prompts import PromptCacheStats
+        stats = PromptCacheStats()
+        
+        for cached in (0, 1024):
+            run_id = uuid4()
+            message = AIMessage(content="Answer.", usage_metadata={
+                "input_tokens": 1500, "output_tokens": 10, "total_tokens": 1510,
+                "input_token_details": {"cache_read": cached}
+            })
+            stats.on_chat_model_start({}, [[]], run_id=run_id)
+            stats.on_llm_end(LLMResult(generations=[[ChatGeneration(message=message)]]), run_id=run_id)
+        
+        result = stats.stats()
+        assert result["calls"] == 2
+        assert result["prompt_tokens"] == 3000
+        assert result["cached_tokens"] == 1024
+        assert result["cached_calls"] == 1
+        assert result["mean_latency_cached"] is not None
+    
+    def test_count_tokens(self):
+        """Test that token counting returns a positive count."""
+        from app.prompts import count_tokens
+        assert count_tokens("The heart pumps blood.") > 0
+
+
+class TestRetrieval:
+    """Tests for local passage retrieval."""
+    
+    def test_tokenize(self):
+        """Test stop word removal and plural folding."""
+        from app.retrieval import tokenize
+        assert tokenize("Where are the Lungs' lobes?") == ["lung", "lobe"]
+    
+    def test_search_ranks_relevant_passage_first(self):
+        """Test that the passage answering the question ranks first."""
+        from app.retrieval import passage_retriever
+        passages = passage_retriever.index.search("mitral valve", k=2)
+        assert passages[0].id == "heart-valves"
+        assert len(passages) <= 2
+    
+    def test_search_without_matching_terms(self):
+        """Test that unrelated queries retrieve nothing."""
+        from app.retrieval import passage_retriever
+        assert passage_retriever.index.search("quantum chromodynamics", k=3) == []
+    
+    def test_held_organ_passages_preferred(self):
+        """Test that deictic questions retrieve passages about the held organ."""
+        from app.retrieval import retrieve_passages
+        passages = retrieve_passages("How many lobes does this have?", "right_lung", get_organ_info("right_lung"), k=1)
+        assert [passage.id for passage in passages] == ["right-lung-lobes"]
+        assert retrieve_passages("How many lobes?", "right_lung", get_organ_info("right_lung"), k=0) == []
+    
+    @patch('app.routes.agent_executor')
+    def test_passages_injected_after_stable_prefix(self, mock_agent):
+        """Test that retrieved passages are sent in the human turn."""
+        mock_agent.ainvoke = AsyncMock(return_value={"output": "Answer.", "intermediate_steps": []})
+        client.post("/medtech/query", json={
+            "sessionID": "retrieval_session", "context": {"heldObject": "heart"}, "query": "What does the mitral valve do?"
+        })
+        agent_input = mock_agent.ainvoke.call_args[0][0]
+        assert agent_input["input"].startswith("Reference passages:\n[1] Heart valves:")
+        assert "Heart valves" not in agent_input["organ_context"]
+
+
+def _find_prompt(agent):
+    """Find the ChatPromptTemplate inside an agent engine."""
+    from langchain_core.prompts import ChatPromptTemplate
+    runnable = agent.chain if hasattr(agent, "chain") else agent.agent.runnable
+    for step in runnable.steps:
+        if isinstance(step, ChatPromptTemplate):
+            return step
+    raise AssertionError("No prompt template found")
+
+
 class TestModels:
     """Tests for Pydantic models."""
     
@@ -178,6 +1391,741 @@ class TestModels:
         assert response.actions == []
 
 
+class TestSerialization:
+    """Tests for one-pass response encoding and MessagePack negotiation."""
+
+    def test_negotiate(self):
+        """Test that MessagePack is chosen only when the client prefers it."""
+        pytest.importorskip("ormsgpack")
+        from app.serialization import negotiate, MEDIA_JSON, MEDIA_MSGPACK
+        assert negotiate(None) == MEDIA_JSON
+        assert negotiate("*/*") == MEDIA_JSON
+        assert negotiate("application/msgpack") == MEDIA_MSGPACK
+        assert negotiate("application/x-msgpack, application/json;q=0.5") == MEDIA_MSGPACK
+        assert negotiate("application/json, application/msgpack;q=0.5") == MEDIA_JSON
+        assert negotiate("application/msgpack;q=0") == MEDIA_JSON
+
+    def test_unknown_organ_template_matches_encoding(self):
+        """Test that the pre-encoded unknown-organ error equals encoding the response model."""
+        from app.serialization import (
+            encode, encode_unknown_organ, msgpack_available, unknown_organ_response, MEDIA_JSON, MEDIA_MSGPACK
+        )
+        media_types = [MEDIA_JSON] + ([MEDIA_MSGPACK] if msgpack_available() else [])
+        for media_type in media_types:
+            for organ_id in ["scalpel", 'quote"and\\slash\n', "héart", "x" * 70000]:
+                assert encode_unknown_organ(organ_id, media_type) == encode(unknown_organ_response(organ_id), media_type)
+        body = json.loads(encode_unknown_organ("scalpel"))
+        assert body["displayText"] == "Error: Organ with ID 'scalpel' not found."
+        assert body["actions"] == []
+
+    def test_msgpack_response(self):
+        """Test that the query endpoint answers in MessagePack when asked and in JSON by default."""
+        ormsgpack = pytest.importorskip("ormsgpack")
+        payload = {"sessionID": "msgpack_session", "context": {"heldObject": "heart"}, "query": "Where does this go?"}
+        json_response = client.post("/medtech/query", json=payload)
+        assert json_response.headers["content-type"] == "application/json"
+        assert json_response.headers["X-MeXR-Served-By"] == "fast-path"
+
+        response = client.post("/medtech/query", json=payload, headers={"Accept": "application/msgpack"})
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "application/msgpack"
+        assert response.headers["Vary"] == "Accept"
+        assert response.headers["X-MeXR-Served-By"] == "fast-path"
+        assert ormsgpack.unpackb(response.content) == json_response.json()
+
+        unknown = client.post("/medtech/query", headers={"Accept": "application/msgpack"},
+                              json={**payload, "context": {"heldObject": "scalpel"}})
+        assert ormsgpack.unpackb(unknown.content)["displayText"] == "Error: Organ with ID 'scalpel' not found."
+
+
+class TestStartup:
+    """Tests for lazy startup, warm-up and readiness."""
+    
+    def test_agent_created_on_first_use(self):
+        """Test that the agent is built lazily and reused."""
+        import app.routes as routes
+        sentinel = object()
+        with patch.object(routes, "agent_executor", None), patch.object(routes, "create_agent", return_value=sentinel) as create:
+            assert routes.get_agent() is sentinel
+            assert routes.get_agent() is sentinel
+        create.assert_called_once()
+    
+    def test_missing_api_key_fails_at_agent_creation(self):
+        """Test that a missing key is reported when the agent is built, not at import."""
+        from app.agent import create_agent
+        with patch("app.agent.OPENAI_API_KEY", None):
+            with pytest.raises(ValueError, match="OPENAI_API_KEY"):
+                create_agent()
+    
+    @pytest.mark.asyncio
+    async def test_warm_up_records_failures(self):
+        """Test that a failed warm-up step keeps the app not ready."""
+        from app.startup import StartupState, warm_up
+        
+        def broken():
+            raise RuntimeError("no connection")
+        
+        state = StartupState()
+        state.record_imports()
+        await warm_up(state, {"index": lambda: None, "agent": broken})
+        stats = state.stats()
+        assert stats["ready"] is False
+        assert stats["components"] == {"index": True, "agent": False}
+        assert "no connection" in stats["errors"]["agent"]
+        
+        await warm_up(state, {"agent": lambda: None})
+        assert state.ready and state.stats()["time_to_ready_seconds"] > 0
+    
+    def test_ready_endpoint_after_warm_up(self):
+        """Test that /ready reports 200 once the lifespan warm-up has finished."""
+        import time
+        with TestClient(app) as lifespan_client:
+            for _ in range(200):
+                response = lifespan_client.get("/ready")
+                if response.status_code == 200:
+                    break
+                time.sleep(0.05)
+        data = response.json()
+        assert response.status_code == 200
+        assert data["components"] == {
+            "knowledge_base": True, "prompts": True, "answer_pack": True, "retrieval": True, "agent": True
+        }
+        assert data["import_seconds"] > 0
+
+
+class TestMetrics:
+    """Tests for the Prometheus metrics."""
+    
+    def test_render_text_format(self):
+        """Test counter and histogram rendering."""
+        from app.metrics import Counter, Histogram, MetricsRegistry
+        registry = MetricsRegistry()
+        counter = registry.register(Counter("test_total", "A counter.", ("route",)))
+        histogram = registry.register(Histogram("test_seconds", "A histogram.", buckets=(0.1, 1.0)))
+        counter.labels('/a"b').inc()
+        counter.labels('/a"b').inc(2)
+        histogram.labels().observe(0.5)
+        histogram.labels().observe(5)
+        
+        lines = registry.render().splitlines()
+        assert "# TYPE test_total counter" in lines
+        assert 'test_total{route="/a\\"b"} 3' in lines
+        assert 'test_seconds_bucket{le="0.1"} 0' in lines
+        assert 'test_seconds_bucket{le="1"} 1' in lines
+        assert 'test_seconds_bucket{le="+Inf"} 2' in lines
+        assert "test_seconds_sum 5.5" in lines
+        assert "test_seconds_count 2" in lines
+    
+    def test_query_stages_exposed(self):
+        """Test that a query records its stages and serving path by route and organ."""
+        client.post("/medtech/query", json={
+            "sessionID": "metrics_session", "context": {"heldObject": "liver"}, "query": "Where does this go?"
+        })
+        response = client.get("/metrics")
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/plain")
+        text = response.text
+        assert 'mexr_queries_total{route="/medtech/query",organ="liver",served_by="fast-path"}' in text
+        for stage in ("validation", "kb_lookup", "history_update", "serialization"):
+            assert f'mexr_stage_duration_seconds_count{{stage="{stage}",route="/medtech/query",organ="liver"}}' in text
+    
+    def test_callback_records_llm_and_tool_calls(self):
+        """Test that LLM calls, token usage and tool calls are counted for the current query."""
+        import contextvars
+        from langchain_core.language_models.fake_chat_models import FakeMessagesListChatModel
+        from app import metrics
+        
+        llm = FakeMessagesListChatModel(
+            responses=[AIMessage(content="Hi", usage_metadata={"input_tokens": 30, "output_tokens": 2, "total_tokens": 32})],
+            callbacks=[metrics.agent_metrics]
+        )
+        tool = highlight_object.model_copy(update={"callbacks": [metrics.agent_metrics]})
+        
+        def run():
+            metrics.set_organ("stomach")
+            llm.invoke("Hello")
+            tool.invoke({"target_id": "socket_stomach"})
+            return metrics.current_query().llm_calls
+        
+        assert contextvars.copy_context().run(run) == 1
+        labels = ("unmatched", "stomach")
+        assert metrics.LLM_TOKENS.labels(*labels, "prompt").value >= 30
+        assert metrics.TOOL_CALLS.labels(*labels, "highlight_object").value >= 1
+        assert metrics.STAGE_DURATION.labels("llm", *labels).count >= 1
+
+
+class TestLogging:
+    """Tests for structured logging."""
+    
+    def test_json_record_carries_request_context(self):
+        """Test that records are formatted as JSON with request and session IDs."""
+        import contextvars
+        import json
+        import logging
+        from app.logs import ContextFilter, JsonFormatter, bind_session, request_id_var
+        
+        def make_record():
+            request_id_var.set("req-1")
+            bind_session("session-1")
+            record = logging.LogRecord("app.test", logging.INFO, __file__, 1, "Answered %s", ("query",), None)
+            record.served_by = "cache"
+            ContextFilter().filter(record)
+            return record
+        
+        entry = json.loads(JsonFormatter().format(contextvars.copy_context().run(make_record)))
+        assert entry["message"] == "Answered query"
+        assert entry["level"] == "INFO"
+        assert entry["request_id"] == "req-1"
+        assert entry["session_id"] == "session-1"
+        assert entry["served_by"] == "cache"
+    
+    def test_request_id_header(self):
+        """Test that the client's request ID is echoed and one is generated otherwise."""
+        response = client.get("/health", headers={"X-Request-ID": "trace-123"})
+        assert response.headers["X-Request-ID"] == "trace-123"
+        assert len(client.get("/health").headers["X-Request-ID"]) == 32
+    
+    def test_agent_trace_only_for_sampled_requests(self, caplog):
+        """Test that agent traces are logged only when the request is sampled."""
+        import contextvars
+        import logging
+        from langchain_core.language_models.fake_chat_models import FakeListChatModel
+        from app.logs import agent_trace_logger, trace_sampled_var
+        
+        llm = FakeListChatModel(responses=["Traced", "Not traced"], callbacks=[agent_trace_logger])
+        
+        def run(sampled):
+            trace_sampled_var.set(sampled)
+            llm.invoke("Hello")
+        
+        with caplog.at_level(logging.INFO, logger="app.logs"):
+            contextvars.copy_context().run(run, True)
+            contextvars.copy_context().run(run, False)
+        traces = [record for record in caplog.records if getattr(record, "trace", None)]
+        assert [record.trace for record in traces] == ["llm_start", "llm_end"]
+        assert traces[1].output[0]["text"] == "Traced"
+    
+    def test_agent_not_verbose_by_default(self):
+        """Test that the chain trace is not printed to stdout by default."""
+        from app.agent import create_agent
+        assert create_agent("executor").verbose is False
+
+
+class TestResilience:
+    """Tests for latency deadlines, the knowledge base fallback and the circuit breaker."""
+
+    @staticmethod
+    def _breaker(**kwargs):
+        from app.resilience import CircuitBreaker
+        now = [0.0]
+        options = dict(window_seconds=30, min_calls=4, failure_rate=0.5, slow_call_seconds=5,
+                       slow_call_rate=0.8, open_seconds=10, clock=lambda: now[0])
+        options.update(kwargs)
+        return CircuitBreaker("test", **options), now
+
+    def test_breaker_opens_and_recovers(self):
+        """Test that failures open the breaker and a successful trial closes it again."""
+        breaker, now = self._breaker()
+        for succeeded in (True, False, True, False):
+            assert breaker.allow()
+            breaker.record(succeeded, 0.1)
+        assert breaker.state == "open"
+        assert not breaker.allow()
+
+        now[0] = 10
+        assert breaker.state == "half_open"
+        assert breaker.allow()
+        assert not breaker.allow()
+        breaker.record(True, 0.1)
+        assert breaker.state == "closed"
+
+    def test_slow_calls_open_breaker(self):
+        """Test that a mostly slow upstream opens the breaker and a slow trial keeps it open."""
+        breaker, now = self._breaker()
+        for _ in range(4):
+            breaker.record(True, 6.0)
+        assert breaker.state == "open"
+        now[0] = 10
+        assert breaker.allow()
+        breaker.record(True, 6.0)
+        assert breaker.state == "open"
+
+    def test_fallback_answer(self):
+        """Test that the fallback describes the organ and highlights its socket."""
+        from app.intent import fallback_answer
+        liver = get_organ_info("liver")
+        answer = fallback_answer(liver)
+        assert liver["description"] in answer["displayText"]
+        assert answer["actions"] == [highlight_object.invoke({"target_id": "socket_liver"})]
+
+    @patch('app.routes.QUERY_DEADLINE_SECONDS', 0.05)
+    @patch('app.routes.agent_executor')
+    def test_deadline_cancels_agent_and_falls_back(self, mock_agent):
+        """Test that an agent run past the deadline is cancelled and the fallback is served."""
+        import asyncio
+        from app.session import session_manager
+        cancelled = []
+        async def stalled(agent_input):
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+        mock_agent.ainvoke = AsyncMock(side_effect=stalled)
+
+        response = client.post("/medtech/query", json={
+            "sessionID": "deadline_session", "context": {"heldObject": "heart"}, "query": "Why does it beat?"
+        })
+        assert response.status_code == 200
+        assert response.headers["X-MeXR-Served-By"] == "fallback"
+        assert response.json()["actions"][0]["targetID"] == "socket_heart"
+        assert cancelled == [True]
+        assert len(session_manager.get_history("deadline_session")) == 2
+        assert 'reason="deadline"' in client.get("/metrics").text
+
+    @patch('app.routes.agent_executor')
+    def test_open_breaker_skips_agent(self, mock_agent):
+        """Test that queries go straight to the fallback while the breaker is open."""
+        from app.resilience import llm_breaker
+        mock_agent.ainvoke = AsyncMock()
+        with patch.object(llm_breaker, "allow", return_value=False):
+            response = client.post("/medtech/query", json={
+                "sessionID": "breaker_session", "context": {"heldObject": "liver"}, "query": "What does it filter?"
+            })
+        assert response.headers["X-MeXR-Served-By"] == "fallback"
+        mock_agent.ainvoke.assert_not_called()
+        assert 'reason="circuit_open"' in client.get("/metrics").text
+        assert 'mexr_circuit_breaker_state{breaker="llm"} 0' in client.get("/metrics").text
+
+    @patch('app.routes.QUERY_DEADLINE_SECONDS', 0.05)
+    @patch('app.routes.agent_executor')
+    def test_stream_deadline_before_first_event(self, mock_agent):
+        """Test that a stream with no agent event before the deadline serves the fallback."""
+        import asyncio
+        async def stalled_events(agent_input, version):
+            await asyncio.sleep(5)
+            yield {"event": "on_chain_end", "parent_ids": [], "data": {"output": {"output": "Too late."}}}
+        mock_agent.astream_events = stalled_events
+
+        response = client.post("/medtech/query/stream", json={
+            "sessionID": "stream_deadline", "context": {"heldObject": "stomach"}, "query": "How does it digest?"
+        })
+        events = parse_sse(response.text)
+        assert events[0] == ("action", highlight_object.invoke({"target_id": "socket_stomach"}))
+        assert events[-1][0] == "done"
+        assert "Stomach" in events[-1][1]["displayText"]
+
+
+    @patch('app.routes.QUERY_DEADLINE_SECONDS', 0.2)
+    @patch('app.routes.agent_executor')
+    def test_stream_deadline_after_first_event(self, mock_agent):
+        """Test that a stream stalling after it started sending is cut off at the deadline with the fallback."""
+        import asyncio
+        async def stalling_events(agent_input, version):
+            yield {"event": "on_chat_model_stream", "run_id": "r1",
+                   "data": {"chunk": AIMessageChunk(content="The stomach churns food with strong muscular waves. It also ")}}
+            await asyncio.sleep(5)
+            yield {"event": "on_chain_end", "parent_ids": [], "data": {"output": {"output": "Too late."}}}
+        mock_agent.astream_events = stalling_events
+
+        response = client.post("/medtech/query/stream", json={
+            "sessionID": "stream_stall", "context": {"heldObject": "stomach"}, "query": "How does it digest?"
+        })
+        events = parse_sse(response.text)
+        texts = [payload["text"] for kind, payload in events if kind == "text"]
+        assert texts[0] == "The stomach churns food with strong muscular waves."
+        assert not any("It also" in text for text in texts)
+        assert events[-1][0] == "done"
+        assert "Stomach" in events[-1][1]["displayText"]
+        assert 'reason="deadline"' in client.get("/metrics").text
+
+    @patch('app.routes.agent_executor')
+    def test_upstream_error_falls_back(self, mock_agent):
+        """Test that a failed agent run is answered by the fallback instead of an error."""
+        mock_agent.ainvoke = AsyncMock(side_effect=RuntimeError("connection reset"))
+
+        response = client.post("/medtech/query", json={
+            "sessionID": "upstream_error", "context": {"heldObject": "heart"}, "query": "Why does it beat?"
+        })
+        assert response.status_code == 200
+        assert response.headers["X-MeXR-Served-By"] == "fallback"
+        assert response.json()["actions"][0]["targetID"] == "socket_heart"
+        assert 'reason="agent_error"' in client.get("/metrics").text
+
+
+class TestModelRouting:
+    """Tests for the complexity classifier and model tier routing."""
+
+    def test_complexity_scores(self):
+        """Test that factual questions score low and reasoning or clinical questions score high."""
+        from app.routing import score_complexity
+        for query in ("What does this organ do?", "How many chambers does it have?", "What is the function of the liver?"):
+            assert score_complexity(query) < 0.5, query
+        for query in ("Why is it shaped like this?", "How does the heart pump blood?",
+                      "What diseases commonly affect it?", "What is this made of and why does it need so much blood?"):
+            assert score_complexity(query) >= 0.5, query
+
+    def test_low_confidence_answers(self):
+        """Test that hedging or very short answers are flagged for escalation."""
+        from app.routing import is_low_confidence
+        assert is_low_confidence("I'm not sure which vessel that is.")
+        assert is_low_confidence("Yes.")
+        assert not is_low_confidence("The heart pumps blood through the body.")
+
+    @patch('app.routes.agent_executor')
+    def test_queries_routed_by_tier(self, mock_agent):
+        """Test that simple queries use the fast agent and hard ones the main agent."""
+        from app.routing import ModelRouter
+        router = ModelRouter(enabled=True, threshold=0.5, escalate=False)
+        fast_agent = Mock()
+        fast_agent.ainvoke = AsyncMock(return_value={"output": "It pumps blood around the body.", "intermediate_steps": []})
+        router.get_fast_agent(lambda model: fast_agent)
+        mock_agent.ainvoke = AsyncMock(return_value={"output": "Because of its four chambers.", "intermediate_steps": []})
+
+        with patch('app.routes.model_router', router):
+            simple = client.post("/medtech/query", json={
+                "sessionID": "tier_session", "context": {"heldObject": "heart"}, "query": "What does this organ do?"
+            })
+            hard = client.post("/medtech/query", json={
+                "sessionID": "tier_session", "context": {"heldObject": "heart"}, "query": "Why is it shaped like this?"
+            })
+        assert simple.json()["displayText"] == "It pumps blood around the body."
+        assert hard.json()["displayText"] == "Because of its four chambers."
+        stats = router.stats()["tiers"]
+        assert stats["fast"]["runs"] == 1 and stats["full"]["runs"] == 1
+        assert stats["fast"]["share"] == 0.5
+        assert 'mexr_model_tier_runs_total{route="/medtech/query",organ="heart",tier="fast"}' in client.get("/metrics").text
+
+    @patch('app.routes.agent_executor')
+    def test_low_confidence_answer_escalated(self, mock_agent):
+        """Test that a hedging fast-tier answer is rerun on the main agent."""
+        from app.routing import ModelRouter
+        router = ModelRouter(enabled=True, threshold=0.5, escalate=True)
+        fast_agent = Mock()
+        fast_agent.ainvoke = AsyncMock(return_value={"output": "I'm not sure about that.", "intermediate_steps": []})
+        router.get_fast_agent(lambda model: fast_agent)
+        mock_agent.ainvoke = AsyncMock(return_value={"output": "It stores glycogen and makes bile.", "intermediate_steps": []})
+
+        with patch('app.routes.model_router', router):
+            response = client.post("/medtech/query", json={
+                "sessionID": "escalate_session", "context": {"heldObject": "liver"}, "query": "What does this organ do?"
+            })
+        assert response.json()["displayText"] == "It stores glycogen and makes bile."
+        fast_agent.ainvoke.assert_awaited_once()
+        mock_agent.ainvoke.assert_awaited_once()
+        assert router.stats()["escalations"] == 1
+
+
+class TestPrefetch:
+    """Tests for speculative prefetch on grab."""
+
+    @staticmethod
+    def _slow_agent(mock_agent, delay=0.05):
+        import asyncio
+
+        async def answer(agent_input):
+            await asyncio.sleep(delay)
+            return {"output": "It pumps blood.", "intermediate_steps": []}
+        mock_agent.ainvoke = AsyncMock(side_effect=answer)
+
+    @pytest.mark.asyncio
+    @patch('app.routes.agent_executor')
+    async def test_query_after_grab_uses_speculative_answer(self, mock_agent):
+        """Test that a query arriving during the speculative run waits for it instead of running the agent again."""
+        import httpx
+        from app.prefetch import prefetcher
+        prefetcher.enabled = True
+        self._slow_agent(mock_agent)
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as async_client:
+            grab = await async_client.post("/medtech/context", json={
+                "sessionID": "prefetch_hit", "event": "grab", "context": {"heldObject": "heart"},
+            })
+            assert grab.json() == {"prefetch": "started"}
+            response = await async_client.post("/medtech/query", json={
+                "sessionID": "prefetch_hit", "context": {"heldObject": "heart"}, "query": "What does this do?",
+            })
+            assert response.headers["X-MeXR-Served-By"] == "cache"
+            assert response.json()["displayText"] == "It pumps blood."
+            stats = (await async_client.get("/medtech/prefetch/stats")).json()
+        assert mock_agent.ainvoke.await_count == 1
+        assert stats["hits"] == 1
+        assert stats["hit_rate"] == 1.0
+        assert stats["outcomes"]["prepared"] == 1
+
+    @pytest.mark.asyncio
+    @patch('app.routes.agent_executor')
+    async def test_release_cancels_speculative_run(self, mock_agent):
+        """Test that putting the organ down cancels the run and nothing is cached."""
+        import asyncio
+        from app.cache import response_cache
+        from app.prefetch import Prefetcher
+        from app.routes import _speculative_answer
+        from app.knowledge_base import get_organ_info
+        self._slow_agent(mock_agent, delay=5)
+        prefetcher = Prefetcher(max_runs_per_session=1)
+        assert prefetcher.grab("prefetch_release", "heart", get_organ_info("heart"), _speculative_answer) == "started"
+        await asyncio.sleep(0.01)
+        assert prefetcher.release("prefetch_release")
+        await asyncio.sleep(0.01)
+        assert prefetcher.stats()["outcomes"]["cancelled"] == 1
+        assert prefetcher.stats()["unused"] == 1
+        assert not response_cache.contains("heart", "What does this do?")
+        # The session's one speculative run is spent
+        assert prefetcher.grab("prefetch_release", "liver", get_organ_info("liver"), _speculative_answer) == "capped"
+
+    def test_context_event_validation(self):
+        """Test that grabs need a context and unknown objects start nothing."""
+        response = client.post("/medtech/context", json={"sessionID": "prefetch_events", "event": "grab"})
+        assert response.status_code == 422
+        response = client.post("/medtech/context", json={
+            "sessionID": "prefetch_events", "event": "grab", "context": {"heldObject": "scalpel"},
+        })
+        assert response.json() == {"prefetch": "unknown-organ"}
+        response = client.post("/medtech/context", json={"sessionID": "prefetch_events", "event": "release"})
+        assert response.json() == {"prefetch": "idle"}
+
+
+class TestAdmission:
+    """Tests for per-session and per-client rate limits and the agent slot queue."""
+
+    def test_token_bucket_refills(self):
+        """Test that an empty bucket refuses with Retry-After and refills over time."""
+        from app.admission import RateLimiter, AdmissionRejected
+        now = [0.0]
+        limiter = RateLimiter("session_rate", per_minute=30, burst=2, clock=lambda: now[0])
+        limiter.acquire("a")
+        limiter.acquire("a")
+        with pytest.raises(AdmissionRejected) as exc_info:
+            limiter.acquire("a")
+        assert exc_info.value.status_code == 429
+        assert exc_info.value.headers["Retry-After"] == "2"
+        limiter.acquire("b")
+
+        now[0] = 2
+        limiter.acquire("a")
+        assert limiter.stats()["rejected"] == 1
+
+    def test_token_bucket_weighted_acquire(self):
+        """Test that a multi-token charge is taken in full or not at all."""
+        from app.admission import RateLimiter, AdmissionRejected
+        now = [0.0]
+        limiter = RateLimiter("session_rate", per_minute=60, burst=5, clock=lambda: now[0])
+        limiter.acquire("a", 3)
+        with pytest.raises(AdmissionRejected) as exc_info:
+            limiter.acquire("a", 3)
+        assert exc_info.value.headers["Retry-After"] == "1"
+        limiter.acquire("a", 2)
+        assert limiter.stats()["allowed"] == 5
+
+    def test_rate_limiter_forgets_oldest_keys(self):
+        """Test that buckets beyond the key limit are dropped least recently used first."""
+        from app.admission import RateLimiter
+        limiter = RateLimiter("client_rate", per_minute=60, burst=1, max_keys=2)
+        for key in ("a", "b", "c"):
+            limiter.acquire(key)
+        assert limiter.stats()["keys"] == 2
+        limiter.acquire("a")
+
+    def test_queue_bounds_and_handoff(self):
+        """Test that waiters get freed slots in order and a full queue is refused at once."""
+        import asyncio
+        from app.admission import AdmissionController, AdmissionRejected
+        controller = AdmissionController(max_concurrent=1, max_queue=1, queue_timeout=1)
+        order = []
+
+        async def run(name, hold):
+            async with controller.slot() as admitted:
+                order.append((name, admitted))
+                await asyncio.sleep(hold)
+
+        async def scenario():
+            first = asyncio.create_task(run("first", 0.05))
+            await asyncio.sleep(0)
+            second = asyncio.create_task(run("second", 0))
+            await asyncio.sleep(0)
+            assert controller.waiting == 1
+            with pytest.raises(AdmissionRejected) as exc_info:
+                await run("third", 0)
+            assert exc_info.value.status_code == 503
+            assert exc_info.value.reason == "queue_full"
+            await asyncio.gather(first, second)
+
+        asyncio.run(scenario())
+        assert order == [("first", True), ("second", True)]
+        assert controller.stats()["in_flight"] == 0
+        assert controller.stats()["waiting"] == 0
+
+    def test_queue_timeout_and_budget(self):
+        """Test that a wait past the queue timeout is refused but one past the query budget falls back."""
+        import asyncio
+        from app.admission import AdmissionController, AdmissionRejected
+        controller = AdmissionController(max_concurrent=1, max_queue=4, queue_timeout=0.05)
+
+        async def scenario():
+            async with controller.slot():
+                with pytest.raises(AdmissionRejected) as exc_info:
+                    async with controller.slot():
+                        pass
+                assert exc_info.value.reason == "queue_timeout"
+                async with controller.slot(max_wait=0.01) as admitted:
+                    assert admitted is False
+            async with controller.slot() as admitted:
+                assert admitted is True
+
+        asyncio.run(scenario())
+        assert controller.stats()["admitted"] == 2
+
+    @patch('app.routes.agent_executor')
+    def test_session_rate_limit_returns_429(self, mock_agent):
+        """Test that agent queries past the session's burst get 429 while fast-path answers still work."""
+        from app.admission import RateLimiter
+        mock_agent.ainvoke = AsyncMock(return_value={"output": "It pumps blood.", "intermediate_steps": []})
+        limiter = RateLimiter("session_rate", per_minute=1, burst=1)
+        payload = {"sessionID": "rate_session", "context": {"heldObject": "heart"}}
+        with patch('app.admission.session_rate_limiter', limiter):
+            assert client.post("/medtech/query", json={**payload, "query": "Why does it beat?"}).status_code == 200
+            response = client.post("/medtech/query", json={**payload, "query": "How big is it?"})
+            assert response.status_code == 429
+            assert int(response.headers["Retry-After"]) >= 1
+            assert client.post("/medtech/query", json={**payload, "query": "Where does this go?"}).status_code == 200
+            stream = client.post("/medtech/query/stream", json={**payload, "query": "What does it weigh?"})
+            assert stream.status_code == 429
+        assert mock_agent.ainvoke.call_count == 1
+        assert 'mexr_admission_rejections_total{reason="session_rate"}' in client.get("/metrics").text
+
+    @patch('app.routes.agent_executor')
+    def test_full_queue_returns_503(self, mock_agent):
+        """Test that HTTP and WebSocket queries are refused with a retry hint while the queue is full."""
+        from app.admission import AdmissionController
+        mock_agent.ainvoke = AsyncMock()
+        controller = AdmissionController(max_concurrent=1, max_queue=0)
+        controller.in_flight = 1
+        with patch('app.routes.llm_admission', controller):
+            response = client.post("/medtech/query", json={
+                "sessionID": "busy_session", "context": {"heldObject": "liver"}, "query": "What does it filter?"
+            })
+            assert response.status_code == 503
+            assert "Retry-After" in response.headers
+            with client.websocket_connect("/medtech/ws/busy_session") as websocket:
+                websocket.send_json({"type": "query", "context": {"heldObject": "liver"}, "query": "What does it store?"})
+                message = websocket.receive_json()
+        assert message["type"] == "error"
+        assert message["retryAfter"] >= 1
+        mock_agent.ainvoke.assert_not_called()
+        stats = client.get("/medtech/admission/stats").json()
+        assert set(stats) == {"agent_slots", "session_rate_limit", "client_rate_limit"}
+
+
+class TestFakeOpenAI:
+    """Tests for the benchmark stand-in for the OpenAI API."""
+    
+    @pytest.fixture
+    def fake_client(self):
+        import os
+        import sys
+        import httpx
+        sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), "benchmarks"))
+        from fake_openai import FakeLLMConfig, create_app
+        fake_app = create_app(FakeLLMConfig(latency_ms=0, token_latency_ms=0, jitter_ms=0, tool_call_rate=1.0))
+        return httpx.AsyncClient(transport=httpx.ASGITransport(app=fake_app), base_url="http://fake")
+    
+    @pytest.mark.asyncio
+    async def test_tool_call_then_answer(self, fake_client):
+        """Test that a turn requests the highlight tool and then answers after the tool result."""
+        from app.prompts import get_organ_prompt_block
+        tools = [{"type": "function", "function": {"name": "highlight_object", "parameters": {}}}]
+        messages = [
+            {"role": "system", "content": get_organ_prompt_block("liver", get_organ_info("liver"))},
+            {"role": "user", "content": "What does this do?"},
+        ]
+        async with fake_client:
+            first = (await fake_client.post("/v1/chat/completions", json={"messages": messages, "tools": tools})).json()
+            call = first["choices"][0]["message"]["tool_calls"][0]
+            assert json.loads(call["function"]["arguments"]) == {"target_id": "socket_liver"}
+            
+            messages += [first["choices"][0]["message"], {"role": "tool", "tool_call_id": call["id"], "content": "{}"}]
+            second = (await fake_client.post("/v1/chat/completions", json={
+                "messages": messages, "tools": tools, "stream": True, "stream_options": {"include_usage": True}
+            })).text
+        chunks = [json.loads(line[6:]) for line in second.splitlines() if line.startswith("data: {")]
+        text = "".join(c["choices"][0]["delta"].get("content") or "" for c in chunks if c["choices"])
+        assert "Liver" in text
+        assert chunks[-1]["usage"]["prompt_tokens"] > 0
+        assert second.rstrip().endswith("data: [DONE]")
+
+
+class TestLLMHttpClient:
+    """Tests for the shared LLM HTTP client."""
+
+    @staticmethod
+    def _transport(handler, **kwargs):
+        import httpx
+        from app.http_client import RetryTransport
+        return RetryTransport(httpx.MockTransport(handler), backoff=0, **kwargs)
+
+    @pytest.mark.asyncio
+    async def test_retries_server_errors(self):
+        """Test that a 503 is retried, honouring Retry-After, and the retry is counted."""
+        import httpx
+        statuses = iter([503, 200])
+        def handler(request):
+            return httpx.Response(next(statuses), headers={"Retry-After": "0"}, json={})
+        transport = self._transport(handler, max_retries=2)
+        async with httpx.AsyncClient(transport=transport) as client:
+            response = await client.post("http://llm/v1/chat/completions", json={})
+        assert response.status_code == 200
+        assert (transport.requests, transport.retries, transport.failures, transport.in_flight) == (1, 1, 0, 0)
+
+    @pytest.mark.asyncio
+    async def test_gives_up_after_max_retries(self):
+        """Test that connection errors are retried up to the limit and then raised."""
+        import httpx
+        attempts = []
+        def handler(request):
+            attempts.append(request)
+            raise httpx.ConnectError("refused", request=request)
+        transport = self._transport(handler, max_retries=2)
+        async with httpx.AsyncClient(transport=transport) as client:
+            with pytest.raises(httpx.ConnectError):
+                await client.get("http://llm/v1/models")
+        assert len(attempts) == 3
+        assert transport.failures == 1
+
+    @pytest.mark.asyncio
+    async def test_closed_stream_is_drained(self):
+        """Test that the unread tail of a closed response is read so the connection can be reused."""
+        import httpx
+        from app.http_client import DrainingStream
+        read = []
+        class Body(httpx.AsyncByteStream):
+            async def __aiter__(self):
+                for chunk in (b"data: [DONE]\n\n", b""):
+                    read.append(chunk)
+                    yield chunk
+        stream = DrainingStream(Body())
+        async for _ in stream:
+            break
+        await stream.aclose()
+        assert read == [b"data: [DONE]\n\n", b""]
+
+    def test_agent_uses_shared_client(self):
+        """Test that the model is created on the shared client without its own retries."""
+        from app.agent import create_agent
+        from app.http_client import llm_http_client
+        with patch("langchain_openai.ChatOpenAI") as chat_model:
+            create_agent("structured")
+        kwargs = chat_model.call_args.kwargs
+        assert kwargs["http_async_client"] is llm_http_client.get()
+        assert kwargs["max_retries"] == 0
+
+    def test_pool_stats_endpoint(self):
+        """Test the LLM connection pool statistics endpoint."""
+        client = TestClient(app)
+        stats = client.get("/medtech/llm/pool/stats").json()
+        assert {"requests", "retries", "connections", "idle_connections", "max_connections"} <= set(stats)
+
+
 class TestAPIEndpoints:
     """Tests for API endpoints."""
     
@@ -245,6 +2193,41 @@ class TestAPIEndpoints:
         assert "invalid_organ" in data["displayText"]
         assert data["actions"] == []
     
+    @patch('app.routes.agent_executor')
+    def test_query_endpoint_fast_path(self, mock_agent):
+        """Test that placement questions are answered without the agent."""
+        mock_agent.ainvoke = AsyncMock()
+        request_data = {
+            "sessionID": "fast_path_session",
+            "context": {"heldObject": "left_lung"},
+            "query": "Where does this go?"
+        }
+        
+        response = client.post("/medtech/query", json=request_data)
+        assert response.status_code == 200
+        assert response.headers["X-MeXR-Served-By"] == "fast-path"
+        assert response.json()["actions"][0]["targetID"] == "socket_left_lung"
+        mock_agent.ainvoke.assert_not_called()
+    
+    @patch('app.routes.agent_executor')
+    def test_query_endpoint_agent_path(self, mock_agent):
+        """Test that other questions are routed to the agent."""
+        mock_agent.ainvoke = AsyncMock(return_value={
+            "output": "The heart has four chambers.",
+            "intermediate_steps": []
+        })
+        request_data = {
+            "sessionID": "agent_path_session",
+            "context": {"heldObject": "heart"},
+            "query": "How many chambers does it have?"
+        }
+        
+        response = client.post("/medtech/query", json=request_data)
+        assert response.status_code == 200
+        assert response.headers["X-MeXR-Served-By"] == "agent"
+        assert response.json()["displayText"] == "The heart has four chambers."
+        mock_agent.ainvoke.assert_awaited_once()
+    
     def test_query_endpoint_missing_fields(self):
         """Test query endpoint with missing required fields."""
         request_data = {